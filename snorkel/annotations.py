@@ -1,26 +1,51 @@
+import hashlib
+import inspect
 import numpy as np
+import os
+import re
+import shutil
+import sys
+import sysconfig
+import warnings
 from pandas import DataFrame, Series
 import scipy.sparse as sparse
-from sqlalchemy.sql import bindparam, select
+from six import (
+    StringIO, binary_type, get_function_closure, get_function_code, get_function_defaults,
+    integer_types, text_type
+)
+from sqlalchemy.orm import joinedload, with_polymorphic
+from sqlalchemy.sql import bindparam, select, text
 
 from .features import get_span_feats
 from .models import (
     GoldLabel, GoldLabelKey, Label, LabelKey, Feature, FeatureKey, Candidate,
-    Marginal
+    Span, LFFingerprint, Marginal, get_table_version, bump_table_version,
+    get_database_token
 )
-from .models.meta import new_sessionmaker
+from .models.meta import new_sessionmaker, snorkel_postgres
 from .udf import UDF, UDFRunner
-from .utils import (
-    matrix_conflicts,
-    matrix_coverage,
-    matrix_overlaps,
-    matrix_tp,
-    matrix_fp,
-    matrix_fn,
-    matrix_tn
-)
+from .utils import matrix_stats
 from future.utils import iteritems
 
+
+# Number of candidates loaded and annotated together by each AnnotatorUDF.apply call;
+# also the max number of ids per IN clause when loading them and their Spans
+# Note: Must stay below SQLite's limit of 999 parameters per query
+ANNOTATION_CHUNK_SIZE = 500
+
+# Number of annotations buffered by AnnotatorUDF.reduce before being written in bulk
+ANNOTATION_BUFFER_SIZE = 50000
+
+# Max number of AnnotationKey names per IN clause when resolving key ids
+KEY_SELECT_BATCH_SIZE = 500
+
+# Number of rows fetched at a time when streaming annotations in load_matrix
+LOAD_CHUNK_SIZE = 100000
+
+# Default directory for annotation matrices cached by load_matrix
+MATRIX_CACHE_DIR = 'matrix_cache'
+
+
 class csr_AnnotationMatrix(sparse.csr_matrix):
     """
     An extension of the scipy.sparse.csr_matrix class for holding sparse annotation matrices
@@ -112,26 +137,24 @@ try:
             lf_names = [self.get_key(session, j).name for j in range(self.shape[1])]
 
             # Default LF stats
+            ls = None
+            if labels is not None:
+                ls = np.ravel(labels.todense() if sparse.issparse(labels) else labels)
+            stats = matrix_stats(self, ls)
             col_names = ['j', 'Coverage', 'Overlaps', 'Conflicts']
             d = {
                 'j'         : range(self.shape[1]),
-                'Coverage'  : Series(data=matrix_coverage(self), index=lf_names),
-                'Overlaps'  : Series(data=matrix_overlaps(self), index=lf_names),
-                'Conflicts' : Series(data=matrix_conflicts(self), index=lf_names)
+                'Coverage'  : Series(data=stats['coverage'], index=lf_names),
+                'Overlaps'  : Series(data=stats['overlaps'], index=lf_names),
+                'Conflicts' : Series(data=stats['conflicts'], index=lf_names)
             }
             if labels is not None:
                 col_names.extend(['TP', 'FP', 'FN', 'TN', 'Empirical Acc.'])
-                ls = np.ravel(labels.todense() if sparse.issparse(labels) else labels)
-                tp = matrix_tp(self, ls)
-                fp = matrix_fp(self, ls)
-                fn = matrix_fn(self, ls)
-                tn = matrix_tn(self, ls)
-                ac = (tp+tn).astype(float) / (tp+tn+fp+fn)
-                d['Empirical Acc.'] = Series(data=ac, index=lf_names)
-                d['TP']             = Series(data=tp, index=lf_names)
-                d['FP']             = Series(data=fp, index=lf_names)
-                d['FN']             = Series(data=fn, index=lf_names)
-                d['TN']             = Series(data=tn, index=lf_names)
+                d['Empirical Acc.'] = Series(data=stats['accuracy'], index=lf_names)
+                d['TP']             = Series(data=stats['tp'], index=lf_names)
+                d['FP']             = Series(data=stats['fp'], index=lf_names)
+                d['FN']             = Series(data=stats['fn'], index=lf_names)
+                d['TN']             = Series(data=stats['tn'], index=lf_names)
 
             if est_accs is not None:
                 col_names.append('Learned Acc.')
@@ -147,7 +170,12 @@ except:
 
 
 class Annotator(UDFRunner):
-    """Abstract class for annotating candidates and persisting these annotations to DB"""
+    """
+    Abstract class for annotating candidates and persisting these annotations to DB
+
+    If apply is given a SentenceStore as sentence_store, the Sentences of the candidates
+    are read from its file rather than from the DB.
+    """
     def __init__(self, annotation_class, annotation_key_class, f_gen):
         self.annotation_class     = annotation_class
         self.annotation_key_class = annotation_key_class
@@ -168,21 +196,41 @@ class Annotator(UDFRunner):
         cids_query = cids_query or session.query(Candidate.id)\
                                           .filter(Candidate.split == split)
 
-        # Note: In the current UDFRunner implementation, we load all these into memory and fill a
+        # Note: Unless batch_size is set, the UDFRunner loads all these into memory and fills a
         # multiprocessing JoinableQueue with them before starting... so might as well load them here and pass in.
         # Also, if we try to pass in a query iterator instead, with AUTOCOMMIT on, we get a TXN error...
-        cids       = cids_query.all()
-        cids_count = len(cids)
+        # A checkpoint skips chunks by position, so the ids must come in the same order on resume
+        if kwargs.get('checkpoint') is not None:
+            cids = cids_query.order_by(Candidate.id).all()
+        else:
+            cids = cids_query.all()
 
         # Run the Annotator
-        super(Annotator, self).apply(cids, split=split, key_group=key_group,
-            replace_key_set=replace_key_set, cids_query=cids_query,
-            count=cids_count, **kwargs)
+        self._apply_chunks(cids, split=split, key_group=key_group,
+            replace_key_set=replace_key_set, cids_query=cids_query, **kwargs)
+
+        # Mark any cached matrices for this annotation class as stale
+        bump_table_version(session, self.annotation_class.__tablename__)
+        session.commit()
 
         # Load the matrix
         return self.load_matrix(session, split=split, cids_query=cids_query,
             key_group=key_group)
 
+    def _apply_chunks(self, cids, chunk_size=ANNOTATION_CHUNK_SIZE, batch_size=None,
+        **kwargs):
+        """
+        Runs the UDF over chunks of chunk_size candidate ids, so that each AnnotatorUDF
+        loads its candidates in bulk, and sends back each chunk's annotations at once.
+        A batch_size, if set, is still a number of candidates.
+        """
+        ids    = [cid[0] for cid in cids]
+        chunks = [ids[i:i+chunk_size] for i in range(0, len(ids), chunk_size)]
+        if batch_size is not None:
+            batch_size = max(1, batch_size // chunk_size)
+        super(Annotator, self).apply(chunks, count=len(chunks), batch_size=batch_size,
+            **kwargs)
+
     def clear(self, session, split=0, key_group=0, replace_key_set=True,
         cids_query=None, **kwargs):
         """
@@ -231,153 +279,387 @@ class AnnotatorUDF(UDF):
         # For caching key ids during the reduce step
         self.key_cache = {}
 
+        # For buffering annotations during the reduce step
+        self.anno_buffer = []
+        self.reduce_opts = None
+
         super(AnnotatorUDF, self).__init__(**kwargs)
 
-    def apply(self, cid, **kwargs):
+    def apply(self, cids, sentence_store=None, **kwargs):
         """
-        Applies a given function to a Candidate, yielding a set of Annotations as key_name, value pairs
+        Applies a given function to a chunk of Candidates, yielding their Annotations as a
+        single (candidate ids, key names, key name indexes, values) tuple of arrays
 
-        Note: Accepts a candidate _id_ as argument, because of issues with putting Candidate subclasses
-        into Queues (can't pickle...)
-        """
-        seen = set()
-        cid = cid[0]
-        c    = self.session.query(Candidate).filter(Candidate.id == cid).one()
-        for key_name, value in self.anno_generator(c):
+        If a SentenceStore is given, the Sentences of the Candidates are read from it
+        instead of from the database.
 
-            # Note: Make sure no duplicates emitted here!
-            if (cid, key_name) not in seen:
-                seen.add((cid, key_name))
-                yield cid, key_name, value
+        Note: Accepts a list of candidate _ids_ as argument, because of issues with putting
+        Candidate subclasses into Queues (can't pickle...)
+        """
+        row_cids, key_idxs, values = [], [], []
+        key_names, key_index = [], {}
+        for c in self._load_candidates(cids, sentence_store):
+            seen = set()
+            for key_name, value in self.anno_generator(c):
+
+                # Note: Make sure no duplicates emitted here!
+                if key_name not in seen:
+                    seen.add(key_name)
+                    if key_name not in key_index:
+                        key_index[key_name] = len(key_names)
+                        key_names.append(key_name)
+                    row_cids.append(c.id)
+                    key_idxs.append(key_index[key_name])
+                    values.append(value)
+        yield (np.array(row_cids, dtype=np.int64), key_names,
+            np.array(key_idxs, dtype=np.int32), np.array(values))
+
+    def _load_candidates(self, cids, sentence_store=None):
+        """
+        Loads the Candidates with the given ids, in order, along with their Span contexts
+        and the Sentences of these, using one query for each per ANNOTATION_CHUNK_SIZE
+        ids (or reading the Sentences from sentence_store, if given)
+        """
+        candidates = []
+        for i in range(0, len(cids), ANNOTATION_CHUNK_SIZE):
+            candidates.extend(self.session.query(with_polymorphic(Candidate, '*'))
+                                          .filter(Candidate.id.in_(cids[i:i+ANNOTATION_CHUNK_SIZE])).all())
+
+        # Once loaded into the session, the contexts are not queried again on access;
+        # a chunk of candidates can have up to (number of args) times as many contexts
+        context_ids = set()
+        for c in candidates:
+            context_ids.update(getattr(c, arg + '_id') for arg in c.__argnames__)
+        context_ids = sorted(context_ids)
+        spans = self.session.query(Span)
+        if sentence_store is None:
+            spans = spans.options(joinedload(Span.sentence))
+        for i in range(0, len(context_ids), ANNOTATION_CHUNK_SIZE):
+            spans.filter(Span.id.in_(context_ids[i:i+ANNOTATION_CHUNK_SIZE])).all()
+        if sentence_store is not None:
+            sentence_store.attach(candidates)
+
+        candidates = dict((c.id, c) for c in candidates)
+        return [candidates[cid] for cid in cids if cid in candidates]
 
     def reduce(self, y, clear, key_group, replace_key_set, **kwargs):
         """
-        Inserts Annotations into the database.
+        Buffers Annotations to be inserted into the database; the buffer is written
+        out in bulk by flush() whenever it is full, and before each commit.
+        """
+        self.reduce_opts = (clear, key_group, replace_key_set)
+        row_cids, key_names, key_idxs, values = y
+        self.anno_buffer.extend(zip(row_cids.tolist(),
+            [key_names[k] for k in key_idxs], values.tolist()))
+        if len(self.anno_buffer) >= ANNOTATION_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Inserts the buffered Annotations into the database.
         For Annotations with unseen AnnotationKeys (in key_group, if not None), either adds these
-        AnnotationKeys if create_new_keyset is True, else skips these Annotations.
+        AnnotationKeys if replace_key_set is True, else skips these Annotations.
         """
-        cid, key_name, value = y
-
-        # Prepares queries
-        # Annoation updating only needs to be done if clear=False
-        if not clear:
-            anno_update_query = self.annotation_class.__table__.update()
-            anno_update_query = anno_update_query.where(self.annotation_class.candidate_id == bindparam('cid'))
-            anno_update_query = anno_update_query.where(self.annotation_class.key_id == bindparam('kid'))
-            anno_update_query = anno_update_query.values(value=bindparam('value'))
-
-        # We only need to insert AnnotationKeys if replace_key_set=True
+        if len(self.anno_buffer) == 0:
+            return
+        clear, key_group, replace_key_set = self.reduce_opts
+
+        # Resolve the ids of all AnnotationKeys not already in the cache
+        # Note: New keys are inserted in order of first appearance, which sets the column order
+        key_names, seen = [], set()
+        for _, key_name, _ in self.anno_buffer:
+            if key_name not in seen and key_name not in self.key_cache:
+                seen.add(key_name)
+                key_names.append(key_name)
+        self._load_key_ids(key_names, key_group, replace_key_set)
+
+        # If AnnotationKey does not exist and replace_key_set = False, skip
+        rows = [
+            {'candidate_id': cid, 'key_id': self.key_cache[key_name], 'value': value}
+            for cid, key_name, value in self.anno_buffer if key_name in self.key_cache
+        ]
+        self.anno_buffer = []
+
+        # If the annotations were cleared, none can exist yet, so just insert
+        if clear:
+            rows = [row for row in rows if row['value'] != 0]
+            if snorkel_postgres:
+                self._copy_annotations(rows)
+            elif len(rows) > 0:
+                self.session.execute(self.annotation_class.__table__.insert(), rows)
+
+        # Else, update-or-insert as a single set-based upsert. As before, zero values
+        # only update existing Annotations, and are never inserted
+        else:
+            zero_rows = [row for row in rows if row['value'] == 0]
+            rows      = [row for row in rows if row['value'] != 0]
+            if len(zero_rows) > 0:
+                anno_update_query = self.annotation_class.__table__.update()
+                anno_update_query = anno_update_query.where(self.annotation_class.candidate_id == bindparam('cid'))
+                anno_update_query = anno_update_query.where(self.annotation_class.key_id == bindparam('kid'))
+                anno_update_query = anno_update_query.values(value=bindparam('value'))
+                self.session.execute(anno_update_query,
+                    [{'cid': row['candidate_id'], 'kid': row['key_id'], 'value': 0} for row in zero_rows])
+            if len(rows) > 0:
+                self.session.execute(self._get_upsert_query(), rows)
+
+    def _load_key_ids(self, key_names, key_group, replace_key_set):
+        """Loads the ids of AnnotationKeys into the cache, inserting new keys if replace_key_set"""
+        if len(key_names) == 0:
+            return
+        self._select_key_ids(key_names, key_group)
+
+        # Keys not in cache or DB; add to both if replace_key_set = True
         # Note that in current configuration, we never update AnnotationKeys!
         if replace_key_set:
-            key_insert_query = self.annotation_key_class.__table__.insert()
-
-        # If we are replacing the AnnotationKeys (replace_key_set=True), then we assume they will
-        # all have been handled by *this* reduce thread, and hence be in the cache already
-        # So we only need key select queries if replace_key_set=False
-        else:
-            key_select_query = select([self.annotation_key_class.id])\
-                                .where(self.annotation_key_class.name == bindparam('name'))
+            new_keys = [key_name for key_name in key_names if key_name not in self.key_cache]
+            if len(new_keys) > 0:
+                self.session.execute(self.annotation_key_class.__table__.insert(),
+                    [{'name': key_name, 'group': key_group or 0} for key_name in new_keys])
+                self._select_key_ids(new_keys, key_group)
+
+    def _select_key_ids(self, key_names, key_group):
+        """Selects the ids of the AnnotationKeys with the given names, in batches"""
+        for i in range(0, len(key_names), KEY_SELECT_BATCH_SIZE):
+            key_select_query = select([self.annotation_key_class.id, self.annotation_key_class.name])\
+                                .where(self.annotation_key_class.name.in_(key_names[i:i+KEY_SELECT_BATCH_SIZE]))
             if key_group is not None:
                 key_select_query = key_select_query.where(self.annotation_key_class.group == key_group)
+            for key_id, key_name in self.session.execute(key_select_query):
+                self.key_cache[key_name] = key_id
 
-        anno_insert_query = self.annotation_class.__table__.insert()
-
-        # Check if the AnnotationKey already exists, and gets its id
-        key_id = None
-        if key_name in self.key_cache:
-            key_id = self.key_cache[key_name]
+    def _get_upsert_query(self):
+        """Returns an INSERT query which replaces the value of an existing Annotation"""
+        table = self.annotation_class.__tablename__
+        if snorkel_postgres:
+            return text("""
+                INSERT INTO %s (candidate_id, key_id, value)
+                VALUES (:candidate_id, :key_id, :value)
+                ON CONFLICT (candidate_id, key_id) DO UPDATE SET value = EXCLUDED.value
+                """ % table)
         else:
-            key_args = {'name': key_name, 'group': key_group} if key_group else {'name': key_name}
-
-            # If we are replacing the AnnotationKeys (replace_key_set=True), then we assume they will
-            # all have been handled by *this* reduce thread, and hence be in the cache already
-            if not replace_key_set:
-                key_id = self.session.execute(key_select_query, key_args).first()
+            return text("""
+                INSERT OR REPLACE INTO %s (candidate_id, key_id, value)
+                VALUES (:candidate_id, :key_id, :value)
+                """ % table)
+
+    def _copy_annotations(self, rows):
+        """Inserts rows into the Annotation table using Postgres COPY"""
+        if len(rows) == 0:
+            return
+        buf = StringIO()
+        for row in rows:
+            buf.write("%s\t%s\t%s\n" % (row['candidate_id'], row['key_id'], row['value']))
+        buf.seek(0)
+        cursor = self.session.connection().connection.cursor()
+        cursor.copy_from(buf, self.annotation_class.__tablename__,
+            columns=('candidate_id', 'key_id', 'value'))
+        cursor.close()
+
+
+def _stream_query(session, query, chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Executes the query after flushing the session, yielding the result rows in
+    chunks of up to chunk_size rows.
+
+    The query runs on the session's own connection, so that it sees the session's
+    uncommitted writes. The exception is Postgres, where rows are streamed with a
+    server-side cursor, which needs to run within a transaction; since Snorkel's
+    Postgres sessions are in AUTOCOMMIT mode (see new_sessionmaker), they have no
+    uncommitted writes once flushed, and the cursor is opened on a separate
+    connection in a READ COMMITTED transaction.
+    """
+    session.flush()
+    if not snorkel_postgres:
+        result = session.connection().execute(query.statement)
+        try:
+            for rows in iter(lambda: result.fetchmany(chunk_size), []):
+                yield rows
+        finally:
+            result.close()
+        return
 
-            # Key not in cache but exists in DB; add to cache
-            if key_id is not None:
-                key_id                   = key_id[0]
-                self.key_cache[key_name] = key_id
+    conn = session.get_bind().connect()
+    try:
+        conn   = conn.execution_options(isolation_level='READ COMMITTED')
+        trans  = conn.begin()
+        result = conn.execution_options(stream_results=True).execute(query.statement)
+        for rows in iter(lambda: result.fetchmany(chunk_size), []):
+            yield rows
+        result.close()
+        trans.commit()
+    finally:
+        conn.close()
 
-            # Key not in cache or DB; add to both if create_new_keyset = True
-            elif replace_key_set:
-                key_id   = self.session.execute(key_insert_query, key_args).inserted_primary_key[0]
-                self.key_cache[key_name] = key_id
 
-        # If AnnotationKey does not exist and create_new_keyset = False, skip
-        if key_id is not None:
+def _load_ids(session, query):
+    """Returns the sorted, unique ids returned by a single-column query as an array"""
+    chunks = [np.array([row[0] for row in rows], dtype=np.int64)
+              for rows in _stream_query(session, query)]
+    return np.unique(np.concatenate(chunks)) if len(chunks) > 0 else np.empty(0, dtype=np.int64)
 
-            # Updates the Annotation, assuming one might already exist, if try_update = True
-            if not clear:
-                res = self.session.execute(anno_update_query, {'cid': cid, 'kid': key_id, 'value': value})
 
-            # If Annotation does not exist, insert
-            if (clear or res.rowcount == 0) and value != 0:
-                self.session.execute(anno_insert_query, {'candidate_id': cid, 'key_id': key_id, 'value': value})
+def _get_index_positions(ids, xs):
+    """
+    Returns the positions of the values xs in the sorted array ids, along with a mask
+    of which values of xs are present in ids
+    """
+    idxs = np.searchsorted(ids, xs)
+    mask = idxs < ids.shape[0]
+    mask[mask] = ids[idxs[mask]] == xs[mask]
+    return idxs, mask
 
 
 def load_matrix(matrix_class, annotation_key_class, annotation_class, session,
     split=0, cids_query=None, key_group=0, key_names=None, zero_one=False,
-    load_as_array=False):
+    load_as_array=False, cache=False, cache_dir=MATRIX_CACHE_DIR):
     """
     Returns the annotations corresponding to a split of candidates with N members
     and an AnnotationKey group with M distinct keys as an N x M CSR sparse matrix.
+
+    If cache=True, the matrix is also stored in cache_dir, keyed on the annotation
+    class, split, key group and key names, and subsequent loads memory-map it from
+    there as long as it was written from the same database, and the annotation and
+    candidate table versions are unchanged.
+    Note that the cache is bypassed when a cids_query is provided.
+
+    The table versions are only bumped by Snorkel's own writers: Annotator.apply,
+    CandidateExtractor.apply, CorpusParser.clear, reload_annotator_labels, labeling
+    in a Viewer and BratAnnotator.import_gold_labels. Annotations or candidates added,
+    changed or deleted otherwise, e.g. with session.add(GoldLabel(...)), must be
+    followed by bump_table_version(session, table_name), or by a load without cache.
     """
-    cid_query = cids_query or session.query(Candidate.id)\
-                                     .filter(Candidate.split == split)
-    cid_query = cid_query.order_by(Candidate.id)
+    # Try to load from the cache, reading the table versions *before* loading
+    cache = cache and cids_query is None
+    if cache:
+        cache_path = _get_cache_path(cache_dir, annotation_class, split, key_group,
+            key_names, zero_one)
+        versions = [get_database_token(session)] + \
+                   [get_table_version(session, table_name)
+                    for table_name in (annotation_class.__tablename__, Candidate.__tablename__)]
+        Xr = _load_cached_matrix(cache_path, versions, matrix_class, annotation_key_class)
+        if Xr is not None:
+            return np.squeeze(Xr.toarray()) if load_as_array else Xr
+
+    cids_query = cids_query or session.query(Candidate.id)\
+                                      .filter(Candidate.split == split)
 
     keys_query = session.query(annotation_key_class.id)
     keys_query = keys_query.filter(annotation_key_class.group == key_group)
     if key_names is not None:
         keys_query = keys_query.filter(annotation_key_class.name.in_(frozenset(key_names)))
-    keys_query = keys_query.order_by(annotation_key_class.id)
-
-    # First, we query to construct the row index map
-    cid_to_row = {}
-    row_to_cid = {}
-    for cid, in cid_query.all():
-        if cid not in cid_to_row:
-            j = len(cid_to_row)
-
-            # Create both mappings
-            cid_to_row[cid] = j
-            row_to_cid[j]   = cid
-
-    # Second, we query to construct the column index map
-    kid_to_col = {}
-    col_to_kid = {}
-    for kid, in keys_query.all():
-        if kid not in kid_to_col:
-            j = len(kid_to_col)
-
-            # Create both mappings
-            kid_to_col[kid] = j
-            col_to_kid[j]   = kid
-
-    # Create sparse matrix in LIL format for incremental construction
-    X = sparse.lil_matrix((len(cid_to_row), len(kid_to_col)), dtype=np.int64)
-
-    # NOTE: This is much faster as it allows us to skip the above join (which for some reason is
-    # unreasonably slow) by relying on our symbol tables from above; however this will get slower with
-    # The total number of annotations in DB which is weird behavior...
+
+    # First, we query to construct the row and column indexes, as sorted id arrays
+    cids = _load_ids(session, cids_query)
+    kids = _load_ids(session, keys_query)
+
+    # Then we stream only the annotations for candidates in the split, and map their
+    # ids to rows / columns by binary search over the sorted id arrays
     q = session.query(annotation_class.candidate_id, annotation_class.key_id, annotation_class.value)
-    q = q.order_by(annotation_class.candidate_id)
+    q = q.filter(annotation_class.candidate_id.in_(cids_query.subquery()))
+
+    # If only some keys are loaded, also select their annotations by key id, which
+    # leads the primary key, in batches of ids
+    if key_names is not None:
+        queries = [q.filter(annotation_class.key_id.in_(kids[i:i+KEY_SELECT_BATCH_SIZE].tolist()))
+                   for i in range(0, len(kids), KEY_SELECT_BATCH_SIZE)]
+    else:
+        queries = [q]
+    rows, cols, vals = [], [], []
+    for chunk in (chunk for q in queries for chunk in _stream_query(session, q)):
+        chunk_cids  = np.fromiter((row[0] for row in chunk), dtype=np.int64, count=len(chunk))
+        chunk_kids  = np.fromiter((row[1] for row in chunk), dtype=np.int64, count=len(chunk))
+        chunk_vals  = np.fromiter((row[2] for row in chunk), dtype=np.float64, count=len(chunk))
+        r, row_mask = _get_index_positions(cids, chunk_cids)
+        c, col_mask = _get_index_positions(kids, chunk_kids)
+        mask        = row_mask & col_mask
+        rows.append(r[mask])
+        cols.append(c[mask])
+        vals.append(chunk_vals[mask])
+
+    if len(rows) > 0:
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+    else:
+        rows = cols = np.empty(0, dtype=np.int64)
+        vals = np.empty(0, dtype=np.float64)
 
-    # Iteratively construct row index and output sparse matrix
-    for cid, kid, val in q.all():
-        if cid in cid_to_row and kid in kid_to_col:
-            # Optionally restricts val range to {0,1}, mapping -1 -> 0
-            if zero_one:
-                val = 1 if val == 1 else 0
-            X[cid_to_row[cid], kid_to_col[kid]] = int(val)
+    # Optionally restricts val range to {0,1}, mapping -1 -> 0
+    if zero_one:
+        vals = np.where(vals == 1, 1, 0)
+
+    # Build the CSR matrix directly from the COO arrays
+    X = sparse.coo_matrix((vals.astype(np.int64), (rows, cols)),
+            shape=(cids.shape[0], kids.shape[0])).tocsr()
+    X.eliminate_zeros()
+    if cache:
+        _save_cached_matrix(cache_path, versions, X, cids, kids)
 
     # Return as an AnnotationMatrix
-    Xr = matrix_class(X, candidate_index=cid_to_row, row_index=row_to_cid,
-                        annotation_key_cls=annotation_key_class, key_index=kid_to_col, col_index=col_to_kid)
+    Xr = _build_annotation_matrix(matrix_class, annotation_key_class, X, cids, kids)
     return np.squeeze(Xr.toarray()) if load_as_array else Xr
 
 
+def _build_annotation_matrix(matrix_class, annotation_key_class, X, cids, kids):
+    """Wraps CSR matrix X as an AnnotationMatrix with rows cids and columns kids"""
+    # Create both mappings for rows and columns
+    cid_list, kid_list = cids.tolist(), kids.tolist()
+    cid_to_row = dict(zip(cid_list, range(len(cid_list))))
+    row_to_cid = dict(zip(range(len(cid_list)), cid_list))
+    kid_to_col = dict(zip(kid_list, range(len(kid_list))))
+    col_to_kid = dict(zip(range(len(kid_list)), kid_list))
+    return matrix_class(X, candidate_index=cid_to_row, row_index=row_to_cid,
+                        annotation_key_cls=annotation_key_class, key_index=kid_to_col, col_index=col_to_kid)
+
+
+def _get_cache_path(cache_dir, annotation_class, split, key_group, key_names, zero_one):
+    """Returns the cache directory for a matrix"""
+    name = "%s_split%s_group%s" % (annotation_class.__tablename__, split, key_group)
+    if key_names is not None:
+        keys = u'\0'.join(sorted(key_names)).encode('utf-8')
+        name += "_keys" + hashlib.md5(keys).hexdigest()
+    if zero_one:
+        name += "_zero_one"
+    return os.path.join(cache_dir, name)
+
+
+def _save_cached_matrix(cache_path, versions, X, cids, kids):
+    """
+    Saves the CSR arrays and id indexes of a matrix as .npy files, along with its
+    shape and versions, i.e. the database token and the table versions it was read at
+    """
+    # Write to a temporary directory first, so that readers never see a partial matrix
+    tmp_path = cache_path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    meta = np.array(list(X.shape) + list(versions), dtype=np.int64)
+    for name, arr in [('data', X.data), ('indices', X.indices), ('indptr', X.indptr),
+                      ('cids', cids), ('kids', kids), ('meta', meta)]:
+        np.save(os.path.join(tmp_path, name + '.npy'), arr)
+    if os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
+    os.rename(tmp_path, cache_path)
+
+
+def _load_cached_matrix(cache_path, versions, matrix_class, annotation_key_class):
+    """
+    Loads a cached matrix by memory-mapping its arrays, or returns None if it is
+    missing or stale
+    """
+    meta_path = os.path.join(cache_path, 'meta.npy')
+    if not os.path.exists(meta_path):
+        return None
+    meta = np.load(meta_path)
+    if meta[2:].tolist() != list(versions):
+        return None
+    data, indices, indptr, cids, kids = [
+        np.load(os.path.join(cache_path, name + '.npy'), mmap_mode='r')
+        for name in ('data', 'indices', 'indptr', 'cids', 'kids')
+    ]
+    X = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta[:2]), copy=False)
+    return _build_annotation_matrix(matrix_class, annotation_key_class, X, cids, kids)
+
+
 def load_label_matrix(session, **kwargs):
     return load_matrix(csr_LabelMatrix, LabelKey, Label, session, **kwargs)
 
@@ -396,6 +678,7 @@ class LabelAnnotator(Annotator):
     :param lfs: A _list_ of labeling functions (LFs)
     """
     def __init__(self, lfs=None, label_generator=None):
+        self.lfs = lfs
         if lfs is not None:
             labels = lambda c : [(lf.__name__, lf(c)) for lf in lfs]
         elif label_generator is not None:
@@ -430,10 +713,263 @@ class LabelAnnotator(Annotator):
 
         super(LabelAnnotator, self).__init__(Label, LabelKey, f_gen)
 
+    def apply(self, split=0, key_group=0, incremental=False, L=None, **kwargs):
+        """
+        Applies the LFs to the Candidates of the split, and returns their label matrix.
+
+        If incremental=True, only the LFs which are new or changed (by lf_fingerprint)
+        since they were last applied to the split are re-applied: only their Labels are
+        replaced, and the keys and Labels of LFs no longer in the list are deleted. If
+        the split's previous label matrix L is given, the returned matrix reuses its
+        columns for the unchanged LFs instead of reloading them.
+        """
+        if not incremental:
+            L = super(LabelAnnotator, self).apply(split=split, key_group=key_group, **kwargs)
+            if self.lfs is not None and kwargs.get('cids_query') is None:
+                session = new_sessionmaker()()
+                self._save_fingerprints(session, self.lfs, split, key_group)
+                session.commit()
+            return L
+
+        if self.lfs is None:
+            raise ValueError("Incremental labeling requires a list of lfs.")
+        if kwargs.get('cids_query') is not None:
+            raise ValueError("Incremental labeling is only supported for whole splits.")
+        for name in ('clear', 'replace_key_set'):
+            kwargs.pop(name, None)
+
+        SnorkelSession = new_sessionmaker()
+        session = SnorkelSession()
+        cids_query = session.query(Candidate.id).filter(Candidate.split == split)
+
+        # Find the LFs whose labels for this split were produced by a different version
+        fingerprints = dict(
+            session.query(LFFingerprint.name, LFFingerprint.fingerprint)\
+                   .filter(LFFingerprint.split == split)\
+                   .filter(LFFingerprint.group == key_group).all()
+        )
+        lf_fingerprints = dict((lf.__name__, lf_fingerprint(lf)) for lf in self.lfs)
+        stale_lfs = [lf for lf in self.lfs if lf_fingerprints[lf.__name__] is None or
+                     fingerprints.get(lf.__name__) != lf_fingerprints[lf.__name__]]
+        stale_names = [lf.__name__ for lf in stale_lfs]
+        keys = dict(session.query(LabelKey.name, LabelKey.id).filter(LabelKey.group == key_group).all())
+        stale_kids = [keys[name] for name in stale_names if name in keys]
+
+        # Delete the labels of the stale LFs, and everything of removed LFs
+        if len(stale_kids) > 0:
+            session.query(Label)\
+                   .filter(Label.key_id.in_(stale_kids))\
+                   .filter(Label.candidate_id.in_(cids_query.subquery()))\
+                   .delete(synchronize_session=False)
+        lf_names = set(lf.__name__ for lf in self.lfs)
+        removed = [name for name in keys if name not in lf_names]
+        if len(removed) > 0:
+            removed_kids = [keys[name] for name in removed]
+            session.query(Label).filter(Label.key_id.in_(removed_kids))\
+                   .delete(synchronize_session=False)
+            session.query(LabelKey).filter(LabelKey.id.in_(removed_kids))\
+                   .delete(synchronize_session=False)
+            session.query(LFFingerprint)\
+                   .filter(LFFingerprint.group == key_group)\
+                   .filter(LFFingerprint.name.in_(removed))\
+                   .delete(synchronize_session=False)
+
+        # Add the keys of new LFs, since the other keys are kept (replace_key_set=False)
+        new_names = [name for name in stale_names if name not in keys]
+        if len(new_names) > 0:
+            session.execute(LabelKey.__table__.insert(),
+                [{'name': name, 'group': key_group} for name in new_names])
+        session.commit()
+
+        # Apply only the stale LFs
+        if len(stale_lfs) > 0:
+            print("Applying %s of %s LFs..." % (len(stale_lfs), len(self.lfs)))
+            annotator = LabelAnnotator(lfs=stale_lfs)
+            annotator._apply_chunks(cids_query.all(), clear=False, split=split,
+                key_group=key_group, replace_key_set=False, cids_query=cids_query,
+                **kwargs)
+            self._save_fingerprints(session, stale_lfs, split, key_group, lf_fingerprints)
+        if len(stale_lfs) > 0 or len(removed) > 0:
+            bump_table_version(session, Label.__tablename__)
+            session.commit()
+
+        if L is not None:
+            X = self._patch_matrix(session, L, split, key_group, stale_names)
+            if X is not None:
+                return X
+        return self.load_matrix(session, split=split, key_group=key_group)
+
+    def clear(self, session, split=0, key_group=0, replace_key_set=True,
+        cids_query=None, **kwargs):
+        # The fingerprints of LFs whose labels are deleted no longer hold
+        query = session.query(LFFingerprint)
+        if not replace_key_set and cids_query is None:
+            query = query.filter(LFFingerprint.split == split)
+        query.delete(synchronize_session=False)
+        super(LabelAnnotator, self).clear(session, split=split, key_group=key_group,
+            replace_key_set=replace_key_set, cids_query=cids_query, **kwargs)
+
+    def _save_fingerprints(self, session, lfs, split, key_group, lf_fingerprints=None):
+        """
+        Records the fingerprints of LFs which were applied to the split; LFs without
+        a stable fingerprint are not recorded, so that they are always re-applied
+        """
+        if lf_fingerprints is None:
+            lf_fingerprints = dict((lf.__name__, lf_fingerprint(lf)) for lf in lfs)
+        session.query(LFFingerprint)\
+               .filter(LFFingerprint.split == split)\
+               .filter(LFFingerprint.group == key_group)\
+               .filter(LFFingerprint.name.in_([lf.__name__ for lf in lfs]))\
+               .delete(synchronize_session=False)
+        session.add_all([
+            LFFingerprint(name=lf.__name__, group=key_group, split=split,
+                fingerprint=lf_fingerprints[lf.__name__])
+            for lf in lfs if lf_fingerprints[lf.__name__] is not None
+        ])
+
+    def _patch_matrix(self, session, L, split, key_group, stale_names):
+        """
+        Returns the split's label matrix built from the columns of label matrix L for
+        unchanged LFs, and newly loaded columns for the stale LFs; or None if L does not
+        have the split's candidates or the other LFs' columns
+        """
+        cids = _load_ids(session, session.query(Candidate.id).filter(Candidate.split == split))
+        kids = _load_ids(session, session.query(LabelKey.id).filter(LabelKey.group == key_group))
+        if len(cids) != L.shape[0] or \
+            not np.array_equal(cids, [L.row_index[i] for i in range(L.shape[0])]):
+            return None
+
+        # Take the columns of the stale LFs from the database, and the others from L
+        blocks, col_kids = [], []
+        if len(stale_names) > 0:
+            X_stale = load_label_matrix(session, split=split, key_group=key_group,
+                key_names=stale_names)
+            blocks.append(sparse.csr_matrix(X_stale))
+            col_kids.extend(X_stale.col_index[j] for j in range(X_stale.shape[1]))
+        old_cols = [L.key_index[kid] for kid in kids if kid in L.key_index and kid not in col_kids]
+        blocks.insert(0, sparse.csr_matrix(L)[:, old_cols])
+        col_kids = [L.col_index[j] for j in old_cols] + col_kids
+        if sorted(col_kids) != kids.tolist():
+            return None
+
+        X = sparse.hstack(blocks, format='csr')[:, np.argsort(col_kids)]
+        return _build_annotation_matrix(csr_LabelMatrix, LabelKey, X, cids, kids)
+
     def load_matrix(self, session, **kwargs):
         return load_label_matrix(session, **kwargs)
 
 
+def lf_fingerprint(lf):
+    """
+    Returns a hash of a labeling function's name, source code, default arguments,
+    closure, and the globals it refers to, which changes whenever the LF is edited;
+    or None, with a warning, if the LF refers to a value which cannot be hashed
+    stably across processes, in which case the LF is always treated as changed.
+
+    Functions, classes and modules of the standard library, installed packages and
+    snorkel itself are hashed by name; those of other modules by their source, and
+    the attributes of other modules which the LF refers to (e.g. helpers.f) are
+    followed. Compiled regexes are hashed by their pattern and flags.
+    """
+    try:
+        return _fingerprint(lf, set())
+    except _UnstableValue as e:
+        warnings.warn("LF %s refers to %s, which has no stable fingerprint; it will be "
+            "re-applied every time." % (lf.__name__, e.args[0]), RuntimeWarning)
+        return None
+
+
+class _UnstableValue(Exception):
+    pass
+
+
+_PATTERN_TYPE = type(re.compile(''))
+
+_SIMPLE_TYPES = (type(None), bool, float, complex, binary_type, text_type) + integer_types
+
+_LIBRARY_PATHS = tuple(set(os.path.realpath(p) for p in (
+    sysconfig.get_paths()['stdlib'], sysconfig.get_paths()['purelib'],
+    sysconfig.get_paths()['platlib'])))
+
+
+def _is_library_module(name):
+    """Whether the module is part of snorkel, the standard library or an installed package"""
+    if name is None or name in sys.builtin_module_names or name == 'snorkel' or \
+        name.startswith('snorkel.'):
+        return True
+    # Modules without a file, e.g. __main__ of a notebook, are not
+    path = getattr(sys.modules.get(name), '__file__', None)
+    return path is not None and os.path.realpath(path).startswith(_LIBRARY_PATHS)
+
+
+def _code_names(code):
+    """The global and attribute names of code object and the code objects nested in it"""
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names.extend(_code_names(const))
+    return names
+
+
+def _fingerprint(f, seen):
+    h = hashlib.md5()
+    h.update(f.__name__.encode('utf-8'))
+    if f in seen:
+        return h.hexdigest()
+    seen.add(f)
+
+    code = get_function_code(f)
+    try:
+        h.update(inspect.getsource(f).encode('utf-8'))
+    except (IOError, TypeError):
+        h.update(code.co_code)
+        h.update(repr(code.co_consts).encode('utf-8'))
+
+    # Hash the values the function can read other than its arguments
+    names = _code_names(code)
+    values = list(get_function_defaults(f) or ())
+    values.extend(cell.cell_contents for cell in (get_function_closure(f) or ()))
+    values.extend(f.__globals__[name] for name in names if name in f.__globals__)
+    for value in values:
+        h.update(_value_fingerprint(value, names, seen).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _value_fingerprint(value, names, seen):
+    """A hash of a value read by a function whose code refers to names"""
+    if isinstance(value, _SIMPLE_TYPES):
+        return repr(value)
+    elif isinstance(value, _PATTERN_TYPE):
+        return repr((value.pattern, value.flags))
+    elif isinstance(value, (tuple, list)):
+        return repr([_value_fingerprint(v, names, seen) for v in value])
+    elif isinstance(value, (set, frozenset)):
+        return repr(sorted(_value_fingerprint(v, names, seen) for v in value))
+    elif isinstance(value, dict):
+        return repr(sorted((_value_fingerprint(k, names, seen), _value_fingerprint(v, names, seen))
+                           for k, v in iteritems(value)))
+    elif inspect.ismodule(value):
+        if _is_library_module(value.__name__) or value in seen:
+            return value.__name__
+        # Follow the module's attributes which the function refers to
+        seen.add(value)
+        return repr([(name, _value_fingerprint(getattr(value, name), names, seen))
+                     for name in sorted(set(names)) if hasattr(value, name)])
+    elif inspect.isclass(value) or inspect.isroutine(value):
+        module = getattr(value, '__module__', None)
+        name = '%s.%s' % (module, getattr(value, '__name__', ''))
+        if _is_library_module(module):
+            return name
+        elif inspect.isfunction(value):
+            return _fingerprint(value, seen)
+        elif inspect.isclass(value):
+            try:
+                return name + inspect.getsource(value)
+            except (IOError, TypeError):
+                return name
+    raise _UnstableValue(repr(value))
+
+
 class FeatureAnnotator(Annotator):
     """Apply feature generators to the candidates, generating Feature annotations"""
     def __init__(self, f=get_span_feats):
@@ -2,13 +2,22 @@ from collections import defaultdict
 from copy import deepcopy
 from itertools import product
 import re
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import select
 
-from .models import Candidate, TemporarySpan, Sentence
+from .models import Candidate, Context, Span, TemporarySpan, Sentence, bump_table_version
+from .models.meta import new_sessionmaker, snorkel_postgres
 from .udf import UDF, UDFRunner
 
 QUEUE_COLLECT_TIMEOUT = 5
 
+# Number of Spans and candidates buffered by CandidateExtractorUDF before being written in bulk
+CANDIDATE_BUFFER_SIZE = 10000
+
+# Max number of values per IN clause when looking up existing spans and candidates
+# Note: Must stay below SQLite's limit of 999 parameters per query
+SELECT_CHUNK_SIZE = 500
+
 
 class CandidateExtractor(UDFRunner):
     """
@@ -26,25 +35,39 @@ class CandidateExtractor(UDFRunner):
                              that contains it. Only applies to binary relations. Default is False.
     :param symmetric_relations: Boolean indicating whether to extract symmetric Candidates, i.e., rel(A,B) and rel(B,A),
                                 where A and B are Contexts. Only applies to binary relations. Default is False.
+    :param bulk: Boolean indicating whether to buffer the extracted Spans and Candidates, and write them with
+                 multi-row inserts, looking up existing ones with one query per chunk, instead of one row at a
+                 time. Their ids are only reserved when the buffer is written (on SQLite, as MAX(id) + 1, which
+                 is not registered anywhere), so other writes to the context and candidate tables, e.g. by a
+                 bulk=False run, must not be interleaved with a bulk run. Default is False.
     """
-    def __init__(self, candidate_class, cspaces, matchers, self_relations=False, nested_relations=False, symmetric_relations=False):
+    def __init__(self, candidate_class, cspaces, matchers, self_relations=False, nested_relations=False, symmetric_relations=False,
+                 bulk=False):
         super(CandidateExtractor, self).__init__(CandidateExtractorUDF,
                                                  candidate_class=candidate_class,
                                                  cspaces=cspaces,
                                                  matchers=matchers,
                                                  self_relations=self_relations,
                                                  nested_relations=nested_relations,
-                                                 symmetric_relations=symmetric_relations)
+                                                 symmetric_relations=symmetric_relations,
+                                                 bulk=bulk)
 
     def apply(self, xs, split=0, **kwargs):
         super(CandidateExtractor, self).apply(xs, split=split, **kwargs)
 
+        # Mark any cached annotation matrices as stale
+        session = new_sessionmaker()()
+        bump_table_version(session, Candidate.__tablename__)
+        session.commit()
+        session.close()
+
     def clear(self, session, split, **kwargs):
         session.query(Candidate).filter(Candidate.split == split).delete()
 
 
 class CandidateExtractorUDF(UDF):
-    def __init__(self, candidate_class, cspaces, matchers, self_relations, nested_relations, symmetric_relations, **kwargs):
+    def __init__(self, candidate_class, cspaces, matchers, self_relations, nested_relations, symmetric_relations,
+                 bulk=False, **kwargs):
         self.candidate_class     = candidate_class
         self.candidate_spaces    = cspaces if type(cspaces) in [list, tuple] else [cspaces]
         self.matchers            = matchers if type(matchers) in [list, tuple] else [matchers]
@@ -66,6 +89,12 @@ class CandidateExtractorUDF(UDF):
         for i in range(self.arity):
             self.child_context_sets[i] = set()
 
+        # For buffering the matched Spans and the extracted candidates when writing in bulk
+        self.bulk             = bulk
+        self.span_buffer      = []
+        self.candidate_buffer = []
+        self.buffer_opts      = None
+
         super(CandidateExtractorUDF, self).__init__(**kwargs)
 
     def apply(self, context, clear, split, **kwargs):
@@ -73,8 +102,11 @@ class CandidateExtractorUDF(UDF):
         # by the Matcher
         for i in range(self.arity):
             self.child_context_sets[i].clear()
-            for tc in self.matchers[i].apply(self.candidate_spaces[i].apply(context)):
-                tc.load_id_or_insert(self.session)
+            for tc in self.matchers[i].apply_context(self.candidate_spaces[i], context):
+                if self.bulk:
+                    self.span_buffer.append(tc)
+                else:
+                    tc.load_id_or_insert(self.session)
                 self.child_context_sets[i].add(tc)
 
         # Generates and persists candidates
@@ -101,6 +133,12 @@ class CandidateExtractorUDF(UDF):
                 # Keep track of extracted
                 extracted.add((a,b))
 
+            # In bulk, the candidate is written by flush()
+            if self.bulk:
+                self.buffer_opts = (split, clear)
+                self.candidate_buffer.append(tuple(arg for _, arg in args))
+                continue
+
             # Assemble candidate arguments
             for i, arg_name in enumerate(self.candidate_class.__argnames__):
                 candidate_args[arg_name + '_id'] = args[i][1].id
@@ -117,6 +155,104 @@ class CandidateExtractorUDF(UDF):
             # Add Candidate to session
             yield self.candidate_class(**candidate_args)
 
+        # Contexts are only flushed whole, so that the buffer holds all of their candidates
+        if len(self.candidate_buffer) + len(self.span_buffer) >= CANDIDATE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Inserts the buffered Spans which are not in the database yet, as the ORM path
+        does for every matched Span, and the buffered candidates, using pre-allocated
+        ids and multi-row inserts.
+        Existing Spans are looked up by stable id, and existing candidates (if clear was
+        False) by their arguments, with one query per chunk; on Postgres, the Spans are
+        also upserted on their stable id, in case another process inserted them meanwhile.
+        """
+        if len(self.candidate_buffer) == 0 and len(self.span_buffer) == 0:
+            return
+        candidates, self.candidate_buffer = self.candidate_buffer, []
+
+        # Get the ids of the matched Spans, inserting the new ones
+        spans = {}
+        for span in self.span_buffer:
+            self._stable_id(span, spans)
+        self.span_buffer = []
+        candidates = [tuple(self._stable_id(span, spans) for span in args) for args in candidates]
+        span_ids = self._load_or_insert_spans(spans)
+        if len(candidates) == 0:
+            return
+        split, clear = self.buffer_opts
+        arg_ids = [tuple(span_ids[stable_id] for stable_id in args) for args in candidates]
+
+        # Skip the candidates which exist already, as well as any repeats
+        existing = self._load_existing_candidates(arg_ids) if not clear else set()
+        new = []
+        for args in arg_ids:
+            if args not in existing:
+                existing.add(args)
+                new.append(args)
+
+        # Insert the new candidates
+        ids = self._allocate_ids(Candidate.__tablename__, len(new))
+        candidate_table = self.candidate_class.__table__
+        self._insert(Candidate.__table__, [
+            {'id': cid, 'type': candidate_table.name, 'split': split} for cid in ids
+        ])
+        arg_names = [arg_name + '_id' for arg_name in self.candidate_class.__argnames__]
+        self._insert(candidate_table, [
+            dict(zip(arg_names, args), id=cid) for cid, args in zip(ids, new)
+        ])
+
+    def _stable_id(self, span, spans):
+        """Returns the stable id of span, recording span under it in spans"""
+        stable_id = span.get_stable_id()
+        spans.setdefault(stable_id, span)
+        return stable_id
+
+    def _load_or_insert_spans(self, spans):
+        """Returns the Context ids of spans, keyed by stable id, inserting the missing ones"""
+        span_ids = self._load_context_ids(list(spans.keys()))
+        new = [stable_id for stable_id in spans if stable_id not in span_ids]
+        ids = self._allocate_ids(Context.__tablename__, len(new))
+        context_rows = [{'id': cid, 'type': 'span', 'stable_id': stable_id} for cid, stable_id in zip(ids, new)]
+        if snorkel_postgres and len(context_rows) > 0:
+            query = postgresql.insert(Context.__table__).values(context_rows)\
+                              .on_conflict_do_nothing(index_elements=['stable_id'])\
+                              .returning(Context.__table__.c.id, Context.__table__.c.stable_id)
+            inserted = dict((stable_id, cid) for cid, stable_id in self.session.execute(query))
+            span_ids.update(self._load_context_ids([s for s in new if s not in inserted]))
+        else:
+            self._insert(Context.__table__, context_rows)
+            inserted = dict(zip(new, ids))
+        span_ids.update(inserted)
+
+        span_rows = []
+        for stable_id, cid in inserted.items():
+            row = spans[stable_id]._get_insert_args()
+            row['id'] = cid
+            span_rows.append(row)
+        self._insert(Span.__table__, span_rows)
+        return span_ids
+
+    def _load_context_ids(self, stable_ids):
+        """Returns the ids of the existing Contexts with the given stable ids"""
+        ids = {}
+        for i in range(0, len(stable_ids), SELECT_CHUNK_SIZE):
+            query = select([Context.stable_id, Context.id])\
+                    .where(Context.stable_id.in_(stable_ids[i:i+SELECT_CHUNK_SIZE]))
+            ids.update(self.session.execute(query).fetchall())
+        return ids
+
+    def _load_existing_candidates(self, arg_ids):
+        """Returns the argument id tuples of the existing candidates among arg_ids"""
+        arg_cols = [self.candidate_class.__table__.c[arg_name + '_id'] for arg_name in self.candidate_class.__argnames__]
+        first_ids = sorted(set(args[0] for args in arg_ids))
+        existing = set()
+        for i in range(0, len(first_ids), SELECT_CHUNK_SIZE):
+            query = select(arg_cols).where(arg_cols[0].in_(first_ids[i:i+SELECT_CHUNK_SIZE]))
+            existing.update(tuple(row) for row in self.session.execute(query))
+        return existing
+
 
 class CandidateSpace(object):
     """
@@ -160,17 +296,22 @@ class Ngrams(CandidateSpace):
 
                 # Check for split
                 # NOTE: For simplicity, we only split single tokens right now!
-                if l == 1 and self.split_rgx is not None and end - start > 0:
-                    m = re.search(self.split_rgx, context.text[start-offsets[0]:end-offsets[0]+1])
-                    if m is not None and l < self.n_max + 1:
-                        ts1 = TemporarySpan(char_start=start, char_end=start + m.start(1) - 1, sentence=context)
-                        if ts1 not in seen:
-                            seen.add(ts1)
-                            yield ts
-                        ts2 = TemporarySpan(char_start=start + m.end(1), char_end=end, sentence=context)
-                        if ts2 not in seen:
-                            seen.add(ts2)
-                            yield ts2
+                if l == 1:
+                    for split in self.split(context, start, end):
+                        if split not in seen:
+                            seen.add(split)
+                            yield split
+
+    def split(self, context, start, end):
+        """Returns the two spans around the first split token in the single token span start-end, if any"""
+        offsets = context.char_offsets
+        if self.split_rgx is None or end - start <= 0:
+            return []
+        m = re.search(self.split_rgx, context.text[start-offsets[0]:end-offsets[0]+1])
+        if m is None:
+            return []
+        return [TemporarySpan(char_start=start, char_end=start + m.start(1) - 1, sentence=context),
+                TemporarySpan(char_start=start + m.end(1), char_end=end, sentence=context)]
 
 
 class PretaggedCandidateExtractor(UDFRunner):
@@ -187,6 +328,12 @@ class PretaggedCandidateExtractor(UDFRunner):
     def apply(self, xs, split=0, **kwargs):
         super(PretaggedCandidateExtractor, self).apply(xs, split=split, **kwargs)
 
+        # Mark any cached annotation matrices as stale
+        session = new_sessionmaker()()
+        bump_table_version(session, Candidate.__tablename__)
+        session.commit()
+        session.close()
+
     def clear(self, session, split, **kwargs):
         session.query(Candidate).filter(Candidate.split == split).delete()
 
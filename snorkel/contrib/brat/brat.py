@@ -14,7 +14,7 @@ from sqlalchemy import and_
 from .utils import download
 from collections import defaultdict
 from IPython.display import IFrame, display, HTML
-from ...models import Span, Candidate, Document, Sentence, TemporarySpan, GoldLabel, GoldLabelKey
+from ...models import Span, Candidate, Document, Sentence, TemporarySpan, GoldLabel, GoldLabelKey, bump_table_version
 from ...learning.utils import print_scores
 
 class BratAnnotator(object):
@@ -319,6 +319,7 @@ class BratAnnotator(object):
                 continue
             label = GoldLabel(key=self.annotator, candidate=c, value=1)
             session.add(label)
+        bump_table_version(session, GoldLabel.__tablename__)
         session.commit()
 
     def _score(self, y_true, y_pred, recall_correction=0, title='BRAT Scores'):
@@ -1,4 +1,4 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 from snorkel.models import construct_stable_id
 from snorkel.parser import Parser, ParserConnection
 
@@ -16,13 +16,25 @@ class SpaCy(Parser):
     python -m spacy download en
 
     '''
-    def __init__(self,lang='en'):
+    def __init__(self,lang='en', batch_size=1000, n_process=1):
         try:
             import spacy
         except:
             raise Exception("spacy not installed. Use `pip install spacy`.")
+        # Language.pipe only takes n_process from spaCy 2.2 on
+        version = spacy.about.__version__
+        if n_process > 1 and tuple(int(v) for v in version.split('.')[:2]) < (2, 2):
+            raise ValueError("n_process > 1 requires spaCy >= 2.2, but spaCy %s is installed" % version)
         super(SpaCy, self).__init__(name="spaCy")
+        self.version = version
         self.model = spacy.load('en')
+        self.batch_size = batch_size
+        self.n_process = n_process
+
+    def signature(self):
+        meta = getattr(self.model, 'meta', {})
+        return "%s:%s:%s-%s" % (super(SpaCy, self).signature(), self.version,
+                                meta.get('name', 'en'), meta.get('version'))
 
     def connect(self):
         return ParserConnection(self)
@@ -37,7 +49,27 @@ class SpaCy(Parser):
         text = text.encode('utf-8', 'error')
         text = text.decode('utf-8')
 
-        doc = self.model(text)
+        return self._parse_doc(document, self.model(text))
+
+    def parse_batch(self, xs):
+        '''
+        Parse a stream of (document, text) pairs with spaCy's batched pipe
+        :param xs:
+        :return:
+        '''
+        documents = deque()
+        def texts():
+            for document, text in xs:
+                documents.append(document)
+                yield text.encode('utf-8', 'error').decode('utf-8')
+
+        kwargs = {'n_process': self.n_process} if self.n_process > 1 else {}
+        docs = self.model.pipe(texts(), batch_size=self.batch_size, **kwargs)
+        for doc in docs:
+            for parts in self._parse_doc(documents.popleft(), doc):
+                yield parts
+
+    def _parse_doc(self, document, doc):
         assert doc.is_parsed
 
         position = 0
@@ -1,4 +1,4 @@
-from .models import StableLabel, GoldLabel, Context, GoldLabelKey
+from .models import StableLabel, GoldLabel, Context, GoldLabelKey, bump_table_version
 from sqlalchemy.orm import object_session
 from future.utils import iteritems
 
@@ -57,5 +57,6 @@ def reload_annotator_labels(session, candidate_class, annotator_name, split, fil
             session.add(label)
             labels.append(label)
 
+    bump_table_version(session, GoldLabel.__tablename__)
     session.commit()
     print("AnnotatorLabels created: %s" % (len(labels),))
@@ -2,8 +2,9 @@ from .classifier import Classifier
 from numba import jit
 import numbskull
 from numbskull import NumbSkull
+from numbskull.dataloading import compute_var_map
 from numbskull.inference import FACTORS
-from numbskull.numbskulltypes import Weight, Variable, Factor, FactorToVar
+from numbskull.numbskulltypes import Weight, Variable, Factor, FactorToVar, VarToFactor
 import numpy as np
 import random
 import scipy.sparse as sparse
@@ -18,6 +19,9 @@ DEP_FIXING = 1
 DEP_REINFORCING = 2
 DEP_EXCLUSIVE = 3
 
+# Number of candidates whose factor graph arrays are compiled at a time
+COMPILE_CHUNK_SIZE = 100000
+
 
 class GenerativeModel(Classifier):
     """
@@ -73,7 +77,8 @@ class GenerativeModel(Classifier):
         LF_acc_prior_weight_default=1, labels=None, label_prior_weight=5,
         init_deps=0.0, init_class_prior=-1.0, epochs=30, step_size=None, 
         decay=1.0, reg_param=0.1, reg_type=2, verbose=False, truncation=10, 
-        burn_in=5, cardinality=None, timer=None, candidate_ranges=None, threads=1):
+        burn_in=5, cardinality=None, timer=None, candidate_ranges=None, threads=1,
+        compile_dir=None, chunk_size=COMPILE_CHUNK_SIZE):
         """
         Fits the parameters of the model to a data set. By default, learns a
         conditionally independent model. Additional unary dependencies can be
@@ -121,6 +126,15 @@ class GenerativeModel(Classifier):
             error. If None, then each candidate can take any value from 0 to
             cardinality.
         :param threads: the number of threads to use for sampling. Default is 1.
+        :param compile_dir: Optionally, a directory in which the factor graph
+            arrays are built as memory-mapped files: the variables, factors,
+            edges and the variable-to-factor index, whose size grows with the
+            number of edges. NumbSkull still keeps a few arrays with one entry
+            per variable value (e.g. sampled values and marginals) in memory,
+            so only these are bounded by disk rather than memory. The files
+            are removed once training finishes.
+        :param chunk_size: number of candidates whose factor graph arrays are
+            compiled at a time
         """
         m, n = L.shape
         step_size = step_size or 0.0001
@@ -166,18 +180,18 @@ class GenerativeModel(Classifier):
         # LF weights are un-fixed
         is_fixed = [False for _ in range(n)]
 
-        # If supervised labels are provided, add them as a fixed LF with prior
-        # Note: For large L this column stack operation could be very
-        # inefficient, can consider refactoring...
+        # If supervised labels are provided, add them as a fixed LF with prior;
+        # the column is appended to each chunk of L as it is compiled
         if labels is not None:
-            labels = labels.reshape(m, 1)
-            L = sparse.hstack([L, labels])
+            if sparse.issparse(labels):
+                labels = labels.toarray()
+            labels = np.asarray(labels).reshape(m)
             is_fixed.append(True)
             LF_acc_prior_weights.append(label_prior_weight)
             n += 1
 
         # Reduce overhead of tracking indices by converting L to a CSR sparse matrix.
-        L = sparse.csr_matrix(L).copy()
+        L = sparse.csr_matrix(L)
 
         # If candidate_ranges is provided, remap the values of L using
         # candidate_ranges. This "scoped categorical" approach allows learning
@@ -190,11 +204,14 @@ class GenerativeModel(Classifier):
         if self.candidate_ranges is not None:
             L, self.cardinalities, _ = self._remap_scoped_categoricals(L, 
                 self.candidate_ranges)
-
-        # Shuffle the data points, cardinalities, and candidate_ranges
-        idxs = range(m)
-        self.rng.shuffle(idxs)
-        L = L[idxs, :]
+            if labels is not None:
+                labels, _, _ = self._remap_scoped_categoricals(
+                    labels.reshape(m, 1), self.candidate_ranges)
+                labels = labels.toarray().reshape(m)
+
+        # Shuffle the data points, cardinalities, and candidate_ranges; L itself
+        # is only read through the permutation when compiling
+        idxs = self.rng.permutation(m)
         if candidate_ranges is not None:
             self.cardinalities = self.cardinalities[idxs]
             c_ranges_reshuffled = []
@@ -202,10 +219,16 @@ class GenerativeModel(Classifier):
                 c_ranges_reshuffled.append(self.candidate_ranges[i])
             self.candidate_ranges = c_ranges_reshuffled
 
+        # Empty matrix with the shape of L plus any labels column, for the
+        # methods that only need its shape
+        L_shape = sparse.csr_matrix((m, n), dtype=L.dtype)
+
         # Compile factor graph
-        self._process_dependency_graph(L, deps)
+        self._process_dependency_graph(L_shape, deps)
         weight, variable, factor, ftv, domain_mask, n_edges = self._compile(
-            L, init_deps, init_class_prior, LF_acc_prior_weights, is_fixed, self.cardinalities)
+            L, init_deps, init_class_prior, LF_acc_prior_weights, is_fixed,
+            self.cardinalities, labels=labels, idxs=idxs,
+            compile_dir=compile_dir, chunk_size=chunk_size)
         fg = NumbSkull(
             n_inference_epoch=0,
             n_learning_epoch=epochs, 
@@ -220,14 +243,15 @@ class GenerativeModel(Classifier):
             burn_in=burn_in,
             nthreads=threads
         )
-        fg.loadFactorGraph(weight, variable, factor, ftv, domain_mask, n_edges)
+        _load_factor_graph(fg, weight, variable, factor, ftv, domain_mask,
+            compile_dir=compile_dir)
 
         if timer is not None:
             timer.start()
         fg.learning(out=False)
         if timer is not None:
             timer.end()
-        self._process_learned_weights(L, fg, LF_acc_prior_weights, is_fixed)
+        self._process_learned_weights(L_shape, fg, LF_acc_prior_weights, is_fixed)
 
         # Store info from factor graph
         if self.candidate_ranges is not None:
@@ -235,17 +259,22 @@ class GenerativeModel(Classifier):
         else:
             self.cardinality_for_stats = self.cardinality
         self.learned_weights = fg.factorGraphs[0].weight_value
+
+        # Release the training factor graph, and remove its files
+        fg.factorGraphs = []
+        del variable, factor, ftv, domain_mask
+        _remove_arrays(compile_dir)
+
         weight, variable, factor, ftv, domain_mask, n_edges =\
             self._compile(sparse.coo_matrix((1, n), L.dtype), init_deps,
                 init_class_prior, LF_acc_prior_weights, is_fixed,
-                [self.cardinality_for_stats])
+                np.array([self.cardinality_for_stats]))
 
         variable["isEvidence"] = False
         weight["isFixed"] = True
-        weight["initialValue"] = fg.factorGraphs[0].weight_value
+        weight["initialValue"] = self.learned_weights
 
-        fg.factorGraphs = []
-        fg.loadFactorGraph(weight, variable, factor, ftv, domain_mask, n_edges)
+        _load_factor_graph(fg, weight, variable, factor, ftv, domain_mask)
 
         self.fg = fg
         self.nlf = n
@@ -257,7 +286,7 @@ class GenerativeModel(Classifier):
         support, returning the remapped label matrix, cardinalities, and
         inverse mapping.
         """
-        L = L_in.copy()
+        L = sparse.csr_matrix(L_in, copy=True)
         m, n = L.shape
         cardinalities = np.ones(m)
         mappings = []
@@ -271,14 +300,20 @@ class GenerativeModel(Classifier):
             # Create the inverse mapping
             mappings.append(dict([(a + 1, b) for a, b in enumerate(c_range)]))
 
-            # Re-map the values of L[i, :]
-            # Assumes L is csr_sparse format at this point
-            for j in range(L[i].data.shape[0]):
-                val = L[i].data[j]
-                if val not in c_range:
-                    raise ValueError("""Value {0} is not in supplied range 
-                        for candidate at index {1}""".format(val, i))
-                L[i, L[i].indices[j]] = c_range.index(val) + 1
+        # Re-map the values of L all at once, by binary search over the
+        # (candidate, value) pairs of the concatenated candidate ranges
+        flat_ranges, offsets = _flatten_candidate_ranges(candidate_ranges)
+        rows = np.repeat(np.arange(m), np.diff(L.indptr))
+        nz = L.data != 0
+        range_rows = np.repeat(np.arange(m), np.diff(offsets))
+        positions = _find_in_ranges(flat_ranges, range_rows,
+            L.data[nz].astype(np.int64), rows[nz])
+        if np.any(positions < 0):
+            i = rows[nz][np.argmax(positions < 0)]
+            val = L.data[nz][np.argmax(positions < 0)]
+            raise ValueError("""Value {0} is not in supplied range 
+                for candidate at index {1}""".format(val, i))
+        L.data[nz] = positions - offsets[rows[nz]] + 1
         return L, cardinalities, mappings
 
     def learned_lf_stats(self):
@@ -353,7 +388,8 @@ class GenerativeModel(Classifier):
 
         return DataFrame(stats)
 
-    def marginals(self, L, candidate_ranges=None, batch_size=None):
+    def marginals(self, L, candidate_ranges=None, batch_size=None,
+        use_numba=False):
         """
         Given an M x N label matrix, returns marginal probabilities for each
         candidate, depending on classification setting:
@@ -370,101 +406,127 @@ class GenerativeModel(Classifier):
 
         In the categorical setting, the K values (columns in the marginals
         matrix) correspond to indices of the Candidate values defined.
+
+        If batch_size is set, the rows of L are processed batch_size at a time.
+        In the binary setting, use_numba computes each batch with a compiled
+        per-candidate kernel instead of sparse matrix products.
         """
         m, n = L.shape
         if self.weights is None:
             raise ValueError("""Must fit model with train() before computing 
                 marginal probabilities.""")
+        batch_size = batch_size or max(m, 1)
 
         # Binary classification setting
         if self.cardinality == 2:
-            marginals = np.ndarray(L.shape[0], dtype=np.float64)
-
-            for i in range(L.shape[0]):
-                logp_true = self.weights.class_prior
-                logp_false = -1 * self.weights.class_prior
-
-                l_i = L[i].tocoo()
-
-                for l_index1 in range(l_i.nnz):
-                    data_j, j = l_i.data[l_index1], l_i.col[l_index1]
-                    if data_j == 1:
-                        logp_true  += self.weights.lf_accuracy[j]
-                        logp_false -= self.weights.lf_accuracy[j]
-                        logp_true  += self.weights.lf_class_propensity[j]
-                        logp_false -= self.weights.lf_class_propensity[j]
-                    elif data_j == -1:
-                        logp_true  -= self.weights.lf_accuracy[j]
-                        logp_false += self.weights.lf_accuracy[j]
-                        logp_true  += self.weights.lf_class_propensity[j]
-                        logp_false -= self.weights.lf_class_propensity[j]
-                    else:
-                        ValueError("""Illegal value at %d, %d: %d.
-                            Must be in {-1, 0, 1}.""" % (i, j, data_j))
-
-                    for l_index2 in range(l_i.nnz):
-                        data_k, k = l_i.data[l_index2], l_i.col[l_index2]
-                        if j != k:
-                            if data_j == -1 and data_k == 1:
-                                logp_true += self.weights.dep_fixing[j, k]
-                            elif data_j == 1 and data_k == -1:
-                                logp_false += self.weights.dep_fixing[j, k]
-
-                            if data_j == 1 and data_k == 1:
-                                logp_true += self.weights.dep_reinforcing[j, k]
-                            elif data_j == -1 and data_k == -1:
-                                logp_false += self.weights.dep_reinforcing[j, k]
-
-                marginals[i] = 1 / (1 + np.exp(logp_false - logp_true))
+            # Pairwise dependency weights, without self-dependencies
+            fixing = _dep_weight_matrix(self.weights.dep_fixing, n)
+            reinforcing = _dep_weight_matrix(self.weights.dep_reinforcing, n)
+
+            L = sparse.csr_matrix(L)
+            marginals = np.ndarray(m, dtype=np.float64)
+            for start in range(0, m, batch_size):
+                L_b = L[start:start + batch_size]
+                if use_numba:
+                    logits = np.zeros(L_b.shape[0], dtype=np.float64)
+                    _binary_logits(L_b.indptr, L_b.indices,
+                        L_b.data.astype(np.float64), self.weights.class_prior,
+                        self.weights.lf_accuracy[:n],
+                        self.weights.lf_class_propensity[:n], fixing.toarray(),
+                        reinforcing.toarray(), logits)
+                else:
+                    logits = self._binary_logits(L_b, fixing, reinforcing)
+                if np.isnan(logits).any():
+                    i = np.argmax(np.isnan(logits))
+                    row = L_b[i].tocoo()
+                    j = row.col[np.argmax((row.data != 0) & (row.data != 1) &
+                        (row.data != -1))]
+                    raise ValueError("""Illegal value at %d, %d: %d.
+                        Must be in {-1, 0, 1}.""" % (start + i, j, L_b[i, j]))
+                marginals[start:start + L_b.shape[0]] = 1 / (1 + np.exp(-logits))
             return marginals
 
         # Categorical setting
         else:
-            all_marginals = []
-
             # Handle the scoped categorical case, otherwise get cardinalities
             # from self.cardinality
             if candidate_ranges is not None:
-                L, cardinalities, mappings = self._remap_scoped_categoricals(L, 
+                L, cardinalities, _ = self._remap_scoped_categoricals(L, 
                     candidate_ranges)
             else:
+                L = sparse.csr_matrix(L)
                 cardinalities = self.cardinality * np.ones(m)
+            cardinalities = cardinalities.astype(np.int64)
+            K = int(cardinalities.max()) if m > 0 else self.cardinality
 
             # Get the marginal (posterior) probability for each candidate
-            for i in range(m):
-                cardinality = int(cardinalities[i])
-                marginals = np.zeros(cardinality, dtype=np.float64)
-                # NB: class priors not currently available for categoricals
-                l_i = L[i].tocoo()
-                for l_index1 in range(l_i.nnz):
-                    data_j, j = l_i.data[l_index1], l_i.col[l_index1]
-                    if (data_j != 0):
-                        if not 1 <= data_j <= cardinality:
-                            raise ValueError(
-                                """Illegal value at %d, %d: %d. Must be in 0 to 
-                                %d.""" % (i, j, data_j, cardinality))
-                        # NB: LF class propensity not currently available
-                        # for categoricals
-                        marginals[int(data_j - 1)] += \
-                            2 * self.weights.lf_accuracy[j]
-                            
-                # NB: fixing and reinforcing not available for categoricals
-                # Get softmax
-                exps = np.exp(marginals)
-                marginals = exps / exps.sum()
-                all_marginals.append(marginals)
+            all_marginals = []
+            for start in range(0, m, batch_size):
+                L_b = L[start:start + batch_size].tocoo()
+                card_b = cardinalities[start:start + batch_size]
+                nz = L_b.data != 0
+                rows, cols = L_b.row[nz], L_b.col[nz]
+                vals = L_b.data[nz].astype(np.int64)
+                illegal = (vals < 1) | (vals > card_b[rows])
+                if np.any(illegal):
+                    k = np.argmax(illegal)
+                    raise ValueError(
+                        """Illegal value at %d, %d: %d. Must be in 0 to 
+                        %d.""" % (start + rows[k], cols[k], vals[k], card_b[rows[k]]))
+
+                # NB: class priors, LF class propensity, and fixing and
+                # reinforcing not currently available for categoricals
+                scores = sparse.coo_matrix(
+                    (2 * self.weights.lf_accuracy[cols], (rows, vals - 1)),
+                    shape=(L_b.shape[0], K)).toarray()
+
+                # Get softmax over each candidate's own cardinality
+                in_range = np.arange(K) < card_b[:, None]
+                scores[~in_range] = -np.inf
+                exps = np.exp(scores - scores.max(axis=1)[:, None])
+                all_marginals.append(exps / exps.sum(axis=1)[:, None])
+            M = np.vstack(all_marginals) if all_marginals else np.zeros((0, K))
 
             # If candidate_ranges not None, remap back to original values and
             # return as sparse matrix
             if candidate_ranges is not None:
-                M = sparse.coo_matrix((m, self.cardinality), dtype=np.float64)
-                for i, marginals in enumerate(all_marginals):
-                    for j, p in enumerate(marginals):
-                        M[i, mappings[i][j]] = p
-            else:
-                M = np.vstack(all_marginals)
+                flat_ranges, _ = _flatten_candidate_ranges(candidate_ranges)
+                rows = np.repeat(np.arange(m), cardinalities)
+                in_range = np.arange(K) < cardinalities[:, None]
+                M = sparse.coo_matrix((M[in_range], (rows, flat_ranges - 1)),
+                    shape=(m, self.cardinality), dtype=np.float64)
             return M
 
+    def _binary_logits(self, L, fixing, reinforcing):
+        """
+        Computes log p(true) - log p(false) for each row of CSR label matrix L
+        with sparse products; rows with values outside {-1, 0, 1} are NaN
+        """
+        shape = L.shape
+        pos = sparse.csr_matrix(((L.data == 1).astype(np.float64), L.indices,
+            L.indptr), shape=shape)
+        neg = sparse.csr_matrix(((L.data == -1).astype(np.float64), L.indices,
+            L.indptr), shape=shape)
+
+        logits = 2 * self.weights.class_prior * np.ones(shape[0])
+        logits += 2 * (pos - neg).dot(self.weights.lf_accuracy[:shape[1]])
+        logits += 2 * (pos + neg).dot(self.weights.lf_class_propensity[:shape[1]])
+
+        # Each pair of LFs j, k with a fixing dependency adds weight to true
+        # when j is -1 and k is 1, and to false when j is 1 and k is -1; with a
+        # reinforcing dependency, when both are 1 or both are -1 respectively
+        if fixing.nnz > 0:
+            logits += np.asarray(neg.multiply(pos.dot(fixing.T)).sum(axis=1)).ravel()
+            logits -= np.asarray(pos.multiply(neg.dot(fixing.T)).sum(axis=1)).ravel()
+        if reinforcing.nnz > 0:
+            logits += np.asarray(pos.multiply(pos.dot(reinforcing.T)).sum(axis=1)).ravel()
+            logits -= np.asarray(neg.multiply(neg.dot(reinforcing.T)).sum(axis=1)).ravel()
+
+        illegal = (L.data != 0) & (L.data != 1) & (L.data != -1)
+        if np.any(illegal):
+            logits[np.unique(np.repeat(np.arange(shape[0]), np.diff(L.indptr))[illegal])] = np.nan
+        return logits
+
     def _process_dependency_graph(self, L, deps):
         """
         Processes an iterable of triples that specify labeling function dependencies.
@@ -503,11 +565,22 @@ class GenerativeModel(Classifier):
         for dep_name in GenerativeModel.dep_names:
             setattr(self, dep_name, getattr(self, dep_name).tocoo(copy=True))
 
-    def _compile(self, L, init_deps, init_class_prior, LF_acc_prior_weights, is_fixed, cardinalities):
+    def _compile(self, L, init_deps, init_class_prior, LF_acc_prior_weights,
+        is_fixed, cardinalities, labels=None, idxs=None, compile_dir=None,
+        chunk_size=COMPILE_CHUNK_SIZE):
         """Compiles a generative model based on L and the current labeling function
         dependencies.
+
+        Candidate i of the factor graph is row idxs[i] of L (by default, row i),
+        and if labels is not None, labels[idxs[i]] is its value for an extra
+        last labeling function. The arrays are filled chunk_size candidates at
+        a time, and are memory-mapped files in compile_dir if it is set.
         """
+        L = sparse.csr_matrix(L)
         m, n = L.shape
+        if labels is not None:
+            n += 1
+        cardinalities = np.asarray(cardinalities, dtype=np.int64)
 
         n_weights = 1 if self.class_prior else 0
 
@@ -539,10 +612,10 @@ class GenerativeModel(Classifier):
         n_edges *= m
 
         weight = np.zeros(n_weights, Weight)
-        variable = np.zeros(n_vars, Variable)
-        factor = np.zeros(n_factors, Factor)
-        ftv = np.zeros(n_edges, FactorToVar)
-        domain_mask = np.zeros(n_vars, np.bool)
+        variable = _allocate_array(compile_dir, 'variable', n_vars, Variable)
+        factor = _allocate_array(compile_dir, 'factor', n_factors, Factor)
+        ftv = _allocate_array(compile_dir, 'ftv', n_edges, FactorToVar)
+        domain_mask = _allocate_array(compile_dir, 'domain_mask', n_vars, np.bool)
 
         #
         # Compiles weight matrix
@@ -574,88 +647,6 @@ class GenerativeModel(Classifier):
             weight[i]['isFixed'] = False
             weight[i]['initialValue'] = np.float64(init_deps)
 
-        #
-        # Compiles variable matrix
-        #
-        # Internal representation:
-        #   True Class:         0 to (cardinality - 1) are the classes
-        #   Labeling functions: 0 to (cardinality - 1) are the classes
-        #                       cardinality is abstain
-        # Candidates (variables)
-        for i in range(m):
-            variable[i]['isEvidence'] = False
-            variable[i]['initialValue'] = self.rng.randint(cardinalities[i])
-            variable[i]["dataType"] = 0
-            variable[i]["cardinality"] = cardinalities[i]
-
-        # LF label variables -- initial loop to set all variables
-        for i in range(m):
-            for j in range(n):
-                index = m + n * i + j
-                variable[index]["isEvidence"] = 1
-                variable[index]["dataType"] = 0
-                variable[index]["cardinality"] = cardinalities[i] + 1
-                
-                # Default to abstain
-                variable[index]["initialValue"] = cardinalities[i]
-
-        # LF labels -- now set the non-zero labels
-        L_coo = L.tocoo()
-        for L_index in range(L_coo.nnz):
-            data, i, j = L_coo.data[L_index], L_coo.row[L_index], L_coo.col[L_index]
-            index = m + n * i + j
-
-            # Note: Here we need to use the overall cardinality to handle, since
-            # with candidate_ranges not None and self.cardinality > 2, some
-            # candidates could have cardinality == 2...
-            if (self.cardinality == 2):
-                if data == 1:
-                    variable[index]["initialValue"] = 1
-                elif data == 0:
-                    variable[index]["initialValue"] = 2
-                elif data == -1:
-                    variable[index]["initialValue"] = 0
-                else:
-                    raise ValueError("Invalid labeling function output in cell (%d, %d): %d. "
-                                     "Valid values are 1, 0, and -1. " % (i, j, data))
-            else:
-                if data == 0:
-                    variable[index]["initialValue"] = cardinalities[i]
-                elif 1 <= data <= cardinalities[i]:
-                    variable[index]["initialValue"] = data - 1
-                else:
-                    raise ValueError("Invalid labeling function output in cell (%d, %d): %d. "
-                                     "Valid values are 0 to %d. " % (i, j, data, self.cardinalities[i]))
-
-        #
-        # Compiles factor and ftv matrices
-        #
-        # Class prior
-        if self.class_prior:
-            if self.cardinality != 2:
-                raise NotImplementedError("Class Prior not implemented for categorical classes.")
-            for i in range(m):
-                factor[i]["factorFunction"] = FACTORS["DP_GEN_CLASS_PRIOR"]
-                factor[i]["weightId"] = 0
-                factor[i]["featureValue"] = 1
-                factor[i]["arity"] = 1
-                factor[i]["ftv_offset"] = i
-
-                ftv[i]["vid"] = i
-
-            f_off = m
-            ftv_off = m
-            w_off = 1
-        else:
-            f_off = 0
-            ftv_off = 0
-            w_off = 0
-
-        # Factors over labeling function outputs
-        nfactors_for_lf = [(int(self.hasPrior[i]) + int(not is_fixed[i])) for i in range(n)]
-        f_off, ftv_off, w_off = self._compile_output_factors(L, factor, f_off, ftv, ftv_off, w_off, "DP_GEN_LF_ACCURACY",
-                                                             (lambda m, n, i, j: i, lambda m, n, i, j: m + n * i + j), nfactors_for_lf)
-
         optional_name_map = {
             'lf_prior':
                 ('DP_GEN_LF_PRIOR', (
@@ -669,15 +660,6 @@ class GenerativeModel(Classifier):
                     lambda m, n, i, j: m + n * i + j)),
         }
 
-        for optional_name in GenerativeModel.optional_names:
-            if getattr(self, optional_name):
-                if optional_name != 'lf_propensity' and self.cardinality != 2:
-                    raise NotImplementedError(optional_name + " not implemented for categorical classes.")
-                f_off, ftv_off, w_off = self._compile_output_factors(L, factor, f_off, ftv, ftv_off, w_off,
-                                                                     optional_name_map[optional_name][0],
-                                                                     optional_name_map[optional_name][1])
-
-        # Factors for labeling function dependencies
         dep_name_map = {
             'dep_similar':
                 ('DP_GEN_DEP_SIMILAR', (
@@ -699,75 +681,181 @@ class GenerativeModel(Classifier):
                     lambda m, n, i, j, k: m + n * i + k))
         }
 
+        # Check that the factors are supported for the classification setting
+        if self.class_prior and self.cardinality != 2:
+            raise NotImplementedError("Class Prior not implemented for categorical classes.")
+        for optional_name in GenerativeModel.optional_names:
+            if getattr(self, optional_name):
+                if optional_name != 'lf_propensity' and self.cardinality != 2:
+                    raise NotImplementedError(optional_name + " not implemented for categorical classes.")
         CATEGORICAL_DEPS = ['dep_similar', 'dep_exclusive']
         for dep_name in GenerativeModel.dep_names:
-            mat = getattr(self, dep_name)
-            if mat.nnz > 0:
+            if getattr(self, dep_name).nnz > 0:
                 if dep_name not in CATEGORICAL_DEPS and self.cardinality != 2:
                     raise NotImplementedError(
                         dep_name + " not implemented for categorical classes.")
+
+        nfactors_for_lf = [(int(self.hasPrior[i]) + int(not is_fixed[i])) for i in range(n)]
+        for start in range(0, m, chunk_size):
+            end = min(start + chunk_size, m)
+            rows = np.arange(start, end) if idxs is None else idxs[start:end]
+            L_chunk = L[rows]
+            if labels is not None:
+                L_chunk = sparse.hstack([L_chunk, labels[rows].reshape(-1, 1)])
+
+            self._compile_variables(m, n, start, end, sparse.coo_matrix(L_chunk),
+                variable, cardinalities[start:end])
+
+            #
+            # Compiles factor and ftv matrices
+            #
+            # Class prior
+            if self.class_prior:
+                chunk = factor[start:end]
+                chunk["factorFunction"] = FACTORS["DP_GEN_CLASS_PRIOR"]
+                chunk["weightId"] = 0
+                chunk["featureValue"] = 1
+                chunk["arity"] = 1
+                chunk["ftv_offset"] = np.arange(start, end)
+
+                ftv[start:end]["vid"] = np.arange(start, end)
+
+                f_off = m
+                ftv_off = m
+                w_off = 1
+            else:
+                f_off = 0
+                ftv_off = 0
+                w_off = 0
+
+            # Factors over labeling function outputs
+            f_off, ftv_off, w_off = self._compile_output_factors(m, n, start,
+                end, factor, f_off, ftv, ftv_off, w_off, "DP_GEN_LF_ACCURACY",
+                (lambda m, n, i, j: i, lambda m, n, i, j: m + n * i + j),
+                nfactors_for_lf)
+
+            for optional_name in GenerativeModel.optional_names:
+                if getattr(self, optional_name):
+                    f_off, ftv_off, w_off = self._compile_output_factors(m, n,
+                        start, end, factor, f_off, ftv, ftv_off, w_off,
+                        optional_name_map[optional_name][0],
+                        optional_name_map[optional_name][1])
+
+            # Factors for labeling function dependencies
+            for dep_name in GenerativeModel.dep_names:
+                mat = getattr(self, dep_name)
                 for i in range(len(mat.data)):
-                    f_off, ftv_off, w_off = self._compile_dep_factors(L, factor, 
-                        f_off, ftv, ftv_off, w_off, mat.row[i], mat.col[i],
-                        dep_name_map[dep_name][0], dep_name_map[dep_name][1])
+                    f_off, ftv_off, w_off = self._compile_dep_factors(m, n,
+                        start, end, factor, f_off, ftv, ftv_off, w_off,
+                        mat.row[i], mat.col[i], dep_name_map[dep_name][0],
+                        dep_name_map[dep_name][1])
 
         return weight, variable, factor, ftv, domain_mask, n_edges
 
-    def _compile_output_factors(self, L, factors, factors_offset, ftv, 
-        ftv_offset, weight_offset, factor_name, vid_funcs,
+    def _compile_variables(self, m, n, start, end, L_chunk, variable,
+        cardinalities):
+        """
+        Compiles the variables of candidates start to end, given their rows of
+        the label matrix as COO matrix L_chunk and their cardinalities.
+        """
+        # Internal representation:
+        #   True Class:         0 to (cardinality - 1) are the classes
+        #   Labeling functions: 0 to (cardinality - 1) are the classes
+        #                       cardinality is abstain
+        # Candidates (variables)
+        chunk = variable[start:end]
+        chunk['isEvidence'] = False
+        chunk['initialValue'] = (self.rng.random_sample(len(cardinalities)) *
+                                 cardinalities).astype(np.int64)
+        chunk["dataType"] = 0
+        chunk["cardinality"] = cardinalities
+
+        # LF label variables -- default to abstain
+        chunk = variable[m + n * start:m + n * end]
+        chunk["isEvidence"] = 1
+        chunk["dataType"] = 0
+        chunk["cardinality"] = np.repeat(cardinalities + 1, n)
+        chunk["initialValue"] = np.repeat(cardinalities, n)
+
+        # LF labels -- now set the non-zero labels
+        rows, cols = L_chunk.row, L_chunk.col
+        data = L_chunk.data.astype(np.int64)
+
+        # Note: Here we need to use the overall cardinality to handle, since
+        # with candidate_ranges not None and self.cardinality > 2, some
+        # candidates could have cardinality == 2...
+        if (self.cardinality == 2):
+            invalid = (data != 1) & (data != 0) & (data != -1)
+            if np.any(invalid):
+                k = np.argmax(invalid)
+                raise ValueError("Invalid labeling function output in cell (%d, %d): %d. "
+                                 "Valid values are 1, 0, and -1. " % (start + rows[k], cols[k], data[k]))
+            values = np.choose(data + 1, (0, 2, 1))
+        else:
+            invalid = (data < 0) | (data > cardinalities[rows])
+            if np.any(invalid):
+                k = np.argmax(invalid)
+                raise ValueError("Invalid labeling function output in cell (%d, %d): %d. "
+                                 "Valid values are 0 to %d. " % (start + rows[k], cols[k], data[k], cardinalities[rows[k]]))
+            values = np.where(data == 0, cardinalities[rows], data - 1)
+        chunk["initialValue"][n * rows + cols] = values
+
+    def _compile_output_factors(self, m, n, start, end, factors,
+        factors_offset, ftv, ftv_offset, weight_offset, factor_name, vid_funcs,
         nfactors_for_lf=None):
         """
         Compiles factors over the outputs of labeling functions, i.e., for which
         there is one weight per labeling function and one factor per labeling 
-        function-candidate pair.
+        function-candidate pair, for candidates start to end.
         """
-        m, n = L.shape
-
         if nfactors_for_lf == None:
             nfactors_for_lf = [1 for i in range(n)]
 
-        factors_index = factors_offset
-        ftv_index = ftv_offset
-        for i in range(m):
-            w_off = weight_offset
-            for j in range(n):
-                for k in range(nfactors_for_lf[j]):
-                    factors[factors_index]["factorFunction"] = FACTORS[factor_name]
-                    factors[factors_index]["weightId"] = w_off
-                    factors[factors_index]["featureValue"] = 1
-                    factors[factors_index]["arity"] = len(vid_funcs)
-                    factors[factors_index]["ftv_offset"] = ftv_index
-
-                    factors_index += 1
-                    w_off += 1
-
-                    for vid_func in vid_funcs:
-                        ftv[ftv_index]["vid"] = vid_func(m, n, i, j)
-                        ftv_index += 1
-
-        return factors_index, ftv_index, w_off
-
-    def _compile_dep_factors(self, L, factors, factors_offset, ftv, ftv_offset, weight_offset, j, k, factor_name, vid_funcs):
+        # The factors of each candidate, and the LF of each of them
+        lf_index = np.repeat(np.arange(n), nfactors_for_lf)
+        n_lf_factors = len(lf_index)
+        arity = len(vid_funcs)
+
+        f_start = factors_offset + n_lf_factors * start
+        f_end = factors_offset + n_lf_factors * end
+        chunk = factors[f_start:f_end]
+        chunk["factorFunction"] = FACTORS[factor_name]
+        chunk["weightId"] = np.tile(weight_offset + np.arange(n_lf_factors), end - start)
+        chunk["featureValue"] = 1
+        chunk["arity"] = arity
+        chunk["ftv_offset"] = ftv_offset + arity * np.arange(f_start - factors_offset, f_end - factors_offset)
+
+        i = np.arange(start, end).reshape(-1, 1)
+        j = lf_index.reshape(1, -1)
+        for i_var, vid_func in enumerate(vid_funcs):
+            vids = np.broadcast_to(vid_func(m, n, i, j), (end - start, n_lf_factors))
+            ftv[ftv_offset + arity * (f_start - factors_offset) + i_var:
+                ftv_offset + arity * (f_end - factors_offset):arity]["vid"] = vids.ravel()
+
+        return factors_offset + n_lf_factors * m, ftv_offset + arity * n_lf_factors * m, \
+            weight_offset + n_lf_factors
+
+    def _compile_dep_factors(self, m, n, start, end, factors, factors_offset,
+        ftv, ftv_offset, weight_offset, j, k, factor_name, vid_funcs):
         """
         Compiles factors for dependencies between pairs of labeling functions (possibly also depending on the latent
-        class label).
+        class label), for candidates start to end.
         """
-        m, n = L.shape
-
-        for i in range(m):
-            factors_index = factors_offset + i
-            ftv_index = ftv_offset + len(vid_funcs) * i
+        arity = len(vid_funcs)
 
-            factors[factors_index]["factorFunction"] = FACTORS[factor_name]
-            factors[factors_index]["weightId"] = weight_offset
-            factors[factors_index]["featureValue"] = 1
-            factors[factors_index]["arity"] = len(vid_funcs)
-            factors[factors_index]["ftv_offset"] = ftv_index
+        chunk = factors[factors_offset + start:factors_offset + end]
+        chunk["factorFunction"] = FACTORS[factor_name]
+        chunk["weightId"] = weight_offset
+        chunk["featureValue"] = 1
+        chunk["arity"] = arity
+        chunk["ftv_offset"] = ftv_offset + arity * np.arange(start, end)
 
-            for i_var, vid_func in enumerate(vid_funcs):
-                ftv[ftv_index + i_var]["vid"] = vid_func(m, n, i, j, k)
+        i = np.arange(start, end)
+        for i_var, vid_func in enumerate(vid_funcs):
+            ftv[ftv_offset + arity * start + i_var:ftv_offset + arity * end:arity]["vid"] = \
+                vid_func(m, n, i, j, k)
 
-        return factors_offset + m, ftv_offset + len(vid_funcs) * m, weight_offset + 1
+        return factors_offset + m, ftv_offset + arity * m, weight_offset + 1
 
     def _process_learned_weights(self, L, fg, LF_acc_prior_weights, is_fixed):
         _, n = L.shape
@@ -897,6 +985,131 @@ class GenerativeModelWeights(object):
             return False
 
 
+# Names of the factor graph arrays which are memory-mapped files in compile_dir
+COMPILED_ARRAYS = ('variable', 'factor', 'ftv', 'domain_mask', 'vmap', 'factor_index')
+
+
+def _allocate_array(compile_dir, name, size, dtype):
+    """
+    Returns a zeroed array, backed by a memory-mapped file in compile_dir if it
+    is not None
+    """
+    if compile_dir is None:
+        return np.zeros(size, dtype)
+    if not os.path.exists(compile_dir):
+        os.makedirs(compile_dir)
+    X = np.lib.format.open_memmap(os.path.join(compile_dir, name + '.npy'),
+        mode='w+', dtype=dtype, shape=(size,))
+    # NumbSkull only accepts arrays of type np.ndarray, so return a view
+    return X.view(np.ndarray)
+
+
+def _remove_arrays(compile_dir):
+    """Removes the files of the arrays allocated in compile_dir, if it is not None"""
+    if compile_dir is None:
+        return
+    for name in COMPILED_ARRAYS:
+        path = os.path.join(compile_dir, name + '.npy')
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _load_factor_graph(fg, weight, variable, factor, ftv, domain_mask,
+    compile_dir=None):
+    """
+    Adds the factor graph to the NumbSkull instance fg, as fg.loadFactorGraph
+    does, but with its variable-to-factor map and factor index allocated with
+    _allocate_array, rather than in memory, and without a Python loop over the
+    variables
+    """
+    sizes = np.where(variable['dataType'] == 0, 1, variable['cardinality'])
+    offsets = np.cumsum(sizes)
+    variable['vtf_offset'] = offsets - sizes
+    n_vtfs = int(offsets[-1]) if len(offsets) > 0 else 0
+    vmap = _allocate_array(compile_dir, 'vmap', n_vtfs, VarToFactor)
+    factor_index = _allocate_array(compile_dir, 'factor_index',
+        int(factor['arity'].sum()), np.int64)
+    compute_var_map(variable, factor, ftv, vmap, factor_index, domain_mask,
+        np.empty(0, np.int64))
+    fg.loadFactorGraphRaw(weight, variable, factor, ftv, vmap, factor_index)
+
+
+def _dep_weight_matrix(weights, n):
+    """
+    Returns the dependency weights among the first n LFs as an n x n CSR matrix
+    with zero diagonal
+    """
+    W = sparse.csr_matrix(weights, dtype=np.float64)[:n, :n]
+    W = W - sparse.diags(W.diagonal(), 0, shape=(n, n), format='csr')
+    W.eliminate_zeros()
+    return W
+
+
+def _flatten_candidate_ranges(candidate_ranges):
+    """
+    Concatenates candidate ranges into one array, returning it with the offset
+    of each candidate's range (and the total length as a final offset)
+    """
+    lengths = np.array([len(c_range) for c_range in candidate_ranges], dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat_ranges = np.fromiter((v for c_range in candidate_ranges for v in c_range),
+        dtype=np.int64, count=offsets[-1])
+    return flat_ranges, offsets
+
+
+def _find_in_ranges(flat_ranges, range_rows, vals, rows):
+    """
+    Returns the position in flat_ranges of each value in vals within the range
+    of its candidate in rows, or -1 if it is not in that range
+    """
+    if len(vals) == 0 or len(flat_ranges) == 0:
+        return -np.ones(len(vals), dtype=np.int64)
+    # Encode (candidate, value) pairs as single sortable keys, then binary
+    # search those of the values among those of the ranges
+    lo = min(flat_ranges.min(), vals.min())
+    span = max(flat_ranges.max(), vals.max()) - lo + 1
+    range_keys = range_rows * span + (flat_ranges - lo)
+    keys = rows * span + (vals - lo)
+    order = np.argsort(range_keys, kind='mergesort')
+    k = np.searchsorted(range_keys[order], keys)
+    k[k == len(order)] = 0
+    return np.where(range_keys[order][k] == keys, order[k], -1)
+
+
+@jit(nopython=True, nogil=True)
+def _binary_logits(indptr, indices, data, class_prior, lf_accuracy,
+    lf_class_propensity, dep_fixing, dep_reinforcing, logits):
+    """
+    Computes log p(true) - log p(false) for each row of a CSR label matrix,
+    leaving NaN for rows with values outside {-1, 0, 1}
+    """
+    for i in range(len(indptr) - 1):
+        logit = 2 * class_prior
+        for l_index1 in range(indptr[i], indptr[i + 1]):
+            data_j, j = data[l_index1], indices[l_index1]
+            if data_j == 0:
+                continue
+            elif data_j != 1 and data_j != -1:
+                logit = np.nan
+                break
+            logit += 2 * data_j * lf_accuracy[j] + 2 * lf_class_propensity[j]
+
+            for l_index2 in range(indptr[i], indptr[i + 1]):
+                data_k, k = data[l_index2], indices[l_index2]
+                if j != k:
+                    if data_j == -1 and data_k == 1:
+                        logit += dep_fixing[j, k]
+                    elif data_j == 1 and data_k == -1:
+                        logit -= dep_fixing[j, k]
+
+                    if data_j == 1 and data_k == 1:
+                        logit += dep_reinforcing[j, k]
+                    elif data_j == -1 and data_k == -1:
+                        logit -= dep_reinforcing[j, k]
+        logits[i] = logit
+
+
 @jit
 def set_numba_seeds(seed):
     np.random.seed(seed)
@@ -1,6 +1,7 @@
 from .constants import *
-from numba import jit
+from numba import jit, prange
 import numpy as np
+import scipy.sparse as sparse
 
 
 class DependencySelector(object):
@@ -10,7 +11,8 @@ class DependencySelector(object):
     def __init__(self):
         pass
 
-    def select(self, L, higher_order=False, propensity=False, threshold=0.05, truncation=10):
+    def select(self, L, higher_order=False, propensity=False, threshold=0.05, truncation=10,
+               sample_size=None, seed=None):
         """
         Identifies a dependency structure among labeling functions for a given data set.
 
@@ -23,147 +25,220 @@ class DependencySelector(object):
         :param threshold: minimum magnitude weight a dependency must have to be returned (in log scale), also
                           regularization strength
         :param truncation: number of iterations between truncation step for regularization
+        :param sample_size: optionally, the number of candidates to sample uniformly at random
+                            (without replacement) and learn the structure from
+        :param seed: seed for sampling candidates
         :return: collection of tuples of the format (LF 1 index, LF 2 index, dependency type),
                  see snorkel.learning.constants
         """
-        try:
-            L = L.todense()
-        except AttributeError:
-            pass
+        L = sparse.csr_matrix(L)
+        L.sort_indices()
+
+        if sample_size is not None and sample_size < L.shape[0]:
+            rng = np.random.RandomState(seed)
+            L = L[np.sort(rng.choice(L.shape[0], sample_size, replace=False))]
 
         m, n = L.shape
 
-        # Initializes data structures
+        # Initializes data structures, one row of weights per LF
         deps = set()
         n_weights = 2 * n
         if higher_order:
             n_weights += 4 * n
         if propensity:
             n_weights += 1
-        weights = np.zeros((n_weights,))
-        joint = np.zeros((6,))
-        # joint[0] = P(Y = -1, L_j = -1)
-        # joint[1] = P(Y = -1, L_j =  0)
-        # joint[2] = P(Y = -1, L_j =  1)
-        # joint[3] = P(Y =  1, L_j = -1)
-        # joint[4] = P(Y =  1, L_j =  0)
-        # joint[5] = P(Y =  1, L_j =  1)
-
-        for j in range(n):
-            # Initializes weights
-            for k in range(n):
-                weights[k] = 1.0
-            for k in range(n, len(weights)):
-                weights[k] = 0.0
-            if propensity:
-                weights[len(weights) - 1] = 0.0
+        weights = np.zeros((n, n_weights))
+        weights[:, :n] = 1.0
 
-            _fit_deps(m, n, j, L, weights, joint, higher_order, propensity,  threshold, truncation)
+        # The fits for each LF are independent, so are run in parallel
+        _fit_all_deps(m, n, L.indptr, L.indices, L.data.astype(np.int64), weights,
+                      higher_order, propensity, threshold, truncation)
 
+        for j in range(n):
             for k in range(n):
-                if abs(weights[n + k]) > threshold:
+                if abs(weights[j, n + k]) > threshold:
                     deps.add((j, k, DEP_SIMILAR) if j < k else (k, j, DEP_SIMILAR))
                 if higher_order:
-                    if abs(weights[2 * n + k]) > threshold:
+                    if abs(weights[j, 2 * n + k]) > threshold:
                         deps.add((j, k, DEP_REINFORCING))
-                    if abs(weights[3 * n + k]) > threshold:
+                    if abs(weights[j, 3 * n + k]) > threshold:
                         deps.add((k, j, DEP_REINFORCING))
-                    if abs(weights[4 * n + k]) > threshold:
+                    if abs(weights[j, 4 * n + k]) > threshold:
                         deps.add((j, k, DEP_FIXING))
-                    if abs(weights[5 * n + k]) > threshold:
+                    if abs(weights[j, 5 * n + k]) > threshold:
                         deps.add((k, j, DEP_FIXING))
 
         return deps
 
 
+@jit(nopython=True, cache=True, nogil=True, parallel=True)
+def _fit_all_deps(m, n, indptr, indices, data, weights, higher_order, propensity, regularization, truncation):
+    for j in prange(n):
+        _fit_deps(m, n, j, indptr, indices, data, weights[j], higher_order, propensity,
+                  regularization, truncation)
+
+
 @jit(nopython=True, cache=True, nogil=True)
-def _fit_deps(m, n, j, L, weights, joint, higher_order, propensity, regularization, truncation):
+def _fit_deps(m, n, j, indptr, indices, data, weights, higher_order, propensity, regularization, truncation):
+    """
+    Fits the weights of the dependencies of LF j, given a CSR label matrix.
+
+    Only the non-zero labels of each row are visited, by deferring updates to
+    the weights of each other LF k until it next labels a row:
+
+        - Every LF k != j that abstains on a row gets the same update to its
+          similar (and outgoing reinforcing and fixing) weights, so these
+          updates are summed up in an accumulator, and sums of these weights
+          over all LFs k != j are kept to compute the joint distribution.
+
+        - The accuracy (and incoming reinforcing and fixing) weights of LF k
+          only change in regularization steps while it abstains, and shrinking
+          s times by l1delta is the same as shrinking once by s * l1delta.
+    """
     step_size = 1.0 / m
     epochs = 10
     l1delta = regularization * step_size * truncation
     last_weight = len(weights) - 1
+    joint = np.zeros((6,))
+
+    # Accumulated updates of the similar, outgoing reinforcing and outgoing
+    # fixing weights of abstaining LFs, and the accumulator value each LF k's
+    # weights were last brought up to date with
+    acc_sim, acc_rein, acc_fix = 0.0, 0.0, 0.0
+    snap_sim = np.zeros((n,))
+    snap_rein = np.zeros((n,))
+    snap_fix = np.zeros((n,))
+
+    # Sums over LFs k != j of the similar, outgoing reinforcing and outgoing
+    # fixing weights
+    sum_sim, sum_rein, sum_fix = 0.0, 0.0, 0.0
+    for k in range(n):
+        if k != j:
+            sum_sim += weights[n + k]
+            if higher_order:
+                sum_rein += weights[3 * n + k]
+                sum_fix += weights[5 * n + k]
+
+    # Number of regularization steps taken, and the number each LF k's
+    # accuracy and incoming weights were last brought up to date with
+    n_shrinks = 0
+    last_shrink = np.zeros((n,), dtype=np.int64)
 
     for t in range(epochs):
         for i in range(m):
             # Processes a training example
+            row_start, row_end = indptr[i], indptr[i + 1]
+
+            # Finds the label of LF j, and brings the weights of the other
+            # labeling LFs up to date
+            l_ij = 0
+            n_labeled = 0
+            for idx in range(row_start, row_end):
+                k = indices[idx]
+                if k == j:
+                    l_ij = data[idx]
+                elif data[idx] == 1 or data[idx] == -1:
+                    n_labeled += 1
+                    if last_shrink[k] < n_shrinks:
+                        delta = (n_shrinks - last_shrink[k]) * l1delta
+                        weights[k] = _shrink(weights[k], delta)
+                        if higher_order:
+                            weights[2 * n + k] = _shrink(weights[2 * n + k], delta)
+                            weights[4 * n + k] = _shrink(weights[4 * n + k], delta)
+                        last_shrink[k] = n_shrinks
+                    weights[n + k] += acc_sim - snap_sim[k]
+                    snap_sim[k] = acc_sim
+                    if higher_order:
+                        weights[3 * n + k] += acc_rein - snap_rein[k]
+                        snap_rein[k] = acc_rein
+                        weights[5 * n + k] += acc_fix - snap_fix[k]
+                        snap_fix[k] = acc_fix
 
             # First, computes joint and conditional distributions
-            joint[:] = 0, 0, 0, 0, 0, 0
-            for k in range(n):
-                if j == k:
+
+            # Accuracy
+            joint[0] = weights[j]
+            joint[1] = 0.0
+            joint[2] = -weights[j]
+            joint[3] = -weights[j]
+            joint[4] = 0.0
+            joint[5] = weights[j]
+
+            # Sums of the weights of the abstaining LFs k != j
+            abstain_sim, abstain_rein, abstain_fix = sum_sim, sum_rein, sum_fix
+
+            for idx in range(row_start, row_end):
+                k = indices[idx]
+                if k == j:
+                    continue
+                if data[idx] == 1:
+                    # Accuracy
+                    joint[0] -= weights[k]
+                    joint[1] -= weights[k]
+                    joint[2] -= weights[k]
+                    joint[3] += weights[k]
+                    joint[4] += weights[k]
+                    joint[5] += weights[k]
+
+                    # Similar
+                    joint[2] += weights[n + k]
+                    joint[5] += weights[n + k]
+
+                    if higher_order:
+                        # Reinforcement
+                        joint[5] += weights[2 * n + k] + weights[3 * n + k]
+                        joint[1] -= weights[2 * n + k]
+                        joint[4] -= weights[2 * n + k]
+
+                        # Fixing
+                        joint[3] += weights[4 * n + k]
+                        joint[1] -= weights[4 * n + k]
+                        joint[4] -= weights[4 * n + k]
+                        joint[0] += weights[5 * n + k]
+
+                elif data[idx] == -1:
                     # Accuracy
-                    joint[0] += weights[j]
-                    joint[5] += weights[j]
-                    joint[2] -= weights[j]
-                    joint[3] -= weights[j]
+                    joint[0] += weights[k]
+                    joint[1] += weights[k]
+                    joint[2] += weights[k]
+                    joint[3] -= weights[k]
+                    joint[4] -= weights[k]
+                    joint[5] -= weights[k]
+
+                    # Similar
+                    joint[0] += weights[n + k]
+                    joint[3] += weights[n + k]
+
+                    if higher_order:
+                        # Reinforcement
+                        joint[0] += weights[2 * n + k] + weights[3 * n + k]
+                        joint[1] -= weights[2 * n + k]
+                        joint[4] -= weights[2 * n + k]
+
+                        # Fixing
+                        joint[2] += weights[4 * n + k]
+                        joint[1] -= weights[4 * n + k]
+                        joint[4] -= weights[4 * n + k]
+                        joint[5] += weights[5 * n + k]
+
                 else:
-                    if L[i, k] == 1:
-                        # Accuracy
-                        joint[0] -= weights[k]
-                        joint[1] -= weights[k]
-                        joint[2] -= weights[k]
-                        joint[3] += weights[k]
-                        joint[4] += weights[k]
-                        joint[5] += weights[k]
-
-                        # Similar
-                        joint[2] += weights[n + k]
-                        joint[5] += weights[n + k]
+                    continue
 
-                        if higher_order:
-                            # Reinforcement
-                            joint[5] += weights[2 * n + k] + weights[3 * n + k]
-                            joint[1] -= weights[2 * n + k]
-                            joint[4] -= weights[2 * n + k]
-
-                            # Fixing
-                            joint[3] += weights[4 * n + k]
-                            joint[1] -= weights[4 * n + k]
-                            joint[4] -= weights[4 * n + k]
-                            joint[0] += weights[5 * n + k]
-
-                    elif L[i, k] == -1:
-                        # Accuracy
-                        joint[0] += weights[k]
-                        joint[1] += weights[k]
-                        joint[2] += weights[k]
-                        joint[3] -= weights[k]
-                        joint[4] -= weights[k]
-                        joint[5] -= weights[k]
-
-                        # Similar
-                        joint[0] += weights[n + k]
-                        joint[3] += weights[n + k]
+                abstain_sim -= weights[n + k]
+                if higher_order:
+                    abstain_rein -= weights[3 * n + k]
+                    abstain_fix -= weights[5 * n + k]
 
-                        if higher_order:
-                            # Reinforcement
-                            joint[0] += weights[2 * n + k] + weights[3 * n + k]
-                            joint[1] -= weights[2 * n + k]
-                            joint[4] -= weights[2 * n + k]
-
-                            # Fixing
-                            joint[2] += weights[4 * n + k]
-                            joint[1] -= weights[4 * n + k]
-                            joint[4] -= weights[4 * n + k]
-                            joint[5] += weights[5 * n + k]
-
-                    else:
-                        # Similar
-                        joint[1] += weights[n + k]
-                        joint[4] += weights[n + k]
+            # Similar
+            joint[1] += abstain_sim
+            joint[4] += abstain_sim
 
-                        if higher_order:
-                            # Reinforcement
-                            joint[0] -= weights[3 * n + k]
-                            joint[2] -= weights[3 * n + k]
-                            joint[3] -= weights[3 * n + k]
-                            joint[5] -= weights[3 * n + k]
-
-                            # Fixing
-                            joint[0] -= weights[5 * n + k]
-                            joint[2] -= weights[5 * n + k]
-                            joint[3] -= weights[5 * n + k]
-                            joint[5] -= weights[5 * n + k]
+            if higher_order:
+                # Reinforcement and fixing
+                joint[0] -= abstain_rein + abstain_fix
+                joint[2] -= abstain_rein + abstain_fix
+                joint[3] -= abstain_rein + abstain_fix
+                joint[5] -= abstain_rein + abstain_fix
 
             if propensity:
                 joint[0] += weights[last_weight]
@@ -171,16 +246,20 @@ def _fit_deps(m, n, j, L, weights, joint, higher_order, propensity, regularizati
                 joint[3] += weights[last_weight]
                 joint[5] += weights[last_weight]
 
-            joint = np.exp(joint)
-            joint /= np.sum(joint)
+            total = 0.0
+            for b in range(6):
+                joint[b] = np.exp(joint[b])
+                total += joint[b]
+            for b in range(6):
+                joint[b] /= total
 
-            marginal_pos = np.sum(joint[3:6])
-            marginal_neg = np.sum(joint[0:3])
+            marginal_pos = joint[3] + joint[4] + joint[5]
+            marginal_neg = joint[0] + joint[1] + joint[2]
 
-            if L[i, j] == 1:
+            if l_ij == 1:
                 conditional_pos = joint[5] / (joint[2] + joint[5])
                 conditional_neg = joint[2] / (joint[2] + joint[5])
-            elif L[i, j] == -1:
+            elif l_ij == -1:
                 conditional_pos = joint[3] / (joint[0] + joint[3])
                 conditional_neg = joint[0] / (joint[0] + joint[3])
             else:
@@ -189,108 +268,174 @@ def _fit_deps(m, n, j, L, weights, joint, higher_order, propensity, regularizati
 
             # Second, takes likelihood gradient step
 
-            for k in range(n):
-                if j == k:
+            # Accuracy
+            weights[j] -= step_size * (joint[5] + joint[0] - joint[2] - joint[3])
+            if l_ij == 1:
+                weights[j] += step_size * (conditional_pos - conditional_neg)
+            elif l_ij == -1:
+                weights[j] += step_size * (conditional_neg - conditional_pos)
+
+            for idx in range(row_start, row_end):
+                k = indices[idx]
+                if k == j:
+                    continue
+                if data[idx] == 1:
                     # Accuracy
-                    weights[j] -= step_size * (joint[5] + joint[0] - joint[2] - joint[3])
-                    if L[i, j] == 1:
-                        weights[j] += step_size * (conditional_pos - conditional_neg)
-                    elif L[i, j] == -1:
-                        weights[j] += step_size * (conditional_neg - conditional_pos)
-                else:
-                    if L[i, k] == 1:
-                        # Accuracy
-                        weights[k] -= step_size * (marginal_pos - marginal_neg - conditional_pos + conditional_neg)
-
-                        # Similar
-                        weights[n + k] -= step_size * (joint[2] + joint[5])
-                        if L[i, j] == 1:
-                            weights[n + k] += step_size
-
-                        if higher_order:
-                            # Incoming reinforcement
-                            weights[2 * n + k] -= step_size * (joint[5] - joint[1] - joint[4])
-                            if L[i, j] == 1:
-                                weights[2 * n + k] += step_size * conditional_pos
-                            elif L[i, j] == 0:
-                                weights[2 * n + k] += step_size * -1
-
-                            # Outgoing reinforcement
-                            weights[3 * n + k] -= step_size * joint[5]
-                            if L[i, j] == 1:
-                                weights[3 * n + k] += step_size * conditional_pos
-
-                            # Incoming fixing
-                            weights[4 * n + k] -= step_size * (joint[3] - joint[1] - joint[4])
-                            if L[i, j] == -1:
-                                weights[4 * n + k] += step_size * conditional_pos
-                            elif L[i, j] == 0:
-                                weights[4 * n + k] += step_size * -1
-
-                            # Outgoing fixing
-                            weights[5 * n + k] -= step_size * joint[0]
-                            if L[i, j] == -1:
-                                weights[5 * n + k] += step_size * conditional_neg
-                    elif L[i, k] == -1:
-                        # Accuracy
-                        weights[k] -= step_size * (marginal_neg - marginal_pos - conditional_neg + conditional_pos)
-
-                        # Similar
-                        weights[n + k] -= step_size * (joint[0] + joint[3])
-                        if L[i, j] == -1:
-                            weights[n + k] += step_size
-
-                        if higher_order:
-                            # Incoming reinforcement
-                            weights[2 * n + k] -= step_size * (joint[0] - joint[1] - joint[4])
-                            if L[i, j] == -1:
-                                weights[2 * n + k] += step_size * conditional_neg
-                            elif L[i, j] == 0:
-                                weights[2 * n + k] += step_size * -1
-
-                            # Outgoing reinforcement
-                            weights[3 * n + k] -= step_size * joint[0]
-                            if L[i, j] == -1:
-                                weights[3 * n + k] += step_size * conditional_neg
-
-                            # Incoming fixing
-                            weights[4 * n + k] -= step_size * (joint[2] - joint[1] - joint[4])
-                            if L[i, j] == 1:
-                                weights[4 * n + k] += step_size * conditional_neg
-                            elif L[i, j] == 0:
-                                weights[4 * n + k] += step_size * -1
-
-                            # Outgoing fixing
-                            weights[5 * n + k] -= step_size * joint[5]
-                            if L[i, j] == 1:
-                                weights[5 * n + k] += step_size * conditional_pos
-                    else:
-                        # Similar
-                        weights[n + k] -= step_size * (joint[1] + joint[4])
-                        if L[i, j] == 0:
-                            weights[n + k] += step_size
-
-                        if higher_order:
-                            # No effect of incoming reinforcement
-
-                            # Outgoing reinforcement
-                            weights[3 * n + k] -= step_size * (-1 * joint[0] - joint[2] - joint[3] - joint[5])
-                            if L[i, j] != 0:
-                                weights[3 * n + k] += step_size * -1
-
-                            # No effect of incoming fixing
-
-                            # Outgoing fixing
-                            weights[5 * n + k] -= step_size * (-1 * joint[0] - joint[2] - joint[3] - joint[5])
-                            if L[i, j] != 0:
-                                weights[5 * n + k] += step_size * -1
+                    weights[k] -= step_size * (marginal_pos - marginal_neg - conditional_pos + conditional_neg)
+
+                    # Similar
+                    delta = -step_size * (joint[2] + joint[5])
+                    if l_ij == 1:
+                        delta += step_size
+                    weights[n + k] += delta
+                    sum_sim += delta
+
+                    if higher_order:
+                        # Incoming reinforcement
+                        weights[2 * n + k] -= step_size * (joint[5] - joint[1] - joint[4])
+                        if l_ij == 1:
+                            weights[2 * n + k] += step_size * conditional_pos
+                        elif l_ij == 0:
+                            weights[2 * n + k] += step_size * -1
+
+                        # Outgoing reinforcement
+                        delta = -step_size * joint[5]
+                        if l_ij == 1:
+                            delta += step_size * conditional_pos
+                        weights[3 * n + k] += delta
+                        sum_rein += delta
+
+                        # Incoming fixing
+                        weights[4 * n + k] -= step_size * (joint[3] - joint[1] - joint[4])
+                        if l_ij == -1:
+                            weights[4 * n + k] += step_size * conditional_pos
+                        elif l_ij == 0:
+                            weights[4 * n + k] += step_size * -1
+
+                        # Outgoing fixing
+                        delta = -step_size * joint[0]
+                        if l_ij == -1:
+                            delta += step_size * conditional_neg
+                        weights[5 * n + k] += delta
+                        sum_fix += delta
+                elif data[idx] == -1:
+                    # Accuracy
+                    weights[k] -= step_size * (marginal_neg - marginal_pos - conditional_neg + conditional_pos)
+
+                    # Similar
+                    delta = -step_size * (joint[0] + joint[3])
+                    if l_ij == -1:
+                        delta += step_size
+                    weights[n + k] += delta
+                    sum_sim += delta
+
+                    if higher_order:
+                        # Incoming reinforcement
+                        weights[2 * n + k] -= step_size * (joint[0] - joint[1] - joint[4])
+                        if l_ij == -1:
+                            weights[2 * n + k] += step_size * conditional_neg
+                        elif l_ij == 0:
+                            weights[2 * n + k] += step_size * -1
+
+                        # Outgoing reinforcement
+                        delta = -step_size * joint[0]
+                        if l_ij == -1:
+                            delta += step_size * conditional_neg
+                        weights[3 * n + k] += delta
+                        sum_rein += delta
+
+                        # Incoming fixing
+                        weights[4 * n + k] -= step_size * (joint[2] - joint[1] - joint[4])
+                        if l_ij == 1:
+                            weights[4 * n + k] += step_size * conditional_neg
+                        elif l_ij == 0:
+                            weights[4 * n + k] += step_size * -1
+
+                        # Outgoing fixing
+                        delta = -step_size * joint[5]
+                        if l_ij == 1:
+                            delta += step_size * conditional_pos
+                        weights[5 * n + k] += delta
+                        sum_fix += delta
+
+            # The abstaining LFs k != j all get the same updates, which are
+            # accumulated; the labeling LFs are marked as already up to date
+            n_abstain = n - 1 - n_labeled
+
+            # Similar
+            delta = -step_size * (joint[1] + joint[4])
+            if l_ij == 0:
+                delta += step_size
+            acc_sim += delta
+            sum_sim += n_abstain * delta
+
+            if higher_order:
+                # No effect of incoming reinforcement or fixing
+
+                # Outgoing reinforcement and fixing
+                delta = -step_size * (-1 * joint[0] - joint[2] - joint[3] - joint[5])
+                if l_ij != 0:
+                    delta += step_size * -1
+                acc_rein += delta
+                acc_fix += delta
+                sum_rein += n_abstain * delta
+                sum_fix += n_abstain * delta
+
+            for idx in range(row_start, row_end):
+                k = indices[idx]
+                if k != j and (data[idx] == 1 or data[idx] == -1):
+                    snap_sim[k] = acc_sim
+                    snap_rein[k] = acc_rein
+                    snap_fix[k] = acc_fix
 
             if propensity:
                 weights[last_weight] -= step_size * (joint[0] + joint[2] + joint[3] + joint[5])
-                if L[i, j] != 0:
+                if l_ij != 0:
                     weights[last_weight] += step_size
 
-            # Third, takes regularization gradient step
+            # Third, takes regularization gradient step; the similar and
+            # outgoing weights of all LFs are brought up to date and shrunk
+            # now, the others when next used
             if (t * m + i) % truncation == 0:
-                for k in range(len(weights)):
-                    weights[k] = max(0, weights[k] - l1delta) if weights[k] > 0 else min(0, weights[k] + l1delta)
+                n_shrinks += 1
+                weights[j] = _shrink(weights[j], l1delta)
+                if propensity:
+                    weights[last_weight] = _shrink(weights[last_weight], l1delta)
+
+                sum_sim = 0.0
+                for k in range(n):
+                    if k != j:
+                        weights[n + k] = _shrink(weights[n + k] + acc_sim - snap_sim[k], l1delta)
+                        sum_sim += weights[n + k]
+                    snap_sim[k] = 0.0
+                acc_sim = 0.0
+
+                if higher_order:
+                    sum_rein, sum_fix = 0.0, 0.0
+                    for k in range(n):
+                        if k != j:
+                            weights[3 * n + k] = _shrink(weights[3 * n + k] + acc_rein - snap_rein[k], l1delta)
+                            weights[5 * n + k] = _shrink(weights[5 * n + k] + acc_fix - snap_fix[k], l1delta)
+                            sum_rein += weights[3 * n + k]
+                            sum_fix += weights[5 * n + k]
+                        snap_rein[k] = 0.0
+                        snap_fix[k] = 0.0
+                    acc_rein, acc_fix = 0.0, 0.0
+
+    # Brings all weights up to date
+    for k in range(n):
+        if k != j:
+            delta = (n_shrinks - last_shrink[k]) * l1delta
+            weights[k] = _shrink(weights[k], delta)
+            weights[n + k] += acc_sim - snap_sim[k]
+            if higher_order:
+                weights[2 * n + k] = _shrink(weights[2 * n + k], delta)
+                weights[3 * n + k] += acc_rein - snap_rein[k]
+                weights[4 * n + k] = _shrink(weights[4 * n + k], delta)
+                weights[5 * n + k] += acc_fix - snap_fix[k]
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def _shrink(weight, delta):
+    """Shrinks weight towards 0 by delta, without crossing 0"""
+    return max(0, weight - delta) if weight > 0 else min(0, weight + delta)
@@ -15,6 +15,8 @@ except:
 
 from pandas import DataFrame
 
+from ..utils import matrix_stats
+
 # matplotlib.use('Agg')
 # warnings.filterwarnings("ignore", module="matplotlib")
 
@@ -664,7 +666,7 @@ def candidate_coverage(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates which have > 0 (non-zero) labels.**
     """
-    return np.where(sparse_abs(L).sum(axis=1) != 0, 1, 0).sum() / float(L.shape[0])
+    return matrix_stats(L)['candidate_coverage']
 
 
 def LF_coverage(L):
@@ -672,7 +674,7 @@ def LF_coverage(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates that each LF labels.**
     """
-    return np.ravel(sparse_abs(L).sum(axis=0) / float(L.shape[0]))
+    return matrix_stats(L)['coverage']
 
 
 def candidate_overlap(L):
@@ -680,7 +682,7 @@ def candidate_overlap(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates which have > 1 (non-zero) labels.**
     """
-    return np.where(sparse_abs(L).sum(axis=1) > 1, 1, 0).sum() / float(L.shape[0])
+    return matrix_stats(L)['candidate_overlap']
 
 
 def LF_overlaps(L):
@@ -688,8 +690,7 @@ def LF_overlaps(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates that each LF _overlaps with other LFs on_.**
     """
-    L_abs = sparse_abs(L)
-    return np.ravel(np.where(L_abs.sum(axis=1) > 1, 1, 0).T * L_abs / float(L.shape[0]))
+    return matrix_stats(L)['overlaps']
 
 
 def candidate_conflict(L):
@@ -697,7 +698,7 @@ def candidate_conflict(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates which have > 1 (non-zero) labels _which are not equal_.**
     """
-    return np.where(sparse_abs(L).sum(axis=1) != sparse_abs(L.sum(axis=1)), 1, 0).sum() / float(L.shape[0])
+    return matrix_stats(L)['candidate_conflict']
 
 
 def LF_conflicts(L):
@@ -705,8 +706,7 @@ def LF_conflicts(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates that each LF _conflicts with other LFs on_.**
     """
-    L_abs = sparse_abs(L)
-    return np.ravel(np.where(L_abs.sum(axis=1) != sparse_abs(L.sum(axis=1)), 1, 0).T * L_abs / float(L.shape[0]))
+    return matrix_stats(L)['conflicts']
 
 
 def LF_accuracies(L, labels):
@@ -723,7 +723,10 @@ def training_set_summary_stats(L, return_vals=True, verbose=False):
     Return simple summary statistics
     """
     N, M = L.shape
-    coverage, overlap, conflict = candidate_coverage(L), candidate_overlap(L), candidate_conflict(L)
+    stats = matrix_stats(L)
+    coverage = stats['candidate_coverage']
+    overlap  = stats['candidate_overlap']
+    conflict = stats['candidate_conflict']
     if verbose:
         print("=" * 60)
         print("LF Summary Statistics: %s LFs applied to %s candidates" % (M, N))
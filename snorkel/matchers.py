@@ -1,6 +1,10 @@
 import os
 import re
 import warnings
+from bisect import bisect_left, bisect_right
+
+from .candidates import Ngrams
+from .models.context import TemporarySpan, char_to_word_index
 # Travis will not import the PorterStemmer
 if 'CI' not in os.environ:
     try:
@@ -19,9 +23,16 @@ class Matcher(object):
         self.children           = children
         self.opts               = opts
         self.longest_match_only = self.opts.get('longest_match_only', True)
+        self._plan              = None
         self.init()
         self._check_opts()
 
+    def __getstate__(self):
+        # Compiled plans are closures, so are compiled again when needed
+        state = self.__dict__.copy()
+        state['_plan'] = None
+        return state
+
     def init(self):
         pass
 
@@ -58,21 +69,177 @@ class Matcher(object):
         """Gets a tuple that identifies a span for the specific candidate class that c belongs to"""
         return c
 
+    def compile(self):
+        """
+        Compiles the Matcher tree into a single plan, a function of (candidate, sentence,
+        char start, char end) which returns f of the span between these char offsets.
+
+        The plan evaluates the built-in matchers directly over the sentence's text and
+        tokens, without creating span objects for the sub-spans tried by Concat and
+        SlotFillMatch; the children of Union and conjunctions are tried from the one
+        estimated to be cheapest. Matchers which override f or _f (e.g. lambdas) are
+        called on a span object.
+        """
+        if self._plan is None:
+            self._plan = self._compile()[0]
+        return self._plan
+
+    def _compile(self):
+        """Returns the plan of this Matcher, and an estimate of its relative cost"""
+        if _defining_class(type(self), 'f') is not Matcher or len(self.children) > 1:
+            return self._compile_span()
+        own, cost = self._compile_f()
+        if own is None:
+            return self._compile_span()
+        if len(self.children) == 0:
+            return own, cost
+
+        # Evaluate the conjunction from its cheapest side
+        child, child_cost = self.children[0]._compile()
+        first, second = (own, child) if cost <= child_cost else (child, own)
+        return (lambda c, s, a, b: first(c, s, a, b) and second(c, s, a, b)), cost + child_cost
+
+    def _compile_f(self):
+        """Returns the plan of _f and its cost, or (None, None) if it has none"""
+        if _defining_class(type(self), '_f') is Matcher:
+            return (lambda c, s, a, b: True), 0
+        return None, None
+
+    def _compile_span(self):
+        """Returns a plan which calls f on a span object"""
+        f = self.f
+        return (lambda c, s, a, b: f(_span(c, s, a, b))), SPAN_COST
+
+    def apply_context(self, candidate_space, context):
+        """
+        Apply the Matcher to the candidates generated by candidate_space from context
+        Matchers which can find their matches in context directly override this
+        """
+        return self.apply(candidate_space.apply(context))
+
     def apply(self, candidates):
         """
         Apply the Matcher to a **generator** of candidates
         Optionally only takes the longest match (NOTE: assumes this is the *first* match)
         """
-        seen_spans = set()
+        plan = self.compile()
+        seen_spans = self._seen_spans() if self.longest_match_only else None
         for c in candidates:
-            if self.f(c) and (not self.longest_match_only or not any([self._is_subspan(c, s) for s in seen_spans])):
-                if self.longest_match_only:
-                    seen_spans.add(self._get_span(c))
+            sentence = getattr(c, 'sentence', None)
+            match = plan(c, sentence, c.char_start, c.char_end) if sentence is not None else self.f(c)
+            if match and (seen_spans is None or not seen_spans.contains(c)):
+                if seen_spans is not None:
+                    seen_spans.add(c)
                 yield c
 
+    def _seen_spans(self):
+        """Returns an empty index of the spans of accepted candidates, for longest_match_only"""
+        return SeenSpans(self)
+
 
 WORDS = 'words'
 
+# Matches the whitespace following a non-whitespace character
+WS_PREFIX_END = re.compile(r'(?<=\S)\s')
+
+# Estimated relative costs of compiled matchers, used to order their evaluation
+DICTIONARY_COST = 1
+REGEX_COST      = 2
+SPAN_COST       = 10
+
+
+def _defining_class(cls, name):
+    """Returns the class in the MRO of cls which defines attribute name"""
+    for k in cls.__mro__:
+        if name in k.__dict__:
+            return k
+
+
+def _span(c, s, a, b):
+    """Returns the candidate c if given, else a TemporarySpan of sentence s from char a to b"""
+    return c if c is not None else TemporarySpan(sentence=s, char_start=a, char_end=b)
+
+
+def _slice(a, b, start, stop):
+    """Returns the char offsets of the slice [start:stop] of the span from a to b (see TemporarySpan.__getitem__)"""
+    char_start = a if start is None else a + start
+    if stop is None:
+        char_end = b
+    elif stop >= 0:
+        char_end = a + stop - 1
+    else:
+        char_end = b + stop
+    return char_start, char_end
+
+
+def _attrib_tokens(attrib):
+    """Returns a function of (sentence, char start, char end) computing get_attrib_tokens(attrib)"""
+    def tokens(s, a, b):
+        offsets = s.char_offsets
+        return getattr(s, attrib)[char_to_word_index(offsets, a):char_to_word_index(offsets, b) + 1]
+    return tokens
+
+
+def _attrib_span(attrib, sep=" "):
+    """Returns a function of (sentence, char start, char end) computing get_attrib_span(attrib, sep)"""
+    if attrib == WORDS:
+        return lambda s, a, b: s.text[a:b + 1]
+    tokens = _attrib_tokens(attrib)
+    return lambda s, a, b: sep.join(tokens(s, a, b))
+
+
+class SeenSpans(object):
+    """
+    The spans of the candidates accepted by a Matcher, which are checked against
+    each one with the Matcher's _is_subspan
+    """
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.spans   = set()
+
+    def contains(self, c):
+        """Tests if candidate c is a subspan of any of the spans"""
+        for span in self.spans:
+            if self.matcher._is_subspan(c, span):
+                return True
+        return False
+
+    def add(self, c):
+        self.spans.add(self.matcher._get_span(c))
+
+
+class SeenCharSpans(object):
+    """
+    The (char start, char end) spans of the candidates accepted by an NgramMatcher,
+    indexed to check for containment in O(log k).
+
+    Only the spans not contained in any other are kept, sorted by start; their ends
+    are then sorted as well, so a candidate is contained in some span if and only if
+    it is contained in the last one starting at or before it.
+    """
+    def __init__(self):
+        self.starts = []
+        self.ends   = []
+
+    def contains(self, c):
+        """Tests if candidate c is a subspan of any of the spans"""
+        i = bisect_right(self.starts, c.char_start) - 1
+        return i >= 0 and self.ends[i] >= c.char_end
+
+    def add(self, c):
+        start, end = c.char_start, c.char_end
+        if self.contains(c):
+            return
+
+        # Drop the spans which the new one contains; these follow it in the lists
+        i = bisect_left(self.starts, start)
+        j = i
+        while j < len(self.starts) and self.ends[j] <= end:
+            j += 1
+        self.starts[i:j] = [start]
+        self.ends[i:j]   = [end]
+
+
 class NgramMatcher(Matcher):
     """Matcher base class for Ngram objects"""
     def _is_subspan(self, c, span):
@@ -83,6 +250,13 @@ class NgramMatcher(Matcher):
         """Gets a tuple that identifies a span for the specific candidate class that c belongs to"""
         return (c.char_start, c.char_end)
 
+    def _seen_spans(self):
+        # Use the interval index unless the span semantics are overridden
+        if _defining_class(type(self), '_is_subspan') is NgramMatcher \
+            and _defining_class(type(self), '_get_span') is NgramMatcher:
+            return SeenCharSpans()
+        return super(NgramMatcher, self)._seen_spans()
+
 
 class DictionaryMatch(NgramMatcher):
     """Selects candidate Ngrams that match against a given list d"""
@@ -103,6 +277,17 @@ class DictionaryMatch(NgramMatcher):
                 self.stemmer = PorterStemmer()
             self.d = frozenset(self._stem(w) for w in list(self.d))
 
+        # Without a stemmer, each sentence is scanned once for all of its dictionary
+        # matches. To know when to stop extending a token sequence, the prefixes of the
+        # entries that end before a space are kept, and the sorted entries are searched
+        # for sequences followed by no space
+        self.sorted_d    = None
+        self.ws_prefixes = None
+        if self.stemmer is None:
+            self.sorted_d    = sorted(self.d)
+            self.ws_prefixes = frozenset(w[:m.start()] for w in self.d for m in WS_PREFIX_END.finditer(w))
+        self._scanned = (None, None)
+
     def _stem(self, w):
         """Apply stemmer, handling encoding errors"""
         try:
@@ -110,12 +295,116 @@ class DictionaryMatch(NgramMatcher):
         except UnicodeDecodeError:
             return w
 
+    def _is_prefix(self, p, gap):
+        """Checks if an entry starts with p followed by gap and more characters"""
+        if gap and gap.isspace() and p and not p[-1].isspace():
+            return p in self.ws_prefixes
+        k = bisect_left(self.sorted_d, p + gap)
+        if k < len(self.sorted_d) and self.sorted_d[k] == p + gap:
+            k += 1
+        return k < len(self.sorted_d) and self.sorted_d[k].startswith(p + gap)
+
+    def _scan(self, sentence):
+        """
+        Finds all the token sequences of the sentence which are in the dictionary, with
+        a single pass over its tokens: from each token, the sequence is extended for as
+        long as it is the prefix of an entry.
+        Returns the set of their (word start, word end) pairs, or None if the sentence
+        cannot be scanned. As in _f, the words attrib is compared by the sentence text
+        of the sequence, and other attribs by their tokens joined with spaces.
+        """
+        tokens = getattr(sentence, self.attrib)
+        if tokens is None:
+            return None
+        matches = set()
+        if self.attrib == WORDS:
+            offsets = sentence.char_offsets
+            text    = sentence.text.lower() if self.ignore_case else sentence.text
+            ends    = [o + len(w) for o, w in zip(offsets, tokens)]
+            if len(text) != len(sentence.text) or any(b <= a for a, b in zip(ends, ends[1:])) \
+                or any(b < a for a, b in zip(ends, offsets[1:])):
+                return None
+            for i in range(len(tokens)):
+                for j in range(i, len(tokens)):
+                    p = text[offsets[i]:ends[j]]
+                    if p in self.d:
+                        matches.add((i, j))
+                    if j + 1 == len(tokens) or not self._is_prefix(p, text[ends[j]:offsets[j+1]]):
+                        break
+        else:
+            tokens = [t.lower() for t in tokens] if self.ignore_case else tokens
+            for i in range(len(tokens)):
+                p = tokens[i]
+                for j in range(i, len(tokens)):
+                    if j > i:
+                        p = p + ' ' + tokens[j]
+                    if p in self.d:
+                        matches.add((i, j))
+                    if j + 1 == len(tokens) or not self._is_prefix(p, ' '):
+                        break
+        return matches
+
+    def _get_matches(self, sentence):
+        """Returns the result of _scan for the sentence, which is kept for the last one"""
+        if self._scanned[0] is not sentence:
+            self._scanned = (sentence, self._scan(sentence))
+        return self._scanned[1]
+
+    def apply_context(self, candidate_space, context):
+        """
+        For Ngrams, only generates the n-grams found by scanning the sentence, plus the
+        splits of single tokens, rather than testing every n-gram against the dictionary
+        """
+        if type(candidate_space) is not Ngrams or len(self.children) > 0 or self.reverse \
+            or self.sorted_d is None or not hasattr(context, 'char_offsets'):
+            return super(DictionaryMatch, self).apply_context(candidate_space, context)
+        matches = self._get_matches(context)
+        if matches is None:
+            return super(DictionaryMatch, self).apply_context(candidate_space, context)
+        return self.apply(self._ngram_matches(candidate_space, context, matches))
+
+    def _ngram_matches(self, ngrams, context, matches):
+        """
+        Yields the n-grams of ngrams.apply(context) which are in matches, in the same
+        order, along with all the single token splits
+        """
+        offsets, words = context.char_offsets, context.words
+        by_length = {}
+        for i, j in matches:
+            if j - i < ngrams.n_max:
+                by_length.setdefault(j - i + 1, []).append(i)
+        for l in range(2, ngrams.n_max + 1)[::-1]:
+            for i in sorted(by_length.get(l, [])):
+                end = offsets[i+l-1] + len(words[i+l-1]) - 1
+                yield TemporarySpan(char_start=offsets[i], char_end=end, sentence=context)
+
+        # Single tokens are interleaved with their splits
+        singles = set(by_length.get(1, []))
+        for i in range(len(offsets)):
+            start, end = offsets[i], offsets[i] + len(words[i]) - 1
+            if i in singles:
+                yield TemporarySpan(char_start=start, char_end=end, sentence=context)
+            for split in ngrams.split(context, start, end):
+                yield split
+
     def _f(self, c):
         p = c.get_attrib_span(self.attrib)
         p = p.lower() if self.ignore_case else p
         p = self._stem(p) if self.stemmer is not None else p
         return (not self.reverse) if p in self.d else self.reverse
 
+    def _compile_f(self):
+        if _defining_class(type(self), '_f') is not DictionaryMatch:
+            return super(DictionaryMatch, self)._compile_f()
+        span, d, ignore_case, reverse = _attrib_span(self.attrib), self.d, self.ignore_case, self.reverse
+        stem = self._stem if self.stemmer is not None else None
+        def f(c, s, a, b):
+            p = span(s, a, b)
+            p = p.lower() if ignore_case else p
+            p = stem(p) if stem is not None else p
+            return (not reverse) if p in d else reverse
+        return f, DICTIONARY_COST
+
 class LambdaFunctionMatcher(NgramMatcher):
     """Selects candidate Ngrams that return True when fed to a function f."""
     def init(self):
@@ -139,6 +428,18 @@ class Union(NgramMatcher):
                return True
        return False
 
+    def _compile(self):
+        if _defining_class(type(self), 'f') is not Union:
+            return self._compile_span()
+        plans = sorted([child._compile() for child in self.children], key=lambda plan: plan[1])
+        children = [plan for plan, _ in plans]
+        def f(c, s, a, b):
+            for child in children:
+                if child(c, s, a, b) > 0:
+                    return True
+            return False
+        return f, sum(cost for _, cost in plans)
+
 
 class Concat(NgramMatcher):
     """
@@ -174,6 +475,33 @@ class Concat(NgramMatcher):
                     return True
         return False
 
+    def _compile(self):
+        if _defining_class(type(self), 'f') is not Concat or len(self.children) != 2:
+            return self._compile_span()
+        (left, left_cost), (right, right_cost) = [child._compile() for child in self.children]
+        left_required, right_required = self.left_required, self.right_required
+        ignore_sep, sep, permutations = self.ignore_sep, self.sep, self.permutations
+        def f(c, s, a, b):
+            if not left_required and right(c, s, a, b):
+                return True
+            if not right_required and left(c, s, a, b):
+                return True
+
+            # Iterate over the splits at the word boundaries, as char offsets
+            offsets = s.char_offsets
+            span    = s.text[a:b + 1]
+            for wsplit in range(char_to_word_index(offsets, a) + 1, char_to_word_index(offsets, b) + 1):
+                csplit = offsets[wsplit] - a
+                if ignore_sep or span[csplit-1] == sep:
+                    a1, b1 = _slice(a, b, None, csplit - len(sep))
+                    a2, b2 = _slice(a, b, csplit, None)
+                    if left(None, s, a1, b1) and right(None, s, a2, b2):
+                        return True
+                    if permutations and right(None, s, a1, b1) and left(None, s, a2, b2):
+                        return True
+            return False
+        return f, 2 * (left_cost + right_cost)
+
 
 class SlotFillMatch(NgramMatcher):
     """Matches a slot fill pattern of matchers _at the character level_"""
@@ -186,8 +514,9 @@ class SlotFillMatch(NgramMatcher):
 
         # Parse slot fill pattern
         split        = re.split(r'\{(\d+)\}', self.pattern)
-        self._ops    = map(int, split[1::2])
+        self._ops    = list(map(int, split[1::2]))
         self._splits = split[::2]
+        self._rgx    = re.compile(r'(.+)'.join(self._splits) + r'$')
 
         # NOTE: Must have non-null splits!!
         if any([len(s) == 0 for s in self._splits[1:-1]]):
@@ -201,7 +530,7 @@ class SlotFillMatch(NgramMatcher):
     def f(self, c):
 
         # First, filter candidates by matching splits pattern
-        m = re.match(r'(.+)'.join(self._splits) + r'$', c.get_attrib_span(self.attrib))
+        m = self._rgx.match(c.get_attrib_span(self.attrib))
         if m is None:
             return False
 
@@ -211,6 +540,25 @@ class SlotFillMatch(NgramMatcher):
                 return False
         return True
 
+    def _compile(self):
+        if _defining_class(type(self), 'f') is not SlotFillMatch:
+            return self._compile_span()
+        rgx, span = self._rgx, _attrib_span(self.attrib)
+
+        # The slots are tried from the cheapest one
+        slots = sorted([(i + 1,) + self.children[op]._compile() for i, op in enumerate(self._ops)],
+                       key=lambda slot: slot[2])
+        def f(c, s, a, b):
+            m = rgx.match(span(s, a, b))
+            if m is None:
+                return False
+            for g, child, _ in slots:
+                a1, b1 = _slice(a, b, m.start(g), m.end(g))
+                if child(None, s, a1, b1) == 0:
+                    return False
+            return True
+        return f, REGEX_COST + sum(cost for _, _, cost in slots)
+
 
 class RegexMatch(NgramMatcher):
     """Base regex class- does not specify specific semantics of *what* is being matched yet"""
@@ -237,6 +585,12 @@ class RegexMatchSpan(RegexMatch):
     def _f(self, c):
         return True if self.r.match(c.get_attrib_span(self.attrib, sep=self.sep)) is not None else False
 
+    def _compile_f(self):
+        if _defining_class(type(self), '_f') is not RegexMatchSpan:
+            return super(RegexMatchSpan, self)._compile_f()
+        r, span = self.r, _attrib_span(self.attrib, self.sep)
+        return (lambda c, s, a, b: True if r.match(span(s, a, b)) is not None else False), REGEX_COST
+
 
 class RegexMatchEach(RegexMatch):
     """Matches regex pattern on **each token**"""
@@ -244,6 +598,15 @@ class RegexMatchEach(RegexMatch):
         tokens = c.get_attrib_tokens(self.attrib)
         return True if tokens and all([self.r.match(t) is not None for t in tokens]) else False
 
+    def _compile_f(self):
+        if _defining_class(type(self), '_f') is not RegexMatchEach:
+            return super(RegexMatchEach, self)._compile_f()
+        r, get_tokens = self.r, _attrib_tokens(self.attrib)
+        def f(c, s, a, b):
+            tokens = get_tokens(s, a, b)
+            return True if tokens and all(r.match(t) is not None for t in tokens) else False
+        return f, REGEX_COST
+
 
 class PersonMatcher(RegexMatchEach):
     """
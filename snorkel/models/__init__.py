@@ -32,7 +32,8 @@ from .context import construct_stable_id, split_stable_id
 from .candidate import Candidate, candidate_subclass, Marginal
 from .annotation import (
     Feature, FeatureKey, Label, LabelKey, GoldLabel, GoldLabelKey, StableLabel,
-    Prediction, PredictionKey
+    Prediction, PredictionKey, LFFingerprint, TableVersion, get_table_version,
+    bump_table_version, get_database_token
 )
 
 # This call must be performed after all classes that extend SnorkelBase are
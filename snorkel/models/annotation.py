@@ -1,4 +1,6 @@
-from sqlalchemy import Column, String, Integer, Float, ForeignKey, UniqueConstraint
+import random
+
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, UniqueConstraint, event
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship, backref
 
@@ -149,3 +151,78 @@ class StableLabel(SnorkelBase):
 
     def __repr__(self):
         return "%s (%s : %s)" % (self.__class__.__name__, self.annotator_name, self.value)
+
+
+class LFFingerprint(SnorkelBase):
+    """
+    A hash of the labeling function that produced the Labels of a LabelKey for the
+    Candidates of a split, used to re-apply only new or changed labeling functions.
+    """
+    __tablename__ = 'lf_fingerprint'
+    name          = Column(String, primary_key=True)
+    group         = Column(Integer, primary_key=True)
+    split         = Column(Integer, primary_key=True)
+    fingerprint   = Column(String, nullable=False)
+
+    def __repr__(self):
+        return "%s (%s : %s)" % (self.__class__.__name__, self.name, self.fingerprint)
+
+
+# Name of the TableVersion row holding the random token which identifies the database
+DATABASE_TOKEN_NAME = '__database__'
+
+
+class TableVersion(SnorkelBase):
+    """
+    A version counter for a table from which annotation matrices are loaded, e.g.
+    label or candidate. Incremented whenever Snorkel's operators write to the table,
+    and used to invalidate cached annotation matrices.
+
+    The row named DATABASE_TOKEN_NAME instead holds a random token, created along
+    with the table, which tells cached matrices of different databases apart.
+    """
+    __tablename__ = 'table_version'
+    table_name    = Column(String, primary_key=True)
+    version       = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "%s (%s : %s)" % (self.__class__.__name__, self.table_name, self.version)
+
+
+def get_table_version(session, table_name):
+    """Returns the current version of the table, or 0 if it was never written"""
+    version = session.query(TableVersion.version)\
+                     .filter(TableVersion.table_name == table_name).first()
+    return version[0] if version is not None else 0
+
+
+def _new_database_token():
+    return random.SystemRandom().randint(1, 2**31 - 1)
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def _create_database_token(table, connection, **kwargs):
+    connection.execute(table.insert(), {'table_name': DATABASE_TOKEN_NAME,
+                                        'version': _new_database_token()})
+
+
+def get_database_token(session):
+    """
+    Returns the random token identifying the database, creating it if the
+    table_version table predates it
+    """
+    token = get_table_version(session, DATABASE_TOKEN_NAME)
+    if token == 0:
+        token = _new_database_token()
+        session.execute(TableVersion.__table__.insert(),
+                        {'table_name': DATABASE_TOKEN_NAME, 'version': token})
+    return token
+
+
+def bump_table_version(session, table_name):
+    """Increments the version of the table, marking cached matrices loaded from it as stale"""
+    q = TableVersion.__table__.update()\
+                    .where(TableVersion.table_name == table_name)\
+                    .values(version=TableVersion.version + 1)
+    if session.execute(q).rowcount == 0:
+        session.execute(TableVersion.__table__.insert(), {'table_name': table_name, 'version': 1})
@@ -1,8 +1,13 @@
 from .meta import SnorkelBase, snorkel_postgres
+from bisect import bisect_left, bisect_right
+import numpy as np
+from numbers import Integral
+from six import binary_type, text_type
+from six.moves import cPickle as pickle
 from sqlalchemy import Column, String, Integer, Text, ForeignKey, UniqueConstraint
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy.types import PickleType
+from sqlalchemy.types import LargeBinary, PickleType, TypeDecorator
 from sqlalchemy.sql import select, text
 
 
@@ -57,6 +62,102 @@ class Document(Context):
         return "Document " + str(self.name)
 
 
+class PackedArray(TypeDecorator):
+    """
+    A compact binary encoding of a list of ints or strings, used for the token arrays
+    of Sentences on backends without array types; see pack_array. The value loaded
+    from the database is the packed blob itself, which packed_property decodes when
+    accessed.
+    """
+    impl = LargeBinary
+
+    def __init__(self, kind, *args, **kwargs):
+        super(PackedArray, self).__init__(*args, **kwargs)
+        self.kind = kind
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, binary_type):
+            return value
+        return pack_array(value, self.kind)
+
+    def process_result_value(self, value, dialect):
+        return value
+
+
+# Little-endian int types for packed int lists, from narrowest to widest
+PACKED_INT_TYPES = [(b'b', '<i1'), (b'h', '<i2'), (b'i', '<i4')]
+
+
+def pack_array(values, kind):
+    """
+    Packs a list of ints (kind='int') or strings (kind='str') as bytes, starting with
+    a one byte header:
+        b, h, i:    ints, as a little-endian int8, int16 or int32 buffer
+        S:          strings, as one blob of NUL-terminated UTF-8 strings
+        D:          strings with at most 255 distinct values, as the number of distinct
+                    values, these values as above, and a uint8 index for each string
+        P:          any other list, pickled
+    """
+    if kind == 'int' and all(isinstance(v, Integral) for v in values):
+        lo, hi = (min(values), max(values)) if len(values) > 0 else (0, 0)
+        for header, dtype in PACKED_INT_TYPES:
+            info = np.iinfo(dtype)
+            if info.min <= lo and hi <= info.max:
+                return header + np.asarray(values, dtype=dtype).tobytes()
+    elif kind == 'str' and all(isinstance(v, text_type) and u'\0' not in v for v in values):
+        vocab = sorted(set(values))
+        if len(vocab) < 256 and 2 * len(vocab) <= len(values):
+            index = dict((v, i) for i, v in enumerate(vocab))
+            return b'D' + bytearray([len(vocab)]) + \
+                u''.join(v + u'\0' for v in vocab).encode('utf-8') + \
+                np.asarray([index[v] for v in values], dtype=np.uint8).tobytes()
+        return b'S' + u''.join(v + u'\0' for v in values).encode('utf-8')
+    return b'P' + pickle.dumps(values, 2)
+
+
+def unpack_array(packed):
+    """Decodes a list packed by pack_array, or pickled by PickleType"""
+    header, body = packed[:1], packed[1:]
+    for int_header, dtype in PACKED_INT_TYPES:
+        if header == int_header:
+            return np.frombuffer(body, dtype=dtype).tolist()
+    if header == b'S':
+        return body.decode('utf-8').split(u'\0')[:-1]
+    elif header == b'D':
+        n, end = bytearray(body[:1])[0], 1
+        for _ in range(n):
+            end = body.index(b'\0', end) + 1
+        vocab = body[1:end].decode('utf-8').split(u'\0')[:-1]
+        return [vocab[i] for i in np.frombuffer(body[end:], dtype=np.uint8).tolist()]
+    elif header == b'P':
+        return pickle.loads(body)
+    return pickle.loads(packed)
+
+
+class packed_property(object):
+    """
+    Exposes a PackedArray column attribute as a list, which is only decoded when first
+    accessed, and then cached until the attribute changes
+    """
+    def __init__(self, column):
+        self.column = column
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return getattr(cls, self.column)
+        value = getattr(obj, self.column)
+        if not isinstance(value, binary_type):
+            return value
+        cached = obj.__dict__.get('_unpacked_' + self.column)
+        if cached is None or cached[0] is not value:
+            cached = (value, unpack_array(value))
+            obj.__dict__['_unpacked_' + self.column] = cached
+        return cached[1]
+
+    def __set__(self, obj, value):
+        setattr(obj, self.column, value)
+
+
 class Sentence(Context):
     """A sentence Context in a Document."""
     __tablename__ = 'sentence'
@@ -77,16 +178,27 @@ class Sentence(Context):
         entity_cids       = Column(postgresql.ARRAY(String))
         entity_types      = Column(postgresql.ARRAY(String))
     else:
-        words             = Column(PickleType, nullable=False)
-        char_offsets      = Column(PickleType, nullable=False)
-        abs_char_offsets  = Column(PickleType, nullable=False)
-        lemmas            = Column(PickleType)
-        pos_tags          = Column(PickleType)
-        ner_tags          = Column(PickleType)
-        dep_parents       = Column(PickleType)
-        dep_labels        = Column(PickleType)
-        entity_cids       = Column(PickleType)
-        entity_types      = Column(PickleType)
+        _words            = Column('words', PackedArray('str'), nullable=False)
+        _char_offsets     = Column('char_offsets', PackedArray('int'), nullable=False)
+        _abs_char_offsets = Column('abs_char_offsets', PackedArray('int'), nullable=False)
+        _lemmas           = Column('lemmas', PackedArray('str'))
+        _pos_tags         = Column('pos_tags', PackedArray('str'))
+        _ner_tags         = Column('ner_tags', PackedArray('str'))
+        _dep_parents      = Column('dep_parents', PackedArray('int'))
+        _dep_labels       = Column('dep_labels', PackedArray('str'))
+        _entity_cids      = Column('entity_cids', PackedArray('str'))
+        _entity_types     = Column('entity_types', PackedArray('str'))
+
+        words             = packed_property('_words')
+        char_offsets      = packed_property('_char_offsets')
+        abs_char_offsets  = packed_property('_abs_char_offsets')
+        lemmas            = packed_property('_lemmas')
+        pos_tags          = packed_property('_pos_tags')
+        ner_tags          = packed_property('_ner_tags')
+        dep_parents       = packed_property('_dep_parents')
+        dep_labels        = packed_property('_dep_labels')
+        entity_cids       = packed_property('_entity_cids')
+        entity_types      = packed_property('_entity_types')
 
     __mapper_args__ = {
         'polymorphic_identity': 'sentence',
@@ -126,6 +238,16 @@ class Sentence(Context):
         return "Sentence(%s,%s,%s)" % (self.document, self.position, self.text.encode('utf-8'))
 
 
+def char_to_word_index(char_offsets, ci):
+    """Given the sorted char offsets of a sentence's words, return the index of the word char index ci is in"""
+    if len(char_offsets) == 0:
+        return None
+    i = bisect_right(char_offsets, ci)
+    if i > 0 and char_offsets[i-1] == ci:
+        return bisect_left(char_offsets, ci, 0, i)
+    return i - 1
+
+
 class TemporaryContext(object):
     """
     A context which does not incur the overhead of a proper ORM-based Context object.
@@ -138,6 +260,8 @@ class TemporaryContext(object):
     A TemporaryContext must have specified equality / set membership semantics, a stable_id for checking
     uniqueness against the database, and a promote() method which returns a corresponding Context object.
     """
+    __slots__ = ('id',)
+
     def __init__(self):
         self.id = None
 
@@ -182,6 +306,8 @@ class TemporaryContext(object):
 
 class TemporarySpan(TemporaryContext):
     """The TemporaryContext version of Span"""
+    __slots__ = ('sentence', 'char_start', 'char_end', 'meta', '_word_index')
+
     def __init__(self, sentence, char_start, char_end, meta=None):
         super(TemporarySpan, self).__init__()
         self.sentence     = sentence  # The sentence Context of the Span
@@ -228,23 +354,34 @@ class TemporarySpan(TemporaryContext):
                 'meta'      : self.meta}
 
     def get_word_start(self):
-        return self.char_to_word_index(self.char_start)
+        return self._get_word_index()[0]
 
     def get_word_end(self):
-        return self.char_to_word_index(self.char_end)
+        return self._get_word_index()[1]
+
+    def _get_word_index(self):
+        """
+        Returns the word start and end of the span, which are only computed again if its
+        sentence or char offsets change
+        """
+        try:
+            cached = self._word_index
+        except AttributeError:
+            cached = None
+        sentence = self.sentence
+        if cached is None or cached[0] is not sentence or cached[1] != self.char_start \
+            or cached[2] != self.char_end:
+            cached = (sentence, self.char_start, self.char_end,
+                      (self.char_to_word_index(self.char_start), self.char_to_word_index(self.char_end)))
+            self._word_index = cached
+        return cached[3]
 
     def get_n(self):
         return self.get_word_end() - self.get_word_start() + 1
 
     def char_to_word_index(self, ci):
         """Given a character-level index (offset), return the index of the **word this char is in**"""
-        i = None
-        for i, co in enumerate(self.sentence.char_offsets):
-            if ci == co:
-                return i
-            elif ci < co:
-                return i-1
-        return i
+        return char_to_word_index(self.sentence.char_offsets, ci)
 
     def word_to_char_index(self, wi):
         """Given a word-level index, return the character-level index (offset) of the word's start"""
@@ -1,6 +1,7 @@
 from .corenlp import *
 from .corpus_parser import *
 from .doc_preprocessors import *
+from .parse_cache import *
 from .parser import *
 from .spacy_parser import *
 from .rule_parser import *
@@ -2,19 +2,61 @@
 import os
 import sys
 import json
+import re
 import signal
 import socket
 import string
+import time
 import warnings
 
+from requests.exceptions import ConnectionError
 from subprocess import Popen,PIPE
 from collections import defaultdict
+from threading import Lock
 
-from .parser import Parser, URLParserConnection
+from .parser import DEFAULT_POOL_SIZE, Parser, URLParserConnection
 from ..models import Candidate, Context, Document, Sentence, construct_stable_id
 from ..utils import sort_X_on_Y
 
 
+# Seconds a server which failed is avoided for (e.g. while a restarted JVM loads its models)
+SERVER_RETRY_WAIT = 30
+
+# Seconds to wait for the servers to exit on close, before killing them
+SHUTDOWN_TIMEOUT = 10
+
+# Max number of characters per request; the server rejects documents over 100K
+MAX_CHUNK_SIZE = 50000
+
+# Boundaries at which long documents are split into chunks, from most to least preferred
+CHUNK_BOUNDARIES = [re.compile(r'\n\s*\n'), re.compile(r'\n'), re.compile(r'[.!?]\s'), re.compile(r'\s')]
+
+
+def split_text(text, max_chunk_size):
+    '''
+    Split text into chunks of at most max_chunk_size characters, each ending at the
+    last paragraph break, line break, sentence end or whitespace in its second half
+    (in that order of preference), and return them as (offset, chunk) pairs
+
+    :param text:
+    :param max_chunk_size:
+    :return:
+    '''
+    chunks = []
+    start = 0
+    while len(text) - start > max_chunk_size:
+        end = start + max_chunk_size
+        for boundary in CHUNK_BOUNDARIES:
+            matches = list(boundary.finditer(text, start + max_chunk_size // 2, end))
+            if len(matches) > 0:
+                end = matches[-1].end()
+                break
+        chunks.append((start, text[start:end]))
+        start = end
+    chunks.append((start, text[start:]))
+    return chunks
+
+
 class StanfordCoreNLPServer(Parser):
     '''
     Stanford CoreNLP Server
@@ -51,7 +93,8 @@ class StanfordCoreNLPServer(Parser):
 
     def __init__(self, annotators=['tokenize', 'ssplit', 'pos', 'lemma', 'depparse', 'ner'],
                  annotator_opts={}, tokenize_whitespace=False, split_newline=False, encoding="utf-8",
-                 java_xmx='4g', port=12345, num_threads=1, verbose=False, version='3.6.0'):
+                 java_xmx='4g', port=12345, num_threads=1, verbose=False, version='3.6.0',
+                 max_chunk_size=MAX_CHUNK_SIZE, num_servers=1):
         '''
         Create CoreNLP server instance.
         :param annotators:
@@ -63,6 +106,12 @@ class StanfordCoreNLPServer(Parser):
         :param num_threads:
         :param verbose:
         :param version:
+        :param max_chunk_size: documents longer than this many characters are split at
+            paragraph or sentence boundaries, and the chunks parsed concurrently (over
+            up to num_threads requests per server); None disables chunking
+        :param num_servers: number of server JVMs, on consecutive ports from port.
+            Requests go to the server with the fewest outstanding requests (from this
+            process); a server which stops responding is avoided, and restarted if it died
         '''
         super(StanfordCoreNLPServer, self).__init__(name="CoreNLP", encoding=encoding)
 
@@ -77,11 +126,20 @@ class StanfordCoreNLPServer(Parser):
         self.num_threads = num_threads
         self.verbose = verbose
         self.version = version
+        self.max_chunk_size = max_chunk_size
+        self.num_servers = num_servers
 
         # configure connection request options
         opts = self._conn_opts(annotators, annotator_opts, tokenize_whitespace, split_newline)
-        self.endpoint = 'http://127.0.0.1:%d/?%s' % (self.port, opts)
+        self.endpoints = ['http://127.0.0.1:%d/?%s' % (self.port + i, opts) for i in range(num_servers)]
+        self.endpoint = self.endpoints[0]
+
+        # Client-side state for balancing requests over the servers
+        self._lock = Lock()
+        self._outstanding = [0] * num_servers
+        self._avoid_until = [0] * num_servers
 
+        self.process_groups = [None] * num_servers
         self._start_server()
 
         if self.verbose:
@@ -89,23 +147,79 @@ class StanfordCoreNLPServer(Parser):
 
     def _start_server(self, force_load=False):
         '''
-        Launch CoreNLP server
+        Launch the CoreNLP server(s)
         :param force_load:  Force server to pre-load models vs. on-demand
         :return:
         '''
+        # Only the launching process can tell whether a server process died
+        self._owner_pid = os.getpid()
+        for i in range(self.num_servers):
+            self._launch(i)
+        self.process_group = self.process_groups[0]
+
+        if force_load:
+            conn = self.connect()
+            text = "This forces the server to preload all models."
+            for i in range(self.num_servers):
+                content = conn.post(self.endpoints[i], text)
+                StanfordCoreNLPServer.validate_response(content.decode(self.encoding))
+
+    def _launch(self, i):
+        '''
+        Launch the i-th CoreNLP server process
+        :param i:
+        :return:
+        '''
         loc = os.path.join(os.environ['SNORKELHOME'], 'parser')
         cmd = 'java -Xmx%s -cp "%s/*" edu.stanford.nlp.pipeline.StanfordCoreNLPServer --port %d --timeout %d --threads %d > /dev/null'
-        cmd = [cmd % (self.java_xmx, loc, self.port, self.timeout, self.num_threads)]
+        cmd = [cmd % (self.java_xmx, loc, self.port + i, self.timeout, self.num_threads)]
 
         # Setting shell=True returns only the pid of the screen, not any spawned child processes
         # Killing child processes correctly requires using a process group
         # http://stackoverflow.com/questions/4789837/how-to-terminate-a-python-subprocess-launched-with-shell-true
-        self.process_group = Popen(cmd, stdout=PIPE, shell=True, preexec_fn=os.setsid)
+        self.process_groups[i] = Popen(cmd, stdout=PIPE, shell=True, preexec_fn=os.setsid)
 
-        if force_load:
-            conn = self.connect()
-            text = "This forces the server to preload all models."
-            parts = list(conn.parse(None, text))
+    def _acquire_server(self):
+        '''
+        Pick the server with the fewest outstanding requests, among those not being avoided
+        :return:
+        '''
+        with self._lock:
+            now = time.time()
+            servers = [i for i in range(self.num_servers) if self._avoid_until[i] <= now]
+            if len(servers) == 0:
+                servers = range(self.num_servers)
+            i = min(servers, key=lambda i: self._outstanding[i])
+            self._outstanding[i] += 1
+            return i
+
+    def _release_server(self, i):
+        with self._lock:
+            self._outstanding[i] -= 1
+
+    def _server_failed(self, i):
+        '''
+        Avoid the i-th server for a while, and restart it if its process died
+        :param i:
+        :return:
+        '''
+        with self._lock:
+            self._avoid_until[i] = time.time() + SERVER_RETRY_WAIT
+            process = self.process_groups[i]
+            if os.getpid() == self._owner_pid and process is not None and process.poll() is not None:
+                sys.stderr.write('CoreNLP server [{}] on port {} died, restarting...\n'.format(process.pid, self.port + i))
+                self._launch(i)
+                if i == 0:
+                    self.process_group = self.process_groups[0]
+
+    def signature(self):
+        '''
+        Return a string identifying this server's output: its version and annotator options
+        :return:
+        '''
+        opts = self._conn_opts(self.annotators, self.annotator_opts, self.tokenize_whitespace, self.split_newline)
+        return "%s:%s:%s:%s" % (super(StanfordCoreNLPServer, self).signature(), self.version, opts,
+                                self.max_chunk_size)
 
     def _conn_opts(self, annotators, annotator_opts, tokenize_whitespace, split_newline):
         '''
@@ -165,58 +279,142 @@ class StanfordCoreNLPServer(Parser):
         print("-" * 40)
         print(self.endpoint)
         print("version:", self.version)
-        print("shell pid:", self.process_group.pid)
-        print("port:", self.port)
+        print("shell pids:", [process.pid for process in self.process_groups])
+        print("ports:", [self.port + i for i in range(self.num_servers)])
         print("timeout:", self.timeout)
         print("threads:", self.num_threads)
         print("-" * 40)
 
-    def connect(self):
+    def connect(self, pool_size=DEFAULT_POOL_SIZE):
         '''
         Return URL connection object for this server
+        :param pool_size: number of keep-alive connections kept to each server
         :return:
         '''
-        return URLParserConnection(self)
+        return URLParserConnection(self, pool_size=pool_size)
 
     def close(self):
         '''
-        Kill the process group linked with this server.
+        Kill the process groups linked with this server, waiting for them to exit.
         :return:
         '''
-        if self.verbose:
-            print("Killing CoreNLP server [{}]...".format(self.process_group.pid))
-        if self.process_group is not None:
+        process_groups = [process for process in getattr(self, 'process_groups', []) if process is not None]
+        if len(process_groups) == 0 or os.getpid() != getattr(self, '_owner_pid', None):
+            return
+        for process in process_groups:
+            if self.verbose:
+                print("Killing CoreNLP server [{}]...".format(process.pid))
+            self._kill(process, signal.SIGTERM)
+
+        # Force the servers which did not exit in time
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        while time.time() < deadline and any(process.poll() is None for process in process_groups):
+            time.sleep(0.1)
+        for process in process_groups:
+            if process.poll() is None:
+                self._kill(process, signal.SIGKILL)
+        self.process_groups = [None] * self.num_servers
+        self.process_group = None
+
+    def _kill(self, process, sig):
+        try:
+            os.killpg(os.getpgid(process.pid), sig)
+        except Exception as e:
+            sys.stderr.write('Could not kill CoreNLP server [{}] {}\n'.format(process.pid,e))
+
+    def request(self, text, conn):
+        '''
+        POST text to the CoreNLP server, and return its (decoded) JSON response;
+        or None if text is empty, or long enough to be parsed in chunks instead
+
+        :param text:
+        :param conn: server connection
+        :return:
+        '''
+        if len(text.strip()) == 0 or self._needs_chunks(text):
+            return None
+
+        # handle encoding (force to unicode)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8', 'error')
+
+        # POST request to a CoreNLP Server, trying each server once if they fail
+        for attempt in range(self.num_servers):
+            i = self._acquire_server()
             try:
-                os.killpg(os.getpgid(self.process_group.pid), signal.SIGTERM)
-            except Exception as e:
-                sys.stderr.write('Could not kill CoreNLP server [{}] {}\n'.format(self.process_group.pid,e))
+                content = conn.post(self.endpoints[i], text)
+                return content.decode(self.encoding)
+
+            except (socket.error, ConnectionError) as e:
+                self._server_failed(i)
+            finally:
+                self._release_server(i)
+        print>>sys.stderr,"Socket error"
+        raise ValueError("Socket Error")
 
-    def parse(self, document, text, conn):
+    def parse(self, document, text, conn, content=None):
         '''
         Parse CoreNLP JSON results. Requires an external connection/request object to remain threadsafe
 
         :param document:
         :param text:
         :param conn: server connection
+        :param content: the server's response for text, if already requested (see URLParserConnection.pipeline)
         :return:
         '''
         if len(text.strip()) == 0:
             print>> sys.stderr, "Warning, empty document {0} passed to CoreNLP".format(document.name if document else "?")
             return
 
-        # handle encoding (force to unicode)
-        if isinstance(text, unicode):
-            text = text.encode('utf-8', 'error')
+        if content is None and self._needs_chunks(text):
+            for parts in self._parse_chunks(document, text, conn):
+                yield parts
+            return
 
-        # POST request to CoreNLP Server
-        try:
-            content = conn.post(self.endpoint, text)
-            content = content.decode(self.encoding)
+        if content is None:
+            content = self.request(text, conn)
+        for parts in self._parse_content(document, content):
+            yield parts
 
-        except socket.error as e:
-            print>>sys.stderr,"Socket error"
-            raise ValueError("Socket Error")
+    def _needs_chunks(self, text):
+        return self.max_chunk_size is not None and len(text) > self.max_chunk_size
 
+    def _parse_chunks(self, document, text, conn):
+        '''
+        Parse a long document as chunks split at paragraph or sentence boundaries,
+        which are sent to the server concurrently, and stitch their sentences back
+        together with offsets, positions and stable ids relative to the whole document
+
+        :param document:
+        :param text:
+        :param conn: server connection
+        :return:
+        '''
+        if not isinstance(text, unicode):
+            text = text.decode('utf-8')
+        chunks = split_text(text, self.max_chunk_size)
+
+        in_flight = max(1, min(len(chunks), self.num_threads * self.num_servers))
+        responses = conn.pipeline([(offset, chunk) for offset, chunk in chunks], in_flight=in_flight)
+        position = 0
+        for offset, chunk, response in responses:
+            if len(chunk.strip()) == 0:
+                continue
+            for parts in self._parse_content(document, response.result(), offset=offset, position=position):
+                position += 1
+                yield parts
+
+    def _parse_content(self, document, content, offset=0, position=0):
+        '''
+        Parse the CoreNLP JSON response for a document, or for the chunk of it which
+        starts at character offset, and whose first sentence is at position
+
+        :param document:
+        :param content:
+        :param offset:
+        :param position:
+        :return:
+        '''
         # check for parsing error messages
         StanfordCoreNLPServer.validate_response(content)
 
@@ -224,8 +422,8 @@ class StanfordCoreNLPServer(Parser):
             blocks = json.loads(content, strict=False)['sentences']
         except:
             warnings.warn("CoreNLP skipped a malformed document.", RuntimeWarning)
+            blocks = []
 
-        position = 0
         for block in blocks:
             parts = defaultdict(list)
             dep_order, dep_par, dep_lab = [], [], []
@@ -251,10 +449,10 @@ class StanfordCoreNLPServer(Parser):
                 text += (' ' * (i - len(text))) + t['originalText'] if len(text) != i else t['originalText']
             parts['text'] = text
 
-            # make char_offsets relative to start of sentence
-            abs_sent_offset = parts['char_offsets'][0]
-            parts['char_offsets'] = [p - abs_sent_offset for p in parts['char_offsets']]
-            parts['abs_char_offsets'] = [p for p in parts['char_offsets']]
+            # make char_offsets relative to start of sentence, and abs_char_offsets to start of document
+            abs_sent_offset = parts['char_offsets'][0] + offset
+            parts['abs_char_offsets'] = [p + offset for p in parts['char_offsets']]
+            parts['char_offsets'] = [p - abs_sent_offset for p in parts['abs_char_offsets']]
             parts['dep_parents'] = sort_X_on_Y(dep_par, dep_order)
             parts['dep_labels'] = sort_X_on_Y(dep_lab, dep_order)
             parts['position'] = position
@@ -1,33 +1,247 @@
+from collections import defaultdict
+from itertools import islice
+
 from .corenlp import StanfordCoreNLPServer
-from ..models import Candidate, Context, Sentence
+from .doc_preprocessors import DocPreprocessor, DocShard
+from ..models import Candidate, Context, Document, Sentence, bump_table_version
 from ..udf import UDF, UDFRunner
 
 
+# Number of sentences buffered by CorpusParserUDF before being written in bulk
+SENTENCE_BUFFER_SIZE = 10000
+
+# Number of documents of a DocShard parsed between commits
+SHARD_COMMIT_SIZE = 1000
+
+
 class CorpusParser(UDFRunner):
 
-    def __init__(self, parser=None, fn=None):
+    def __init__(self, parser=None, fn=None, cache=None, bulk=False):
+        """
+        :param cache: an optional ParseCache; documents whose text it already has a
+            parse of (by the same parser and options) are not parsed again
+        :param bulk: if True, the parsed Sentences and their Documents are buffered and
+            written with multi-row inserts, instead of being added to the ORM session.
+            Their ids are only reserved when the buffer is written (on SQLite, as
+            MAX(id) + 1, which is not registered anywhere), and the Document objects are
+            left without ids. So the same Documents must not also be written through the
+            ORM, e.g. added to a session by the caller, and other writes to the context
+            table, e.g. by a bulk=False run, must not be interleaved with a bulk run.
+        """
         self.parser = parser or StanfordCoreNLPServer()
+        self.cache = cache
         super(CorpusParser, self).__init__(CorpusParserUDF,
                                            parser=self.parser,
-                                           fn=fn)
+                                           fn=fn,
+                                           cache=cache,
+                                           bulk=bulk)
+
+    def apply(self, xs, in_flight=None, parse_batch_size=None, shards=None,
+        parallelism=None, count=None, **kwargs):
+        """
+        Parse the (document, text) pairs xs into Sentences.
+
+        If shards is set, xs must be a DocPreprocessor, whose input is split into that
+        many DocShards (see DocPreprocessor.shards). Each UDF process then reads and
+        parses the documents of its own shards, so the corpus is never materialized or
+        sent through the input queue. Each shard's Sentences are committed every
+        SHARD_COMMIT_SIZE documents, and progress is printed in documents at each commit
+        instead of with a progress bar over the shards; so a checkpoint cannot be used.
+
+        If parse_batch_size is set, each UDF call parses a chunk of that many documents
+        with the parser's parse_batch (e.g. spaCy's batched pipe). A batch_size is still
+        counted in documents.
+
+        If in_flight is set, a single process keeps up to in_flight documents sent ahead
+        to the parser's server (see URLParserConnection.pipeline), and parses each response
+        while the next ones are outstanding. The server should then run at least in_flight
+        threads, e.g. StanfordCoreNLPServer(num_threads=in_flight).
+        """
+        if in_flight is not None and parse_batch_size is not None:
+            raise ValueError("in_flight cannot be combined with parse_batch_size.")
+        if shards is not None:
+            if in_flight is not None or parse_batch_size is not None:
+                raise ValueError("shards cannot be combined with in_flight or parse_batch_size.")
+            if kwargs.get('checkpoint') is not None:
+                raise ValueError("shards cannot be combined with a checkpoint.")
+            if not isinstance(xs, DocPreprocessor):
+                raise ValueError("shards requires a DocPreprocessor.")
+            xs = xs.shards(shards)
+            kwargs['progress_bar'] = False
+        if in_flight is not None and in_flight > 1:
+            if parallelism is not None and parallelism > 1:
+                raise ValueError("in_flight cannot be combined with parallelism > 1.")
+            conn = self.parser.connect()
+            if not hasattr(conn, 'pipeline'):
+                raise ValueError("Parser %s does not support in_flight requests." % self.parser.name)
+
+            # Pool a keep-alive connection for each request in flight
+            if in_flight > conn.pool_size:
+                conn = self.parser.connect(pool_size=in_flight)
+            if count is None and hasattr(xs, '__len__'):
+                count = len(xs)
+            skip = None
+            if self.cache is not None:
+                skip = lambda text: self.cache.key(self.parser, text) in self.cache
+            xs = conn.pipeline(xs, in_flight=in_flight, skip=skip)
+        elif parse_batch_size is not None:
+            if count is None and hasattr(xs, '__len__'):
+                count = len(xs)
+            if count is not None:
+                count = (count + parse_batch_size - 1) // parse_batch_size
+            if kwargs.get('batch_size') is not None:
+                kwargs['batch_size'] = max(1, kwargs['batch_size'] // parse_batch_size)
+            xs = self._iter_chunks(xs, parse_batch_size)
+        super(CorpusParser, self).apply(xs, parallelism=parallelism, count=count, **kwargs)
+
+    def _iter_chunks(self, xs, size):
+        """Yield lists of up to size consecutive (document, text) pairs"""
+        it = iter(xs)
+        while True:
+            chunk = list(islice(it, size))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
     def clear(self, session, **kwargs):
         session.query(Context).delete()
         # We cannot cascade up from child contexts to parent Candidates,
         # so we delete all Candidates too
         session.query(Candidate).delete()
+        bump_table_version(session, Candidate.__tablename__)
 
 
 class CorpusParserUDF(UDF):
 
-    def __init__(self, parser, fn, **kwargs):
+    def __init__(self, parser, fn, cache=None, bulk=False, **kwargs):
         super(CorpusParserUDF, self).__init__(**kwargs)
         self.parser = parser
         self.req_handler = parser.connect()
         self.fn = fn
+        self.cache = cache
+
+        # For buffering the parts of parsed Sentences when writing in bulk
+        self.bulk = bulk
+        self.sentence_buffer = []
 
     def apply(self, x, **kwargs):
-        """Given a Document object and its raw text, parse into Sentences"""
-        doc, text = x
-        for parts in self.req_handler.parse(doc, text):
+        """
+        Given a Document object and its raw text, parse into Sentences.
+        If x also has the server's pending response for the text, parse that instead;
+        if x is a list of such pairs, parse them together; if x is a DocShard, parse each
+        of its documents.
+        """
+        if isinstance(x, DocShard):
+            n_docs = 0
+            for doc, text in x:
+                for sentence in self.apply((doc, text), **kwargs):
+                    yield sentence
+                n_docs += 1
+
+                # The yielded Sentences have been added to the session by now; commit
+                # them, so that the shard's Sentences are not all held in the session
+                if n_docs % SHARD_COMMIT_SIZE == 0:
+                    self._commit_shard(x, n_docs)
+            self._commit_shard(x, n_docs)
+            return
+        elif isinstance(x, list):
+            parsed = self._parse_batch(x)
+        elif len(x) == 3 and x[2] is not None:
+            doc, text, response = x
+            parsed = self._parse(doc, text, response)
+        else:
+            doc, text = x[:2]
+            parsed = self._parse(doc, text)
+        for parts in parsed:
             parts = self.fn(parts) if self.fn is not None else parts
-            yield Sentence(**parts)
+            if self.bulk:
+                self.sentence_buffer.append(parts)
+            else:
+                yield Sentence(**parts)
+
+        # Documents are only flushed whole, so that each is inserted once
+        if len(self.sentence_buffer) >= SENTENCE_BUFFER_SIZE:
+            self.flush()
+
+    def _commit_shard(self, shard, n_docs):
+        self.flush()
+        self.session.commit()
+        print("Shard %s of %s: %s documents parsed" % (shard.shard + 1, shard.n_shards, n_docs))
+
+    def flush(self):
+        """
+        Inserts the buffered Sentences, and the Documents they belong to which are not
+        in the database yet, using pre-allocated Context ids and multi-row inserts; also
+        writes out the cache's buffered entries
+        """
+        if self.cache is not None:
+            self.cache.flush()
+        if len(self.sentence_buffer) == 0:
+            return
+        sentences, self.sentence_buffer = self.sentence_buffer, []
+
+        # As with the ORM, only Documents which have Sentences are inserted
+        docs, seen = [], set()
+        for parts in sentences:
+            doc = parts.get('document')
+            if doc is not None and doc.id is None and id(doc) not in seen:
+                seen.add(id(doc))
+                docs.append(doc)
+        ids = self._allocate_ids('context', len(docs) + len(sentences))
+        doc_ids = dict((id(doc), cid) for doc, cid in zip(docs, ids))
+
+        context_rows, document_rows, sentence_rows = [], [], []
+        for doc, cid in zip(docs, ids):
+            context_rows.append({'id': cid, 'type': 'document', 'stable_id': doc.stable_id})
+            document_rows.append({'id': cid, 'name': doc.name, 'meta': doc.meta})
+        columns = [c.name for c in Sentence.__table__.columns if c.name not in ('id', 'document_id')]
+        for parts, cid in zip(sentences, ids[len(docs):]):
+            doc = parts.get('document')
+            context_rows.append({'id': cid, 'type': 'sentence', 'stable_id': parts['stable_id']})
+            row = dict((name, parts.get(name)) for name in columns)
+            row['id'] = cid
+            row['document_id'] = doc_ids.get(id(doc), doc.id) if doc is not None else None
+            sentence_rows.append(row)
+
+        self._insert(Context.__table__, context_rows)
+        self._insert(Document.__table__, document_rows)
+        self._insert(Sentence.__table__, sentence_rows)
+
+    def _parse(self, doc, text, response=None):
+        """Return the sentence parts of the document, from the cache if it has them"""
+        if response is not None:
+            parse = lambda: self.req_handler.parse(doc, text, content=response.result())
+        else:
+            parse = lambda: self.req_handler.parse(doc, text)
+        if self.cache is None:
+            return parse()
+
+        key = self.cache.key(self.parser, text)
+        sentences = self.cache.get(key, doc)
+        if sentences is None:
+            sentences = list(parse())
+            self.cache.put(key, doc, sentences)
+        return sentences
+
+    def _parse_batch(self, xs):
+        """Return the sentence parts of a chunk of documents, parsing only those not cached"""
+        if self.cache is None:
+            return self.req_handler.parse_batch(xs)
+
+        keys   = [self.cache.key(self.parser, text) for doc, text in xs]
+        cached = [self.cache.get(key, doc) for key, (doc, text) in zip(keys, xs)]
+        misses = [x for x, sentences in zip(xs, cached) if sentences is None]
+
+        # Group the new parts by their document
+        parsed = defaultdict(list)
+        if len(misses) > 0:
+            for parts in self.req_handler.parse_batch(misses):
+                parsed[id(parts['document'])].append(parts)
+
+        sentences = []
+        for key, (doc, text), doc_sentences in zip(keys, xs, cached):
+            if doc_sentences is None:
+                doc_sentences = parsed[id(doc)]
+                self.cache.put(key, doc, doc_sentences)
+            sentences.extend(doc_sentences)
+        return sentences
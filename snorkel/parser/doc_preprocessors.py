@@ -1,5 +1,7 @@
 import codecs
 import glob
+import io
+import mmap
 import os
 import re
 import lxml.etree as et
@@ -9,6 +11,10 @@ from bs4 import BeautifulSoup
 from ..models import Document
 
 
+# Size of the read buffer used when scanning byte ranges of large files
+READ_BUFFER_SIZE = 1 << 20
+
+
 class DocPreprocessor(object):
     """
     Processes a file or directory of files into a set of Document objects.
@@ -20,26 +26,58 @@ class DocPreprocessor(object):
 
     """
 
+    # Whether parse_file_shard can split a single file into byte ranges
+    splits_files = False
+
     def __init__(self, path, encoding="utf-8", max_docs=float('inf')):
         self.path = path
         self.encoding = encoding
         self.max_docs = max_docs
 
-    def generate(self):
+    def generate(self, shard=0, n_shards=1):
         """
         Parses a file or directory of files into a set of Document objects.
 
+        If n_shards > 1, only parses the shard-th of n_shards disjoint parts of the
+        input: every n_shards-th file, or, for preprocessors which split files, the
+        shard-th byte range of each file. Each shard then stops after its share of
+        max_docs, so that the shards never produce more than max_docs Documents in
+        total; they can produce fewer, and other Documents than with n_shards=1.
         """
+        max_docs = self.max_docs
+        if n_shards > 1 and max_docs != float('inf'):
+            max_docs = (max_docs * (shard + 1)) // n_shards - (max_docs * shard) // n_shards
+        if max_docs <= 0:
+            return
+
         doc_count = 0
+        file_count = 0
         for fp in self._get_files(self.path):
             file_name = os.path.basename(fp)
             if self._can_read(file_name):
-                for doc, text in self.parse_file(fp, file_name):
+                if n_shards == 1:
+                    docs = self.parse_file(fp, file_name)
+                elif self.splits_files:
+                    docs = self.parse_file_shard(fp, file_name, shard, n_shards)
+                elif file_count % n_shards == shard:
+                    docs = self.parse_file(fp, file_name)
+                else:
+                    docs = []
+                file_count += 1
+                for doc, text in docs:
                     yield doc, text
                     doc_count += 1
-                    if doc_count >= self.max_docs:
+                    if doc_count >= max_docs:
                         return
 
+    def shards(self, n_shards):
+        """
+        Returns n_shards DocShards, which together generate the same Documents as this
+        preprocessor, and can each be consumed by a separate process. If max_docs is
+        set, each shard only generates its share of it instead; see generate.
+        """
+        return [DocShard(self, shard, n_shards) for shard in range(n_shards)]
+
     def __iter__(self):
         return self.generate()
 
@@ -49,29 +87,67 @@ class DocPreprocessor(object):
     def parse_file(self, fp, file_name):
         raise NotImplementedError()
 
+    def parse_file_shard(self, fp, file_name, shard, n_shards):
+        """Parses the Documents starting in the shard-th of n_shards byte ranges of a file"""
+        raise NotImplementedError()
+
     def _can_read(self, fpath):
         return not fpath.startswith('.')
 
     def _get_files(self, path):
+        # Files are sorted so that every shard sees them in the same order
         if os.path.isfile(path):
             fpaths = [path]
         elif os.path.isdir(path):
-            fpaths = [os.path.join(path, f) for f in os.listdir(path)]
+            fpaths = [os.path.join(path, f) for f in sorted(os.listdir(path))]
         else:
-            fpaths = glob.glob(path)
+            fpaths = sorted(glob.glob(path))
         if len(fpaths) > 0:
             return fpaths
         else:
             raise IOError("File or directory not found: %s" % (path,))
 
 
+class DocShard(object):
+    """
+    One of the disjoint parts of a DocPreprocessor's input; see DocPreprocessor.shards.
+    Iterating over it generates its (Document, text) pairs.
+    """
+    def __init__(self, preprocessor, shard, n_shards):
+        self.preprocessor = preprocessor
+        self.shard = shard
+        self.n_shards = n_shards
+
+    def __iter__(self):
+        return self.preprocessor.generate(self.shard, self.n_shards)
+
+
+def _byte_range(fp, shard, n_shards):
+    """Returns the start and end offsets of the shard-th of n_shards byte ranges of a file"""
+    size = os.path.getsize(fp)
+    return size * shard // n_shards, size * (shard + 1) // n_shards
+
+
 class TSVDocPreprocessor(DocPreprocessor):
     """Simple parsing of TSV file with one (doc_name <tab> doc_text) per line"""
+    splits_files = True
 
     def parse_file(self, fp, file_name):
-        with codecs.open(fp, encoding=self.encoding) as tsv:
-            for line in tsv:
-                (doc_name, doc_text) = line.split('\t')
+        return self.parse_file_shard(fp, file_name, 0, 1)
+
+    def parse_file_shard(self, fp, file_name, shard, n_shards):
+        start, end = _byte_range(fp, shard, n_shards)
+        with io.open(fp, 'rb', buffering=READ_BUFFER_SIZE) as tsv:
+
+            # Skip the line which started before this range, unless it starts right at it
+            if start > 0:
+                tsv.seek(start - 1)
+                tsv.readline()
+            while tsv.tell() < end:
+                line = tsv.readline()
+                if len(line) == 0:
+                    break
+                (doc_name, doc_text) = line.decode(self.encoding).split('\t')
                 stable_id = self.get_stable_id(doc_name)
                 doc = Document(
                     name=doc_name, stable_id=stable_id,
@@ -204,6 +280,28 @@ class HTMLDocPreprocessor(DocPreprocessor):
         return (''.join(c for c in s if ord(c) < 128)).encode('ascii', 'ignore')
 
 
+def _xml_fragment_encoding(head):
+    """
+    Returns the encoding of an XML file given its first bytes, if elements cut out of
+    the file can be parsed on their own with it; or None if the file's prolog declares
+    a DTD, whose entities the elements may use, or if the encoding is not ASCII-compatible
+    """
+    if head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+        return None
+    first_element = re.search(br'<[^?!]', head)
+    prolog = head[:first_element.start()] if first_element is not None else head
+    if b'<!DOCTYPE' in prolog:
+        return None
+    declaration = re.match(br'(?:\xef\xbb\xbf)?\s*<\?xml[^>]*?encoding\s*=\s*["\']([\w.:\-]+)["\']', prolog)
+    encoding = declaration.group(1).decode('ascii') if declaration is not None else 'utf-8'
+    try:
+        if u'<a/>'.encode(encoding) != b'<a/>':
+            return None
+    except LookupError:
+        return None
+    return encoding
+
+
 class XMLMultiDocPreprocessor(DocPreprocessor):
     """
     Parse an XML file _which contains multiple documents_ into a set of Document
@@ -224,17 +322,70 @@ class XMLMultiDocPreprocessor(DocPreprocessor):
         self.id = id
         self.keep_xml_tree = keep_xml_tree
 
+    @property
+    def splits_files(self):
+        # Byte ranges can only be split on documents given by a plain tag name
+        return self._doc_tag() is not None
+
+    def _doc_tag(self):
+        match = re.match(r'^\.//([\w\-]+)$', self.doc)
+        return match.group(1) if match else None
+
     def parse_file(self, f, file_name):
         for i, doc in enumerate(et.parse(f).xpath(self.doc)):
-            doc_id = str(doc.xpath(self.id)[0])
-            text = '\n'.join(
-                filter(lambda t: t is not None, doc.xpath(self.text))
-            )
-            meta = {'file_name': str(file_name)}
-            if self.keep_xml_tree:
-                meta['root'] = et.tostring(doc)
-            stable_id = self.get_stable_id(doc_id)
-            yield Document(name=doc_id, stable_id=stable_id, meta=meta), text
+            yield self._parse_doc(doc, file_name)
+
+    def parse_file_shard(self, fp, file_name, shard, n_shards):
+        """
+        Parses the documents whose start tag is in the shard-th byte range of the file,
+        scanning the memory-mapped file for their tags. Documents must not be nested,
+        nor use namespaces declared outside of them.
+
+        Files whose documents cannot be parsed on their own, since they declare a DTD
+        or an encoding which is not ASCII-compatible, are parsed whole by the first
+        shard instead.
+        """
+        start, end = _byte_range(fp, shard, n_shards)
+        tag = self._doc_tag().encode('utf-8')
+        start_tag = re.compile(b'<' + re.escape(tag) + b'[\\s/>]')
+        end_tag = b'</' + tag + b'>'
+        with open(fp, 'rb') as f:
+            if os.path.getsize(fp) == 0:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                encoding = _xml_fragment_encoding(mm[:READ_BUFFER_SIZE])
+                if encoding is None:
+                    if shard == 0:
+                        for doc_text in self.parse_file(fp, file_name):
+                            yield doc_text
+                    return
+                parser = et.XMLParser(encoding=encoding)
+                match = start_tag.search(mm, start)
+                while match is not None and match.start() < end:
+                    doc_start = match.start()
+
+                    # Self-closing documents have no end tag
+                    close = mm.find(b'>', doc_start)
+                    if mm[close - 1:close] == b'/':
+                        doc_end = close + 1
+                    else:
+                        doc_end = mm.find(end_tag, doc_start) + len(end_tag)
+                    yield self._parse_doc(et.fromstring(mm[doc_start:doc_end], parser), file_name)
+                    match = start_tag.search(mm, doc_end)
+            finally:
+                mm.close()
+
+    def _parse_doc(self, doc, file_name):
+        doc_id = str(doc.xpath(self.id)[0])
+        text = '\n'.join(
+            filter(lambda t: t is not None, doc.xpath(self.text))
+        )
+        meta = {'file_name': str(file_name)}
+        if self.keep_xml_tree:
+            meta['root'] = et.tostring(doc)
+        stable_id = self.get_stable_id(doc_id)
+        return Document(name=doc_id, stable_id=stable_id, meta=meta), text
 
     def _can_read(self, fpath):
         return fpath.endswith('.xml')
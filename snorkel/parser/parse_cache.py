@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+
+from six import get_unbound_function, text_type
+from six.moves import cPickle as pickle
+
+from ..models import construct_stable_id
+from .parser import Parser
+
+
+# Number of cache lookups and stores buffered by a ParseCache before they are written
+# to the file in one transaction
+WRITE_BUFFER_SIZE = 100
+
+
+class ParseCache(object):
+    '''
+    Content-addressed, on-disk cache of parser output, stored in a SQLite file.
+
+    Entries are keyed by a hash of the document text and the parser's signature
+    (name, version and annotator options), and hold the document's sentence parts,
+    pickled and compressed. Once the entries take up more than max_size bytes,
+    the least recently used ones are evicted. Hit and miss counts and the total
+    size of the entries are kept in the file, so that stats() covers every process
+    using it.
+
+    New entries, last use times and counts are buffered, and written by flush() in a
+    single transaction every WRITE_BUFFER_SIZE operations; CorpusParser flushes the
+    cache before each commit of its own.
+    '''
+    def __init__(self, path, max_size=None):
+        '''
+        :param path: path of the SQLite file
+        :param max_size: max total size of the (compressed) entries, in bytes
+        '''
+        self.path = path
+        self.max_size = max_size
+        self._conn = None
+        self._pid = None
+        self._reset_buffers()
+
+    def __getstate__(self):
+        # Each process opens its own connection, and buffers its own operations
+        state = self.__dict__.copy()
+        state['_conn'], state['_pid'] = None, None
+        state['_puts'], state['_used'], state['_counts'] = {}, {}, {'hits': 0, 'misses': 0}
+        return state
+
+    def _reset_buffers(self):
+        self._puts = {}
+        self._used = {}
+        self._counts = {'hits': 0, 'misses': 0}
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute('CREATE TABLE IF NOT EXISTS parse (key TEXT PRIMARY KEY, '
+                               'value BLOB, size INTEGER, last_used REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS parse_last_used ON parse (last_used)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+            self._conn.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+            if self._conn.execute("SELECT 1 FROM stats WHERE name = 'size'").fetchone() is None:
+                self._conn.execute("INSERT INTO stats SELECT 'size', COALESCE(SUM(size), 0) FROM parse")
+            self._conn.commit()
+        return self._conn
+
+    def key(self, parser, text):
+        '''
+        Return the cache key of text parsed by parser
+        :param parser:
+        :param text:
+        :return:
+        '''
+        # The base signature has no version or options, so its parses could be stale
+        if get_unbound_function(type(parser).signature) is get_unbound_function(Parser.signature):
+            raise ValueError("Parser %s does not override signature() with its version and options, "
+                             "so its parses cannot be cached." % type(parser).__name__)
+        if isinstance(text, text_type):
+            text = text.encode('utf-8')
+        h = hashlib.sha1(parser.signature().encode('utf-8'))
+        h.update(b'\0')
+        h.update(text)
+        return h.hexdigest()
+
+    def __contains__(self, key):
+        if key in self._puts:
+            return True
+        row = self.conn.execute('SELECT 1 FROM parse WHERE key = ?', (key,)).fetchone()
+        return row is not None
+
+    def get(self, key, document):
+        '''
+        Return the cached sentence parts for key, linked to document, or None if the
+        text has not been parsed yet
+        :param key:
+        :param document:
+        :return:
+        '''
+        if key in self._puts:
+            value = self._puts[key]
+        else:
+            row = self.conn.execute('SELECT value FROM parse WHERE key = ?', (key,)).fetchone()
+            value = row[0] if row is not None else None
+        if value is None:
+            self._counts['misses'] += 1
+            self._maybe_flush()
+            return None
+        self._used[key] = time.time()
+        self._counts['hits'] += 1
+        self._maybe_flush()
+
+        entry = pickle.loads(zlib.decompress(value))
+        if document is not None and entry['tree'] is not None:
+            document.meta = dict(document.meta or {}, tree=entry['tree'])
+        sentences = []
+        for parts in entry['sentences']:
+            parts['document'] = document
+
+            # Stable ids are relative to the document, so are rebuilt from their offsets
+            if document is not None and parts.get('stable_id') is not None:
+                start, end = parts['stable_id'].rsplit(':', 2)[1:]
+                parts['stable_id'] = construct_stable_id(document, 'sentence', int(start), int(end))
+            sentences.append(parts)
+        return sentences
+
+    def put(self, key, document, sentences):
+        '''
+        Store the sentence parts parsed from the text with key; the entry is written,
+        and the least recently used entries evicted if max_size is exceeded, on flush
+        :param key:
+        :param document:
+        :param sentences:
+        :return:
+        '''
+        entry = {
+            'sentences': [dict((k, v) for k, v in parts.items() if k != 'document')
+                          for parts in sentences],
+            'tree': document.meta.get('tree') if document is not None and document.meta else None
+        }
+        self._puts[key] = zlib.compress(pickle.dumps(entry, 2))
+        self._used[key] = time.time()
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        n = len(self._puts) + len(self._used) + self._counts['hits'] + self._counts['misses']
+        if n >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the buffered entries, last use times and counts in one transaction
+        :return:
+        '''
+        if len(self._puts) == 0 and len(self._used) == 0 and \
+            self._counts['hits'] == 0 and self._counts['misses'] == 0:
+            return
+        conn = self.conn
+        size = 0
+        for key, value in self._puts.items():
+            old = conn.execute('SELECT size FROM parse WHERE key = ?', (key,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO parse VALUES (?, ?, ?, ?)',
+                         (key, sqlite3.Binary(value), len(value), self._used.get(key, time.time())))
+            size += len(value) - (old[0] if old is not None else 0)
+        conn.executemany('UPDATE parse SET last_used = ? WHERE key = ?',
+                         [(t, key) for key, t in self._used.items() if key not in self._puts])
+        for name, value in [('hits', self._counts['hits']), ('misses', self._counts['misses']),
+                            ('size', size)]:
+            conn.execute('UPDATE stats SET value = value + ? WHERE name = ?', (value, name))
+        if self.max_size is not None:
+            self._evict()
+        conn.commit()
+        self._reset_buffers()
+
+    def _evict(self):
+        '''
+        Delete the least recently used entries until the total size fits max_size
+        '''
+        total = self.conn.execute("SELECT value FROM stats WHERE name = 'size'").fetchone()[0]
+        if total <= self.max_size:
+            return
+        excess = total - self.max_size
+        keys, deleted = [], 0
+        for key, size in self.conn.execute('SELECT key, size FROM parse ORDER BY last_used'):
+            keys.append((key,))
+            deleted += size
+            if deleted >= excess:
+                break
+        self.conn.executemany('DELETE FROM parse WHERE key = ?', keys)
+        self.conn.execute("UPDATE stats SET value = value - ? WHERE name = 'size'", (deleted,))
+
+    def stats(self):
+        '''
+        Return the number and total size of the entries, and the hits, misses and
+        hit rate of lookups
+        :return:
+        '''
+        self.flush()
+        counts = dict(self.conn.execute("SELECT name, value FROM stats"))
+        n = self.conn.execute('SELECT COUNT(*) FROM parse').fetchone()[0]
+        lookups = counts['hits'] + counts['misses']
+        return {
+            'entries': n,
+            'size': counts['size'],
+            'hits': counts['hits'],
+            'misses': counts['misses'],
+            'hit_rate': float(counts['hits']) / lookups if lookups > 0 else 0.0
+        }
+
+    def clear(self):
+        '''
+        Delete all entries and reset the statistics
+        :return:
+        '''
+        self._reset_buffers()
+        self.conn.execute('DELETE FROM parse')
+        self.conn.execute("UPDATE stats SET value = 0")
+        self.conn.commit()
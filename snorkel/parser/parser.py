@@ -2,9 +2,18 @@
 import sys
 import requests
 
+from collections import deque
+from threading import Event, Thread
+try:
+    from queue import Queue
+except:
+    from Queue import Queue
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+# Default number of keep-alive connections pooled by a URLParserConnection
+DEFAULT_POOL_SIZE = 10
+
 
 class Parser(object):
 
@@ -23,6 +32,15 @@ class Parser(object):
         text = text.decode('utf-8')
         return text
 
+    def signature(self):
+        '''
+        Return a string identifying this parser's output, i.e. its type, version and
+        options; used to key parses in a ParseCache. This base signature has neither,
+        so ParseCache only accepts parsers which override it.
+        :return:
+        '''
+        return "%s:%s:%s" % (type(self).__name__, self.name, self.encoding)
+
     def connect(self):
         '''
         Return connection object for this parser type
@@ -51,13 +69,25 @@ class ParserConnection(object):
     def parse(self, document, text):
         return self.parser.parse(document, text)
 
+    def parse_batch(self, xs):
+        '''
+        Return parse generator over a chunk of (document, text) pairs, using the
+        parser's batched parse_batch if it has one
+        :param xs:
+        :return:
+        '''
+        if hasattr(self.parser, 'parse_batch'):
+            return self.parser.parse_batch(xs)
+        return (parts for document, text in xs for parts in self.parse(document, text))
+
 
 class URLParserConnection(ParserConnection):
     '''
     URL parser connection
     '''
-    def __init__(self, parser, retries=5):
+    def __init__(self, parser, retries=5, pool_size=DEFAULT_POOL_SIZE):
         self.retries = retries
+        self.pool_size = pool_size
         self.parser = parser
         self.request = self._connection()
 
@@ -82,7 +112,9 @@ class URLParserConnection(ParserConnection):
         # See: http://stackoverflow.com/questions/30453152/python-multiprocessing-and-requests
         if sys.platform in ['darwin']:
             requests_session.trust_env = False
-        requests_session.mount('http://', HTTPAdapter(max_retries=retries))
+        # Keep-alive connections are pooled, so that pipelined requests reuse them
+        requests_session.mount('http://', HTTPAdapter(max_retries=retries,
+                                                      pool_maxsize=self.pool_size))
         return requests_session
 
     def post(self, url, data, allow_redirects=True):
@@ -97,16 +129,80 @@ class URLParserConnection(ParserConnection):
         resp = self.request.post(url, data=data, allow_redirects=allow_redirects)
         return resp.content.strip()
 
-    def parse(self, document, text):
+    def parse(self, document, text, content=None):
         '''
         Return parse generator
         :param document:
         :param text:
+        :param content: the server's response for text, if already requested
         :return:
         '''
-        return self.parser.parse(document, text, self)
-
-
-
+        return self.parser.parse(document, text, self, content=content)
 
+    def pipeline(self, xs, in_flight=8, skip=None):
+        '''
+        Send the texts of a stream of (document, text) pairs to the server ahead of
+        their parsing, keeping up to in_flight requests outstanding on as many threads.
+        Yields (document, text, PendingResponse) triples in input order, so that the
+        caller can parse each response while the next ones are being processed.
+
+        :param xs: iterable of (document, text) pairs
+        :param in_flight: max number of requests sent ahead
+        :param skip: optional predicate on texts which need not be sent, e.g. because
+            their parse is cached; these are yielded with a None response
+        :return:
+        '''
+        requests_queue = Queue()
+
+        def send():
+            while True:
+                item = requests_queue.get()
+                if item is None:
+                    return
+                text, response = item
+                try:
+                    response.content = self.parser.request(text, self)
+                except Exception as e:
+                    response.error = e
+                response.done.set()
+
+        threads = [Thread(target=send) for _ in range(in_flight)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        window = deque()
+        try:
+            for document, text in xs:
+                response = None
+                if skip is None or not skip(text):
+                    response = PendingResponse()
+                    requests_queue.put((text, response))
+                window.append((document, text, response))
+                if len(window) > in_flight:
+                    yield window.popleft()
+            while len(window) > 0:
+                yield window.popleft()
+        finally:
+            for thread in threads:
+                requests_queue.put(None)
+
+
+class PendingResponse(object):
+    '''
+    The response to a request sent by URLParserConnection.pipeline
+    '''
+    def __init__(self):
+        self.done = Event()
+        self.content = None
+        self.error = None
 
+    def result(self):
+        '''
+        Wait for the response, and return its content or raise its error
+        :return:
+        '''
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.content
@@ -1,5 +1,6 @@
 import re
-from collections import defaultdict
+from itertools import islice
+from six import text_type
 from snorkel.models import construct_stable_id
 from snorkel.parser import Parser, ParserConnection
 
@@ -18,6 +19,15 @@ class Tokenizer(object):
     def apply(self,s):
         raise NotImplementedError()
 
+    def apply_batch(self, texts):
+        '''
+        Tokenize a sequence of texts, yielding the (token, offset) list of each
+        :param texts:
+        :return:
+        '''
+        for s in texts:
+            yield self.apply(s)
+
 class RegexTokenizer(Tokenizer):
     '''
     Regular expression tokenization.
@@ -28,18 +38,18 @@ class RegexTokenizer(Tokenizer):
 
     def apply(self,s):
         '''
-
+        Return the (token, char offset) pairs between the matches of the regex
         :param s:
         :return:
         '''
         tokens = []
-        offset = 0
-        # keep track of char offsets
-        for t in self.rgx.split(s):
-            while t < len(s) and t != s[offset:len(t)]:
-                offset += 1
-            tokens += [(t,offset)]
-            offset += len(t)
+        start = 0
+        for match in self.rgx.finditer(s):
+            if match.start() > start:
+                tokens.append((s[start:match.start()], start))
+            start = match.end()
+        if start < len(s):
+            tokens.append((s[start:], start))
         return tokens
 
 class SpacyTokenizer(Tokenizer):
@@ -55,6 +65,10 @@ class SpacyTokenizer(Tokenizer):
         doc = self.model.tokenizer(s)
         return [(t.text, t.idx) for t in doc]
 
+    def apply_batch(self, texts, batch_size=1000):
+        for doc in self.model.tokenizer.pipe(texts, batch_size=batch_size):
+            yield [(t.text, t.idx) for t in doc]
+
     @staticmethod
     def model_installed(name):
         '''
@@ -107,11 +121,24 @@ class RuleBasedParser(Parser):
         self.sent_boundary = sent_boundary if sent_boundary else RegexTokenizer("[\n\r]+")
 
     def to_unicode(self, text):
-
-        text = text.encode('utf-8', 'error')
-        text = text.decode('string_escape', errors='ignore')
-        text = text.decode('utf-8')
-        return text
+        '''
+        Decode byte strings with the parser's encoding; unicode texts are used as
+        they are. Unlike Parser.to_unicode, backslash escapes are not interpreted,
+        so e.g. a literal backslash-n is kept rather than becoming a newline.
+        :param text:
+        :return:
+        '''
+        if isinstance(text, text_type):
+            return text
+        return text.decode(self.encoding)
+
+    def signature(self):
+        def describe(tokenizer):
+            opts = getattr(tokenizer, 'lang', None) or getattr(getattr(tokenizer, 'rgx', None), 'pattern', None)
+            return "%s(%s)" % (type(tokenizer).__name__, opts)
+        # Parses cached before to_unicode stopped interpreting escapes have no "raw" tag
+        return "%s:%s:%s:raw" % (super(RuleBasedParser, self).signature(),
+                                 describe(self.tokenizer), describe(self.sent_boundary))
 
     def connect(self):
         return ParserConnection(self)
@@ -124,41 +151,78 @@ class RuleBasedParser(Parser):
         :return:
         '''
         text = self.to_unicode(text)
-
-        offset, position = 0, 0
         sentences = self.sent_boundary.apply(text)
+        tokens = self._tokenize([sent for sent, _ in sentences])
+        return self._parse_sentences(document, sentences, tokens)
 
-        for sent,sent_offset in sentences:
-            parts = defaultdict(list)
-            tokens = self.tokenizer.apply(sent)
-            if not tokens:
+    def parse_batch(self, xs):
+        '''
+        Parse a chunk of (document, text) pairs, tokenizing the sentences of all of
+        them in one batch (e.g. with spaCy's tokenizer pipe). Texts are converted
+        with to_unicode as in parse, so both give the same sentences.
+        :param xs:
+        :return:
+        '''
+        docs, texts = [], []
+        for document, text in xs:
+            text = self.to_unicode(text)
+            sentences = self.sent_boundary.apply(text)
+            docs.append((document, sentences))
+            texts.extend(sent for sent, _ in sentences)
+
+        tokens = self._tokenize(texts)
+        for document, sentences in docs:
+            for parts in self._parse_sentences(document, sentences, islice(tokens, len(sentences))):
+                yield parts
+
+    def _tokenize(self, texts):
+        # Tokenizers which do not extend Tokenizer may only implement apply
+        if hasattr(self.tokenizer, 'apply_batch'):
+            return self.tokenizer.apply_batch(texts)
+        return (self.tokenizer.apply(s) for s in texts)
+
+    def _parse_sentences(self, document, sentences, tokens):
+        '''
+        Build the parts of a document's sentences, given as (text, char offset) pairs,
+        from their (token, char offset) lists
+        :param document:
+        :param sentences:
+        :param tokens:
+        :return:
+        '''
+        position = 0
+        for (sent, sent_offset), sent_tokens in zip(sentences, tokens):
+            if not sent_tokens:
                 continue
 
-            parts['words'], parts['char_offsets'] = zip(*tokens)
-            parts['abs_char_offsets'] = [idx + offset for idx in parts['char_offsets']]
-            parts['lemmas'] = []
-            parts['pos_tags'] = []
-            parts['ner_tags'] = []
-            parts['dep_parents'] = []
-            parts['dep_labels'] = []
-            parts['position'] = position
-
+            words = [word for word, _ in sent_tokens]
+            char_offsets = [idx for _, idx in sent_tokens]
+            parts = {
+                'words': words,
+                'char_offsets': char_offsets,
+                'abs_char_offsets': [idx + sent_offset for idx in char_offsets],
+                'lemmas': [],
+                'pos_tags': [],
+                'ner_tags': [],
+                'dep_parents': [],
+                'dep_labels': [],
+                'position': position,
+
+                # Link the sentence to its parent document object
+                'document': document,
+                'text': sent,
+
+                # Add null entity array (matching null for CoreNLP)
+                'entity_cids': ['O'] * len(words),
+                'entity_types': ['O'] * len(words)
+            }
             position += 1
-            offset += len(sent)
-
-            # Link the sentence to its parent document object
-            parts['document'] = document
-            parts['text'] = sent
-
-            # Add null entity array (matching null for CoreNLP)
-            parts['entity_cids'] = ['O' for _ in parts['words']]
-            parts['entity_types'] = ['O' for _ in parts['words']]
 
             # Assign the stable id as document's stable id plus absolute
             # character offset
             abs_sent_offset = parts['abs_char_offsets'][0]
-            abs_sent_offset_end = abs_sent_offset + parts['char_offsets'][-1] + len(parts['words'][-1])
+            abs_sent_offset_end = abs_sent_offset + char_offsets[-1] - char_offsets[0] + len(words[-1])
             if document:
                 parts['stable_id'] = construct_stable_id(document, 'sentence', abs_sent_offset, abs_sent_offset_end)
 
-            yield parts
\ No newline at end of file
+            yield parts
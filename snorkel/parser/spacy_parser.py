@@ -1,15 +1,26 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 from snorkel.models import construct_stable_id
 from snorkel.parser import Parser, ParserConnection
 
 try:
     import spacy
     from spacy.cli import download
-    from spacy import util
+    from spacy import about, util
     from spacy.deprecated import resolve_model_name
 except:
     raise Exception("spaCy not installed. Use `pip install spacy`.")
 
+# First spaCy version whose Language.pipe can run in several processes
+SPACY_N_PROCESS_VERSION = (2, 2)
+
+
+def spacy_version():
+    '''
+    Return the (major, minor) version of the installed spaCy
+    :return:
+    '''
+    return tuple(int(v) for v in about.__version__.split('.')[:2])
+
 
 class Spacy(Parser):
     '''
@@ -44,11 +55,28 @@ class Spacy(Parser):
 
     '''
     def __init__(self, annotators=['tagger', 'parser', 'entity'],
-                 lang='en', num_threads=1, verbose=False):
-
+                 lang='en', num_threads=1, batch_size=1000, n_process=1,
+                 verbose=False):
+        '''
+        :param annotators:
+        :param lang:
+        :param num_threads:
+        :param batch_size: number of documents per spaCy batch in parse_batch
+        :param n_process: number of processes used by parse_batch; values > 1 run
+            the model's whole pipeline, need spaCy >= 2.2, and cannot be used from
+            daemonic (parallel) UDFs
+        :param verbose:
+        '''
+        if n_process > 1 and spacy_version() < SPACY_N_PROCESS_VERSION:
+            raise ValueError("n_process > 1 requires spaCy >= %d.%d, but spaCy %s is installed"
+                             % (SPACY_N_PROCESS_VERSION + (about.__version__,)))
         super(Spacy, self).__init__(name="spacy")
+        self.lang = lang
+        self.annotators = annotators
         self.model = Spacy.load_lang_model(lang)
         self.num_threads = num_threads
+        self.batch_size = batch_size
+        self.n_process = n_process
 
         self.pipeline = []
         for proc in annotators:
@@ -86,6 +114,10 @@ class Spacy(Parser):
             download(lang)
         return spacy.load(lang)
 
+    def signature(self):
+        return "%s:%s:%s:%s" % (super(Spacy, self).signature(), about.__version__,
+                                self.lang, ",".join(self.annotators))
+
     def connect(self):
         return ParserConnection(self)
 
@@ -101,6 +133,42 @@ class Spacy(Parser):
         doc = self.model.tokenizer(text)
         for proc in self.pipeline:
             proc(doc)
+        return self._parse_doc(document, doc)
+
+    def parse_batch(self, xs):
+        '''
+        Parse a stream of (document, text) pairs with spaCy's batched pipe, yielding
+        the parts of every sentence of every document, in order
+        :param xs:
+        :return:
+        '''
+        # The documents are queued as their texts are consumed, since pipe keeps the order
+        documents = deque()
+        def texts():
+            for document, text in xs:
+                documents.append(document)
+                yield self.to_unicode(text)
+
+        if self.n_process > 1:
+            docs = self.model.pipe(texts(), batch_size=self.batch_size,
+                                   n_process=self.n_process)
+        else:
+            docs = self.model.tokenizer.pipe(texts(), batch_size=self.batch_size)
+            for proc in self.pipeline:
+                docs = proc.pipe(docs, batch_size=self.batch_size,
+                                 n_threads=self.num_threads)
+
+        for doc in docs:
+            for parts in self._parse_doc(documents.popleft(), doc):
+                yield parts
+
+    def _parse_doc(self, document, doc):
+        '''
+        Transform a parsed spaCy Doc into sentence parts
+        :param document:
+        :param doc:
+        :return:
+        '''
         assert doc.is_parsed
 
         position = 0
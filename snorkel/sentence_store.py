@@ -0,0 +1,258 @@
+import numpy as np
+from six.moves import cPickle as pickle
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .models import Document, Sentence
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# Token array attributes of Sentence, and whether each holds strings or ints
+SENTENCE_ARRAY_FIELDS = [
+    ('words', 'str'),
+    ('char_offsets', 'int'),
+    ('abs_char_offsets', 'int'),
+    ('lemmas', 'str'),
+    ('pos_tags', 'str'),
+    ('ner_tags', 'str'),
+    ('dep_parents', 'int'),
+    ('dep_labels', 'str'),
+    ('entity_cids', 'str'),
+    ('entity_types', 'str')
+]
+
+# Number of Sentences per record batch written by export_sentences
+EXPORT_BATCH_SIZE = 10000
+
+# Max number of Document ids per IN clause when loading the Documents of a batch
+DOCUMENT_SELECT_BATCH_SIZE = 500
+
+# Min number of Sentences materialized at a time when iterating over a SentenceStore
+READ_BATCH_SIZE = 10000
+
+
+def _check_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required to read or write sentence files.")
+
+
+def sentence_schema():
+    """Returns the Arrow schema of a sentence file, with one row per Sentence"""
+    _check_pyarrow()
+    fields = [
+        pa.field('id', pa.int64()),
+        pa.field('document_id', pa.int64()),
+        pa.field('document_name', pa.string()),
+        pa.field('document_stable_id', pa.string()),
+        pa.field('document_meta', pa.binary()),
+        pa.field('position', pa.int32()),
+        pa.field('stable_id', pa.string()),
+        pa.field('text', pa.string())
+    ]
+    for name, kind in SENTENCE_ARRAY_FIELDS:
+        fields.append(pa.field(name, pa.list_(pa.string() if kind == 'str' else pa.int32())))
+    return pa.schema(fields)
+
+
+def export_sentences(session, path, sentences=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Writes Sentences to an Arrow file at path, which can then be read by a
+    SentenceStore instead of the database.
+
+    Rows are written in (document, position) order, with list columns for the token
+    arrays; the Document meta is stored with the first Sentence of each Document.
+
+    :param session: a SnorkelSession
+    :param path: path of the Arrow file
+    :param sentences: a query of the Sentences to write; defaults to all of them
+    :param batch_size: number of Sentences per record batch
+    :return: the number of Sentences written
+    """
+    _check_pyarrow()
+    sentences = sentences if sentences is not None else session.query(Sentence)
+    sentences = sentences.order_by(None).order_by(Sentence.document_id, Sentence.position)
+
+    schema = sentence_schema()
+    sink   = pa.OSFile(path, 'wb')
+    writer = pa.ipc.new_file(sink, schema)
+    n, last_document_id = 0, None
+    for batch in _batches(sentences.yield_per(batch_size), batch_size):
+        # Only the Documents of the batch's Sentences are loaded
+        document_ids = list(set(s.document_id for s in batch))
+        documents = {}
+        for i in range(0, len(document_ids), DOCUMENT_SELECT_BATCH_SIZE):
+            ids = document_ids[i:i+DOCUMENT_SELECT_BATCH_SIZE]
+            documents.update((d.id, d) for d in session.query(Document).filter(Document.id.in_(ids)))
+
+        columns = dict((name, []) for name in schema.names)
+        for s in batch:
+            document = documents[s.document_id]
+            columns['id'].append(s.id)
+            columns['document_id'].append(s.document_id)
+            columns['document_name'].append(document.name)
+            columns['document_stable_id'].append(document.stable_id)
+            columns['document_meta'].append(pickle.dumps(document.meta, 2)
+                                            if s.document_id != last_document_id else None)
+            columns['position'].append(s.position)
+            columns['stable_id'].append(s.stable_id)
+            columns['text'].append(s.text)
+            for name, _ in SENTENCE_ARRAY_FIELDS:
+                value = getattr(s, name)
+                columns[name].append(list(value) if value is not None else None)
+            last_document_id = s.document_id
+            n += 1
+        writer.write_batch(_record_batch(columns, schema))
+    writer.close()
+    sink.close()
+    return n
+
+
+def _batches(xs, batch_size):
+    """Yields the items of xs in lists of up to batch_size"""
+    batch = []
+    for x in xs:
+        batch.append(x)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _record_batch(columns, schema):
+    arrays = [pa.array(columns[f.name], type=f.type) for f in schema]
+    return pa.RecordBatch.from_arrays(arrays, schema.names)
+
+
+class SentenceStore(object):
+    """
+    Read-only access to Sentences exported by export_sentences, so that candidate
+    extraction and featurization can run without reading them from the database.
+
+    The file is memory-mapped, and Sentences are materialized, along with all the
+    other Sentences of their Documents, as transient Sentence and Document objects
+    which keep the ids of their database rows. A SentenceStore can be passed as the
+    input of a CandidateExtractor, and as sentence_store to an Annotator's apply.
+    """
+    def __init__(self, path):
+        """
+        :param path: path of an Arrow file written by export_sentences
+        """
+        _check_pyarrow()
+        self.path = path
+        self._open()
+
+    def _open(self):
+        self.table = pa.ipc.open_file(pa.memory_map(self.path, 'r')).read_all()
+
+        # Index the rows by Sentence id, and find the row range of each Document
+        self.ids = self.table.column('id').to_numpy()
+        self.id_order = np.argsort(self.ids, kind='mergesort')
+        document_ids = self.table.column('document_id').to_numpy()
+        if len(document_ids) == 0:
+            self.doc_starts = self.doc_ends = np.empty(0, dtype=np.int64)
+            return
+        starts = np.flatnonzero(np.diff(document_ids)) + 1
+        self.doc_starts = np.concatenate([[0], starts]).astype(np.int64)
+        self.doc_ends = np.concatenate([starts, [len(document_ids)]]).astype(np.int64)
+
+    def __getstate__(self):
+        # The file is mapped again by each process
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._open()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __iter__(self):
+        """Yields all the Sentences, in (document, position) order"""
+        i = 0
+        while i < len(self.doc_starts):
+            j = int(np.searchsorted(self.doc_starts, self.doc_starts[i] + READ_BATCH_SIZE))
+            j = max(j, i + 1)
+            for document in self._load_documents(np.arange(i, j)):
+                for sentence in document.sentences:
+                    yield sentence
+            i = j
+
+    def documents(self):
+        """Yields all the Documents, with their Sentences"""
+        for i in range(0, len(self.doc_starts), READ_BATCH_SIZE):
+            for document in self._load_documents(np.arange(i, min(i + READ_BATCH_SIZE, len(self.doc_starts)))):
+                yield document
+
+    def get(self, sentence_ids):
+        """
+        Returns a dict of the Sentences with the given ids, loading the Documents
+        which contain them with a single read. Unknown ids are left out.
+        """
+        sentence_ids = np.asarray(list(sentence_ids), dtype=np.int64)
+        if len(sentence_ids) == 0 or len(self.ids) == 0:
+            return {}
+        pos = np.searchsorted(self.ids, sentence_ids, sorter=self.id_order)
+        pos[pos == len(self.ids)] = 0
+        rows = self.id_order[pos]
+        rows = rows[self.ids[rows] == sentence_ids]
+        doc_idxs = np.unique(np.searchsorted(self.doc_starts, rows, side='right') - 1)
+
+        sentences = {}
+        for document in self._load_documents(doc_idxs):
+            for sentence in document.sentences:
+                sentences[sentence.id] = sentence
+        return sentences
+
+    def attach(self, candidates):
+        """
+        Points the Spans of the given Candidates to Sentences read from this store,
+        so that accessing them does not query the database
+        """
+        spans = [span for c in candidates for span in c.get_contexts()]
+        sentences = self.get(set(span.sentence_id for span in spans))
+        for span in spans:
+            if span.sentence_id in sentences:
+                set_committed_value(span, 'sentence', sentences[span.sentence_id])
+
+    def _load_documents(self, doc_idxs):
+        """Materializes the Documents at the given indexes, with all their Sentences"""
+        if len(doc_idxs) == 0:
+            return []
+        starts, ends = self.doc_starts[doc_idxs], self.doc_ends[doc_idxs]
+        if len(doc_idxs) == doc_idxs[-1] - doc_idxs[0] + 1:
+            columns = self.table.slice(starts[0], ends[-1] - starts[0]).to_pydict()
+        else:
+            rows = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)])
+            columns = self.table.take(pa.array(rows)).to_pydict()
+
+        documents = []
+        row = 0
+        for n in (ends - starts).tolist():
+            meta = columns['document_meta'][row]
+            document = Document(
+                id=columns['document_id'][row],
+                name=columns['document_name'][row],
+                stable_id=columns['document_stable_id'][row],
+                meta=pickle.loads(meta) if meta is not None else None
+            )
+            sentences = []
+            for i in range(row, row + n):
+                parts = dict((name, columns[name][i]) for name, _ in SENTENCE_ARRAY_FIELDS)
+                sentences.append(Sentence(
+                    id=columns['id'][i],
+                    document_id=document.id,
+                    position=columns['position'][i],
+                    stable_id=columns['stable_id'][i],
+                    text=columns['text'][i],
+                    **parts
+                ))
+            set_committed_value(document, 'sentences', sentences)
+            for sentence in sentences:
+                set_committed_value(sentence, 'document', document)
+            documents.append(document)
+            row += n
+        return documents
@@ -1,15 +1,23 @@
+import os
+from itertools import islice
 from multiprocessing import Process, JoinableQueue
+from threading import Thread
 try:
     from queue import Empty
 except:
     from Queue import Empty
 
-from .models.meta import new_sessionmaker, snorkel_conn_string
+from sqlalchemy.sql import text
+
+from .models.meta import new_sessionmaker, snorkel_conn_string, snorkel_postgres
 from .utils import ProgressBar
 
 
 QUEUE_TIMEOUT = 3
 
+# Max number of rows per multi-row INSERT statement written by UDF._insert
+INSERT_CHUNK_SIZE = 1000
+
 
 class UDFRunner(object):
     """Class to run UDFs in parallel using simple queue-based multiprocessing setup"""
@@ -23,11 +31,30 @@ class UDFRunner(object):
         else:
             self.reducer = None
 
-    def apply(self, xs, clear=True, parallelism=None, progress_bar=True, count=None, **kwargs):
+    def apply(self, xs, clear=True, parallelism=None, progress_bar=True, count=None,
+              batch_size=None, max_queued_batches=None, checkpoint=None, **kwargs):
         """
         Apply the given UDF to the set of objects xs, either single or multi-threaded, 
         and optionally calling clear() first.
+
+        If batch_size is set, xs is instead streamed to the UDF in chunks of batch_size
+        objects, and the results are committed after every chunk. When run in parallel,
+        at most max_queued_batches chunks (default: 2 * parallelism) are queued at any
+        time, so xs is only consumed as fast as the UDF processes can keep up.
+
+        If a checkpoint file path is also given, the ids of committed chunks are
+        recorded there; re-running with the same xs and checkpoint skips the chunks
+        which were already committed (and does not clear). The checkpoint file is
+        removed once all chunks have been committed.
         """
+        # Check for chunks committed by a previous run
+        if checkpoint is not None and batch_size is None:
+            raise ValueError("A checkpoint can only be used with batch_size set.")
+        done_batches = self._read_checkpoint(checkpoint)
+        if len(done_batches) > 0:
+            print("Resuming from checkpoint: %s batches already committed" % len(done_batches))
+            clear = False
+
         # Clear everything downstream of this UDF if requested
         if clear:
             print("Clearing existing...")
@@ -39,7 +66,18 @@ class UDFRunner(object):
 
         # Execute the UDF
         print("Running UDF...")
-        if parallelism is None or parallelism < 2:
+        if batch_size is not None:
+            if parallelism is None or parallelism < 2:
+                complete = self.apply_st_batched(xs, progress_bar, count, batch_size,
+                    checkpoint, done_batches, clear=clear, **kwargs)
+            else:
+                complete = self.apply_mt_batched(xs, parallelism, batch_size,
+                    max_queued_batches, checkpoint, done_batches, clear=clear, **kwargs)
+
+            # Only discard the checkpoint once every chunk has been committed
+            if complete and checkpoint is not None and os.path.exists(checkpoint):
+                os.remove(checkpoint)
+        elif parallelism is None or parallelism < 2:
             self.apply_st(xs, progress_bar, clear=clear, count=count, **kwargs)
         else:
             self.apply_mt(xs, parallelism, clear=clear, **kwargs)
@@ -72,6 +110,7 @@ class UDFRunner(object):
                     udf.session.add(y)
 
         # Commit session and close progress bar if applicable
+        udf.flush()
         udf.session.commit()
         if pb:
             pb.close()
@@ -112,6 +151,7 @@ class UDFRunner(object):
                         out_queue.task_done()
                     except Empty:
                         break
+                self.reducer.flush()
                 self.reducer.session.commit()
             self.reducer.session.close()
 
@@ -125,6 +165,139 @@ class UDFRunner(object):
             udf.terminate()
         self.udfs = []
 
+    def apply_st_batched(self, xs, progress_bar, count, batch_size, checkpoint,
+        done_batches, **kwargs):
+        """
+        Run the UDF single-threaded over chunks of xs, committing after each chunk.
+        Returns True if all chunks were committed.
+        """
+        udf = self.udf_class(**self.udf_init_kwargs)
+
+        # Set up ProgressBar if possible
+        pb = None
+        if progress_bar and hasattr(xs, '__len__') or count is not None:
+            n = count if count is not None else len(xs)
+            pb = ProgressBar(n)
+
+        for batch_id, batch in self._iter_batches(xs, batch_size, done_batches):
+            for j, x in enumerate(batch):
+                if pb:
+                    pb.bar(batch_id * batch_size + j)
+
+                # Apply UDF and add results to the session
+                for y in udf.apply(x, **kwargs):
+                    if hasattr(self.udf_class, 'reduce'):
+                        udf.reduce(y, **kwargs)
+                    else:
+                        udf.session.add(y)
+
+            # Commit the chunk and record it as done
+            udf.flush()
+            udf.session.commit()
+            self._write_checkpoint(checkpoint, batch_id)
+
+        udf.session.close()
+        if pb:
+            pb.close()
+        return True
+
+    def apply_mt_batched(self, xs, parallelism, batch_size, max_queued_batches,
+        checkpoint, done_batches, **kwargs):
+        """
+        Run the UDF multi-threaded over chunks of xs using bounded queues.
+
+        A feeder thread fills the input queue as the UDF processes drain it, so that
+        xs is never fully materialized. Each UDF process sends back one message per
+        chunk: either the chunk's outputs, if the UDF has a reduce step (which is then
+        run and committed on this thread), or an acknowledgement after committing the
+        chunk itself. Returns True if all chunks were committed.
+        """
+        if snorkel_conn_string.startswith('sqlite'):
+            raise ValueError('Multiprocessing with SQLite is not supported. Please use a different database backend,'
+                             ' such as PostgreSQL.')
+
+        # Bounding both queues provides backpressure in each direction
+        max_queued_batches = max_queued_batches or 2 * parallelism
+        in_queue  = JoinableQueue(maxsize=max_queued_batches)
+        out_queue = JoinableQueue(maxsize=max_queued_batches)
+
+        # Start UDF Processes
+        for i in range(parallelism):
+            udf              = self.udf_class(in_queue=in_queue, out_queue=out_queue, **self.udf_init_kwargs)
+            udf.apply_kwargs = kwargs
+            udf.batched      = True
+            self.udfs.append(udf)
+        for udf in self.udfs:
+            udf.start()
+
+        # Fill the input queue on a separate thread; None signals the end of input
+        n_batches = []
+        def feed():
+            n = 0
+            for batch in self._iter_batches(xs, batch_size, done_batches):
+                in_queue.put(batch)
+                n += 1
+            for udf in self.udfs:
+                in_queue.put(None)
+            n_batches.append(n)
+        feeder        = Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+
+        # Collect the processed chunks until all UDF processes have finished
+        n_committed = 0
+        while True:
+            try:
+                batch_id, ys = out_queue.get(True, QUEUE_TIMEOUT)
+            except Empty:
+                if not any([udf.is_alive() for udf in self.udfs]):
+                    break
+                continue
+            if ys is not None:
+                for y in ys:
+                    self.reducer.reduce(y, **kwargs)
+                self.reducer.flush()
+                self.reducer.session.commit()
+            self._write_checkpoint(checkpoint, batch_id)
+            n_committed += 1
+            out_queue.task_done()
+        if self.reducer is not None:
+            self.reducer.session.close()
+
+        # Terminate and flush the processes
+        for udf in self.udfs:
+            udf.terminate()
+        self.udfs = []
+
+        complete = len(n_batches) > 0 and n_committed == n_batches[0]
+        if not complete:
+            print("Warning: not all batches were committed.")
+        return complete
+
+    def _iter_batches(self, xs, batch_size, done_batches):
+        """Yield (batch id, list of objects) chunks of xs, skipping done batches"""
+        it = iter(xs)
+        batch_id = 0
+        while True:
+            batch = list(islice(it, batch_size))
+            if len(batch) == 0:
+                return
+            if batch_id not in done_batches:
+                yield batch_id, batch
+            batch_id += 1
+
+    def _read_checkpoint(self, checkpoint):
+        """Return the set of batch ids recorded in the checkpoint file"""
+        if checkpoint is None or not os.path.exists(checkpoint):
+            return set()
+        with open(checkpoint) as f:
+            return set(int(line) for line in f if line.strip())
+
+    def _write_checkpoint(self, checkpoint, batch_id):
+        if checkpoint is not None:
+            with open(checkpoint, 'a') as f:
+                f.write("%d\n" % batch_id)
+
 
 class UDF(Process):
     def __init__(self, in_queue=None, out_queue=None):
@@ -144,11 +317,16 @@ class UDF(Process):
         # We use a workaround to pass in the apply kwargs
         self.apply_kwargs = {}
 
+        # If True, in_queue holds (batch id, list of objects) chunks; see UDFRunner.apply_mt_batched
+        self.batched = False
+
     def run(self):
         """
         This method is called when the UDF is run as a Process in a multiprocess setting
         The basic routine is: get from JoinableQueue, apply, put / add outputs, loop
         """
+        if self.batched:
+            return self.run_batched()
         while True:
             try:
                 x = self.in_queue.get(True, QUEUE_TIMEOUT)
@@ -162,9 +340,71 @@ class UDF(Process):
                 self.in_queue.task_done()
             except Empty:
                 break
+        self.flush()
         self.session.commit()
         self.session.close()
 
+    def run_batched(self):
+        """
+        Process chunks of input objects until a None is received, committing or
+        forwarding the outputs of each chunk as a whole
+        """
+        while True:
+            batch = self.in_queue.get()
+            if batch is None:
+                self.in_queue.task_done()
+                break
+            batch_id, xs = batch
+
+            # If the UDF has a reduce step, send all of the chunk's outputs in one message
+            if hasattr(self, 'reduce'):
+                ys = [y for x in xs for y in self.apply(x, **self.apply_kwargs)]
+                self.out_queue.put((batch_id, ys))
+
+            # Otherwise add to the session, and acknowledge once committed
+            else:
+                for x in xs:
+                    for y in self.apply(x, **self.apply_kwargs):
+                        self.session.add(y)
+                self.flush()
+                self.session.commit()
+                self.out_queue.put((batch_id, None))
+            self.in_queue.task_done()
+        self.session.close()
+
     def apply(self, x, **kwargs):
         """This function takes in an object, and returns a generator / set / list"""
         raise NotImplementedError()
+
+    def flush(self):
+        """
+        Called before each commit of the session; UDFs whose reduce step buffers
+        its writes should persist them here
+        """
+        pass
+
+    def _allocate_ids(self, table_name, n):
+        """
+        Reserves n new ids of table, from its id sequence on Postgres. On SQLite, these
+        are the next n ids after MAX(id), which are not registered anywhere; so rows
+        with them must be inserted before anything else writes to the table.
+        """
+        if n == 0:
+            return []
+        if snorkel_postgres:
+            query = text("SELECT nextval('%s_id_seq') FROM generate_series(1, :n)" % table_name)
+            return [row[0] for row in self.session.execute(query, {'n': n})]
+
+        # SQLite has no sequences, but then only one process writes
+        start = self.session.execute(text("SELECT COALESCE(MAX(id), 0) FROM %s" % table_name)).scalar() + 1
+        return list(range(start, start + n))
+
+    def _insert(self, table, rows):
+        """Inserts rows into table, with multi-row INSERTs on Postgres"""
+        if len(rows) == 0:
+            return
+        if snorkel_postgres:
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                self.session.execute(table.insert().values(rows[i:i+INSERT_CHUNK_SIZE]))
+        else:
+            self.session.execute(table.insert(), rows)
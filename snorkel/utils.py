@@ -70,12 +70,58 @@ def sparse_abs(X):
     return X_abs
 
 
+def matrix_stats(L, labels=None):
+    """
+    Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate,
+    and optionally N gold labels in {-1, 0, 1}:
+    Return a dict of statistics, computed together in one pass over the CSR arrays of L:
+
+        - coverage, overlaps, conflicts: M-dim arrays of the fraction of candidates that each
+            LF labels, and labels while overlapping / conflicting with other LFs
+        - candidate_coverage, candidate_overlap, candidate_conflict: the fraction of
+            candidates with > 0 labels, > 1 labels, and > 1 labels which are not equal
+        - tp, fp, tn, fn, accuracy (if labels is not None): M-dim arrays of the counts of
+            each LF's labels against the gold labels, and its empirical accuracy
+    """
+    L = sparse.csr_matrix(L)
+    N, M = L.shape
+    data = L.data
+    abs_data = np.abs(data)
+    rows = np.repeat(np.arange(N), np.diff(L.indptr))
+    cols = L.indices
+
+    # Per-candidate sums of the labels and of their absolute values
+    row_abs = np.bincount(rows, weights=abs_data, minlength=N)
+    row_sum = np.bincount(rows, weights=data, minlength=N)
+    overlap_rows = row_abs > 1
+    conflict_rows = row_abs != np.abs(row_sum)
+
+    def col_sums(weights):
+        return np.bincount(cols, weights=weights, minlength=M)
+
+    stats = {
+        'coverage'           : col_sums(abs_data) / float(N),
+        'overlaps'           : col_sums(abs_data * overlap_rows[rows]) / float(N),
+        'conflicts'          : col_sums(abs_data * conflict_rows[rows]) / float(N),
+        'candidate_coverage' : np.count_nonzero(row_abs) / float(N),
+        'candidate_overlap'  : np.count_nonzero(overlap_rows) / float(N),
+        'candidate_conflict' : np.count_nonzero(conflict_rows) / float(N),
+    }
+    if labels is not None:
+        ls = np.ravel(labels)[rows]
+        for name, l, y in [('tp', 1, 1), ('fp', 1, -1), ('tn', -1, -1), ('fn', -1, 1)]:
+            stats[name] = col_sums((data == l) & (ls == y)).astype(int)
+        stats['accuracy'] = (stats['tp'] + stats['tn']).astype(float) / \
+            (stats['tp'] + stats['tn'] + stats['fp'] + stats['fn'])
+    return stats
+
+
 def matrix_coverage(L):
     """
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates that each LF labels.**
     """
-    return np.ravel(sparse_abs(L).sum(axis=0) / float(L.shape[0]))
+    return matrix_stats(L)['coverage']
 
 
 def matrix_overlaps(L):
@@ -83,8 +129,7 @@ def matrix_overlaps(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates that each LF _overlaps with other LFs on_.**
     """
-    L_abs = sparse_abs(L)
-    return np.ravel(np.where(L_abs.sum(axis=1) > 1, 1, 0).T * L_abs / float(L.shape[0]))
+    return matrix_stats(L)['overlaps']
 
 
 def matrix_conflicts(L):
@@ -92,28 +137,19 @@ def matrix_conflicts(L):
     Given an N x M matrix where L_{i,j} is the label given by the jth LF to the ith candidate:
     Return the **fraction of candidates that each LF _conflicts with other LFs on_.**
     """
-    L_abs = sparse_abs(L)
-    return np.ravel(np.where(L_abs.sum(axis=1) != sparse_abs(L.sum(axis=1)), 1, 0).T * L_abs / float(L.shape[0]))
+    return matrix_stats(L)['conflicts']
 
 def matrix_tp(L, labels):
-    return np.ravel([
-        np.sum(np.ravel((L[:, j] == 1).todense()) * (labels == 1)) for j in range(L.shape[1])
-    ])
+    return matrix_stats(L, labels)['tp']
 
 def matrix_fp(L, labels):
-    return np.ravel([
-        np.sum(np.ravel((L[:, j] == 1).todense()) * (labels == -1)) for j in range(L.shape[1])
-    ])
+    return matrix_stats(L, labels)['fp']
 
 def matrix_tn(L, labels):
-    return np.ravel([
-        np.sum(np.ravel((L[:, j] == -1).todense()) * (labels == -1)) for j in range(L.shape[1])
-    ])
+    return matrix_stats(L, labels)['tn']
 
 def matrix_fn(L, labels):
-    return np.ravel([
-        np.sum(np.ravel((L[:, j] == -1).todense()) * (labels == 1)) for j in range(L.shape[1])
-    ])
+    return matrix_stats(L, labels)['fn']
 
 def get_as_dict(x):
     """Return an object as a dictionary of its attributes"""
@@ -1,5 +1,5 @@
 from __future__ import print_function
-from .models import GoldLabel, StableLabel, GoldLabelKey
+from .models import GoldLabel, StableLabel, GoldLabelKey, bump_table_version
 try:
     from IPython.core.display import display, Javascript
 except:
@@ -210,6 +210,7 @@ class Viewer(widgets.DOMWidget):
                 if self.annotations[cid].value != value:
                     self.annotations[cid].value        = value
                     self.annotations_stable[cid].value = value
+                    bump_table_version(self.session, GoldLabel.__tablename__)
                     self.session.commit()
 
             # Otherwise, create a AnnotatorLabel *and a StableLabel*
@@ -227,6 +228,7 @@ class Viewer(widgets.DOMWidget):
                                                            value=value,\
                                                            split=candidate.split)
                 self.session.add(self.annotations_stable[cid])
+                bump_table_version(self.session, GoldLabel.__tablename__)
                 self.session.commit()
 
         elif content.get('event', '') == 'delete_label':
@@ -235,6 +237,7 @@ class Viewer(widgets.DOMWidget):
             self.annotations[cid] = None
             self.session.delete(self.annotations_stable[cid])
             self.annotations_stable[cid] = None
+            bump_table_version(self.session, GoldLabel.__tablename__)
             self.session.commit()
 
     def get_selected(self):
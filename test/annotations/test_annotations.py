@@ -0,0 +1,325 @@
+import os
+import re
+import shutil
+import tempfile
+import types
+import unittest
+import warnings
+
+import numpy as np
+
+from snorkel import annotations
+from snorkel.annotations import AnnotatorUDF, LabelAnnotator, lf_fingerprint, load_label_matrix
+from snorkel.candidates import CandidateExtractor, Ngrams
+from snorkel.matchers import RegexMatchSpan
+from snorkel.models import (
+    Candidate, Context, Document, Label, LabelKey, LFFingerprint, Sentence,
+    SnorkelSession, TableVersion, bump_table_version, candidate_subclass
+)
+from snorkel.models.annotation import DATABASE_TOKEN_NAME
+
+
+AnnotatedWord = candidate_subclass('AnnotatedWord', ['a'])
+
+SENTENCES = [
+    ['The', 'quick', 'brown', 'fox', 'jumps'],
+    ['over', 'the', 'lazy', 'dog'],
+    ['Snorkel', 'labels', 'training', 'data', 'programmatically'],
+    ['Labeling', 'functions', 'vote', 'on', 'candidates'],
+]
+
+
+def lf_upper(c):
+    return 1 if c.a.get_span()[0].isupper() else 0
+
+def lf_long(c):
+    return -1 if len(c.a.get_span()) > 4 else 0
+
+def lf_o(c):
+    return 1 if 'o' in c.a.get_span() else -1
+
+LFS = [lf_upper, lf_long, lf_o]
+
+
+# A module of helpers, which LFs call through its attributes
+helpers = types.ModuleType('lf_test_helpers')
+
+def vote_short(c):
+    return 1 if len(c.a.get_span()) < 4 else -1
+
+def vote_the(c):
+    return 1 if c.a.get_span().lower() == 'the' else 0
+
+helpers.vote = vote_short
+
+WORD_RGX = re.compile(r'^[a-z]+s$')
+
+def lf_rgx(c):
+    return 1 if WORD_RGX.match(c.a.get_span()) else 0
+
+def lf_helper(c):
+    return helpers.vote(c)
+
+
+class Threshold(object):
+    def __init__(self, n):
+        self.n = n
+
+THRESHOLD = Threshold(6)
+
+def lf_threshold(c):
+    return -1 if len(c.a.get_span()) > THRESHOLD.n else 0
+
+
+def add_sentence(session, document, position, words):
+    offsets = [sum(len(w) + 1 for w in words[:i]) for i in range(len(words))]
+    session.add(Sentence(document=document, position=position, text=' '.join(words),
+        words=words, char_offsets=offsets, abs_char_offsets=offsets, lemmas=words,
+        pos_tags=['NN'] * len(words), ner_tags=['O'] * len(words),
+        dep_parents=[0] * len(words), dep_labels=['dep'] * len(words),
+        entity_cids=['O'] * len(words), entity_types=['O'] * len(words),
+        stable_id='%s::sentence:%s:%s' % (document.name, offsets[0], offsets[-1] + len(words[-1]))))
+
+
+class TestAnnotations(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.session = SnorkelSession()
+        cls.session.query(Context).delete()
+        cls.session.query(Candidate).delete()
+        cls.session.query(LabelKey).delete()
+        cls.session.query(LFFingerprint).delete()
+        for i in range(3):
+            document = Document(name='doc%d' % i, stable_id='doc%d::document:0:0' % i, meta={})
+            cls.session.add(document)
+            for position, words in enumerate(SENTENCES):
+                add_sentence(cls.session, document, position, words)
+        cls.session.commit()
+
+        extractor = CandidateExtractor(AnnotatedWord, [Ngrams(n_max=1)], [RegexMatchSpan(rgx='.*')])
+        extractor.apply(cls.session.query(Sentence).all(), split=0, parallelism=1)
+        cls.candidates = cls.session.query(AnnotatedWord).order_by(AnnotatedWord.id).all()
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.query(Context).delete()
+        cls.session.query(Candidate).delete()
+        cls.session.query(LabelKey).delete()
+        cls.session.query(LFFingerprint).delete()
+        cls.session.commit()
+        cls.session.close()
+        shutil.rmtree(cls.tmp_dir)
+
+    def expected_matrix(self, lfs):
+        """The label matrix computed directly, with candidates ordered by id"""
+        return np.array([[lf(c) for lf in lfs] for c in self.candidates])
+
+    def dense(self, L, lfs, candidates=None):
+        """The dense label matrix L, with its columns in the order of lfs"""
+        candidates = self.candidates if candidates is None else candidates
+        self.assertEqual([L.row_index[i] for i in range(L.shape[0])],
+                         [c.id for c in candidates])
+        names = [L.get_key(self.session, j).name for j in range(L.shape[1])]
+        self.assertEqual(sorted(names), sorted(lf.__name__ for lf in lfs))
+        return L.toarray()[:, [names.index(lf.__name__) for lf in lfs]]
+
+    def test_batched_apply(self):
+        expected = self.expected_matrix(LFS)
+        L = LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1)
+        np.testing.assert_array_equal(self.dense(L, LFS), expected)
+
+        L = LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1, batch_size=10,
+            chunk_size=5)
+        np.testing.assert_array_equal(self.dense(L, LFS), expected)
+
+        # Resuming an interrupted run only labels the candidates after the
+        # committed batch, i.e. the first ten by id
+        cids = [c.id for c in self.candidates]
+        self.session.query(Label).filter(Label.candidate_id.in_(cids[10:]))\
+                    .delete(synchronize_session=False)
+        self.session.commit()
+        checkpoint = os.path.join(self.tmp_dir, 'checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write("0\n")
+        L = LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1, batch_size=10,
+            chunk_size=5, checkpoint=checkpoint)
+        np.testing.assert_array_equal(self.dense(L, LFS), expected)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_buffered_reduce(self):
+        # Flush the buffered annotations several times per run
+        buffer_size = annotations.ANNOTATION_BUFFER_SIZE
+        annotations.ANNOTATION_BUFFER_SIZE = 7
+        try:
+            L = LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1, chunk_size=5)
+            np.testing.assert_array_equal(self.dense(L, LFS), self.expected_matrix(LFS))
+
+            # Without clearing, changed values replace the existing labels, zeros
+            # overwrite them, and labels of unknown keys are skipped
+            def lf_o(c):
+                return -1 if 'o' in c.a.get_span() else 0
+            def lf_new(c):
+                return 1
+            lfs = [lf_upper, lf_long, lf_o]
+            L = LabelAnnotator(lfs=lfs + [lf_new]).apply_existing(split=0, parallelism=1,
+                chunk_size=5, clear=False)
+            np.testing.assert_array_equal(self.dense(L, lfs), self.expected_matrix(lfs))
+        finally:
+            annotations.ANNOTATION_BUFFER_SIZE = buffer_size
+
+    def test_load_matrix(self):
+        LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1)
+        expected = self.expected_matrix(LFS)
+        X = load_label_matrix(self.session, split=0)
+        np.testing.assert_array_equal(self.dense(X, LFS), expected)
+        X = load_label_matrix(self.session, split=0, zero_one=True)
+        np.testing.assert_array_equal(self.dense(X, LFS), np.where(expected == 1, 1, 0))
+        X = load_label_matrix(self.session, split=0, key_names=['lf_o', 'lf_upper'])
+        np.testing.assert_array_equal(self.dense(X, [lf_upper, lf_o]), expected[:, [0, 2]])
+
+        candidates = self.candidates[3:10]
+        cids_query = self.session.query(Candidate.id)\
+                                 .filter(Candidate.id.in_([c.id for c in candidates]))
+        X = load_label_matrix(self.session, cids_query=cids_query)
+        np.testing.assert_array_equal(self.dense(X, LFS, candidates), expected[3:10])
+
+        # Uncommitted writes of the session are loaded too
+        key_id = self.session.query(LabelKey.id).filter(LabelKey.name == 'lf_upper').scalar()
+        cid = self.candidates[1].id
+        self.session.query(Label).filter(Label.key_id == key_id)\
+                    .filter(Label.candidate_id == cid).delete(synchronize_session=False)
+        self.session.add(Label(key_id=key_id, candidate_id=cid, value=-1))
+        X = load_label_matrix(self.session, split=0)
+        self.session.rollback()
+        expected[1, 0] = -1
+        np.testing.assert_array_equal(self.dense(X, LFS), expected)
+
+    def test_matrix_cache(self):
+        cache_dir = os.path.join(self.tmp_dir, 'matrix_cache')
+        LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1)
+        expected = self.expected_matrix(LFS)
+        for _ in range(2):
+            X = load_label_matrix(self.session, split=0, cache=True, cache_dir=cache_dir)
+            np.testing.assert_array_equal(self.dense(X, LFS), expected)
+        self.assertTrue(os.path.exists(os.path.join(cache_dir, 'label_split0_group0', 'meta.npy')))
+
+        # Re-applying the LFs marks the cached matrix as stale
+        lfs = [lf_upper, lf_long]
+        LabelAnnotator(lfs=lfs).apply(split=0, parallelism=1)
+        X = load_label_matrix(self.session, split=0, cache=True, cache_dir=cache_dir)
+        np.testing.assert_array_equal(self.dense(X, lfs), expected[:, :2])
+
+        # So does bumping the table version after writing labels directly
+        key_id = self.session.query(LabelKey.id).filter(LabelKey.name == 'lf_upper').scalar()
+        self.session.query(Label).filter(Label.key_id == key_id).delete(synchronize_session=False)
+        bump_table_version(self.session, Label.__tablename__)
+        self.session.commit()
+        expected[:, 0] = 0
+        X = load_label_matrix(self.session, split=0, cache=True, cache_dir=cache_dir)
+        np.testing.assert_array_equal(self.dense(X, lfs), expected[:, :2])
+
+        # A matrix cached from another database, with the same table versions, is not used
+        self.session.query(Label).filter(Label.key_id != key_id).delete(synchronize_session=False)
+        self.session.query(TableVersion).filter(TableVersion.table_name == DATABASE_TOKEN_NAME)\
+                    .delete(synchronize_session=False)
+        self.session.commit()
+        X = load_label_matrix(self.session, split=0, cache=True, cache_dir=cache_dir)
+        self.assertEqual(X.nnz, 0)
+
+    def test_incremental_apply(self):
+        L = LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1)
+        L = LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1, incremental=True, L=L)
+        np.testing.assert_array_equal(self.dense(L, LFS), self.expected_matrix(LFS))
+
+        # Edit one LF, add another and remove a third; the result is the same as
+        # applying the new LFs from scratch
+        def lf_o(c):
+            return -1 if 'o' in c.a.get_span() else 0
+        def lf_new(c):
+            return 1 if len(c.a.get_span()) < 4 else 0
+        lfs = [lf_upper, lf_o, lf_new]
+        expected = self.expected_matrix(lfs)
+        L = LabelAnnotator(lfs=lfs).apply(split=0, parallelism=1, incremental=True, L=L)
+        np.testing.assert_array_equal(self.dense(L, lfs), expected)
+        np.testing.assert_array_equal(self.dense(load_label_matrix(self.session, split=0), lfs),
+                                      expected)
+        L = LabelAnnotator(lfs=lfs).apply(split=0, parallelism=1, incremental=True)
+        np.testing.assert_array_equal(self.dense(L, lfs), expected)
+
+    def test_lf_fingerprint(self):
+        global WORD_RGX
+        fingerprint = lf_fingerprint(lf_rgx)
+        self.assertEqual(lf_fingerprint(lf_rgx), fingerprint)
+
+        # Regexes are hashed by pattern and flags, not by the address of the object
+        rgx = WORD_RGX
+        try:
+            re.purge()
+            WORD_RGX = re.compile(r'^[a-z]+s$')
+            self.assertFalse(WORD_RGX is rgx)
+            self.assertEqual(lf_fingerprint(lf_rgx), fingerprint)
+            WORD_RGX = re.compile(r'^[a-z]+s$', re.IGNORECASE)
+            self.assertNotEqual(lf_fingerprint(lf_rgx), fingerprint)
+        finally:
+            WORD_RGX = rgx
+
+        # Functions reached through a module's attributes are followed
+        fingerprint = lf_fingerprint(lf_helper)
+        try:
+            helpers.vote = vote_the
+            self.assertNotEqual(lf_fingerprint(lf_helper), fingerprint)
+        finally:
+            helpers.vote = vote_short
+        self.assertEqual(lf_fingerprint(lf_helper), fingerprint)
+
+        # Other objects have no stable fingerprint
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            self.assertIsNone(lf_fingerprint(lf_threshold))
+        self.assertEqual(len(w), 1)
+
+    def test_incremental_apply_helpers(self):
+        lfs = [lf_rgx, lf_helper, lf_threshold]
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            L = LabelAnnotator(lfs=lfs).apply(split=0, parallelism=1, incremental=True)
+            np.testing.assert_array_equal(self.dense(L, lfs), self.expected_matrix(lfs))
+            self.assertEqual(sorted(name for name, in self.session.query(LFFingerprint.name)),
+                             ['lf_helper', 'lf_rgx'])
+
+            # Changing the helper re-applies its LF, and the LF without a fingerprint
+            # is re-applied every time
+            try:
+                helpers.vote = vote_the
+                THRESHOLD.n = 3
+                L = LabelAnnotator(lfs=lfs).apply(split=0, parallelism=1, incremental=True, L=L)
+                np.testing.assert_array_equal(self.dense(L, lfs), self.expected_matrix(lfs))
+                L = LabelAnnotator(lfs=lfs).apply(split=0, parallelism=1, incremental=True)
+                np.testing.assert_array_equal(self.dense(L, lfs), self.expected_matrix(lfs))
+            finally:
+                helpers.vote = vote_short
+                THRESHOLD.n = 6
+
+    def test_chunked_candidate_loading(self):
+        # Load each chunk's candidates and spans with several queries
+        chunk_size = annotations.ANNOTATION_CHUNK_SIZE
+        annotations.ANNOTATION_CHUNK_SIZE = 3
+        try:
+            udf = AnnotatorUDF(Label, LabelKey, None)
+            cids = [c.id for c in self.candidates[::-1]][:10]
+            loaded = udf._load_candidates(cids)
+            self.assertEqual([c.id for c in loaded], cids)
+            self.assertEqual([c.a.get_span() for c in loaded],
+                             [c.a.get_span() for c in self.candidates[::-1][:10]])
+            udf.session.close()
+
+            L = LabelAnnotator(lfs=LFS).apply(split=0, parallelism=1, chunk_size=7)
+            np.testing.assert_array_equal(self.dense(L, LFS), self.expected_matrix(LFS))
+        finally:
+            annotations.ANNOTATION_CHUNK_SIZE = chunk_size
+
+
+if __name__ == '__main__':
+    unittest.main()
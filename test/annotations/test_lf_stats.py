@@ -0,0 +1,73 @@
+from scipy import sparse
+from snorkel.utils import matrix_stats, sparse_abs
+import numpy as np
+import unittest
+import warnings
+
+
+# The per-statistic helpers which matrix_stats replaced
+
+def matrix_coverage(L):
+    return np.ravel(sparse_abs(L).sum(axis=0) / float(L.shape[0]))
+
+def matrix_overlaps(L):
+    L_abs = sparse_abs(L)
+    return np.ravel(np.where(L_abs.sum(axis=1) > 1, 1, 0).T * L_abs / float(L.shape[0]))
+
+def matrix_conflicts(L):
+    L_abs = sparse_abs(L)
+    return np.ravel(np.where(L_abs.sum(axis=1) != sparse_abs(L.sum(axis=1)), 1, 0).T * L_abs / float(L.shape[0]))
+
+def matrix_count(L, labels, l, y):
+    return np.ravel([
+        np.sum(np.ravel((L[:, j] == l).todense()) * (labels == y)) for j in range(L.shape[1])
+    ])
+
+def candidate_coverage(L):
+    return np.where(sparse_abs(L).sum(axis=1) != 0, 1, 0).sum() / float(L.shape[0])
+
+def candidate_overlap(L):
+    return np.where(sparse_abs(L).sum(axis=1) > 1, 1, 0).sum() / float(L.shape[0])
+
+def candidate_conflict(L):
+    return np.where(sparse_abs(L).sum(axis=1) != sparse_abs(L.sum(axis=1)), 1, 0).sum() / float(L.shape[0])
+
+
+class TestMatrixStats(unittest.TestCase):
+
+    def test_matrix_stats(self):
+        rng = np.random.RandomState(0)
+        for density in (0.05, 0.3, 0.8):
+            L = rng.choice([-1, 1], size=(200, 8)) * (rng.random_sample((200, 8)) < density)
+            # The last LF never labels
+            L[:, -1] = 0
+            L = sparse.csr_matrix(L)
+            labels = rng.choice([-1, 1], size=200)
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                stats = matrix_stats(L, labels)
+            np.testing.assert_allclose(stats['coverage'], matrix_coverage(L))
+            np.testing.assert_allclose(stats['overlaps'], matrix_overlaps(L))
+            np.testing.assert_allclose(stats['conflicts'], matrix_conflicts(L))
+            self.assertAlmostEqual(stats['candidate_coverage'], candidate_coverage(L))
+            self.assertAlmostEqual(stats['candidate_overlap'], candidate_overlap(L))
+            self.assertAlmostEqual(stats['candidate_conflict'], candidate_conflict(L))
+
+            tp, fp, tn, fn = [matrix_count(L, labels, l, y) for l, y in [(1, 1), (1, -1), (-1, -1), (-1, 1)]]
+            for name, expected in [('tp', tp), ('fp', fp), ('tn', tn), ('fn', fn)]:
+                np.testing.assert_array_equal(stats[name], expected)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                accuracy = (tp + tn).astype(float) / (tp + tn + fp + fn)
+            np.testing.assert_array_equal(stats['accuracy'], accuracy)
+            self.assertEqual(stats['coverage'][-1], 0)
+            self.assertTrue(np.isnan(stats['accuracy'][-1]))
+
+            # The stats without labels are the same, from a LIL matrix too
+            stats_no_labels = matrix_stats(L.tolil())
+            self.assertFalse('tp' in stats_no_labels)
+            np.testing.assert_allclose(stats_no_labels['conflicts'], stats['conflicts'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+from snorkel.candidates import CandidateExtractor, Ngrams
+from snorkel.matchers import DictionaryMatch, RegexMatchSpan
+from snorkel.models import Candidate, Context, Document, Sentence, SnorkelSession, Span, candidate_subclass
+import unittest
+
+
+ExtractedPair = candidate_subclass('ExtractedPair', ['a', 'b'])
+
+SENTENCES = [
+    [u'Foo', u'bar', u'met', u'Baz', u'in', u'New', u'York'],
+    [u'New', u'York', u'and', u'foo', u'bar', u'baz'],
+    [u'Nothing', u'here'],
+]
+
+DICTIONARY = [u'foo', u'foo bar', u'baz', u'new york']
+
+
+class TestCandidateExtractor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.session = SnorkelSession()
+        cls.session.query(Context).delete()
+        cls.session.query(Candidate).delete()
+        for i in range(4):
+            document = Document(name='doc%d' % i, stable_id='doc%d::document:0:0' % i, meta={})
+            cls.session.add(document)
+            for position, words in enumerate(SENTENCES):
+                offsets = [sum(len(w) + 1 for w in words[:j]) for j in range(len(words))]
+                cls.session.add(Sentence(document=document, position=position, text=u' '.join(words),
+                    words=words, char_offsets=offsets, abs_char_offsets=offsets,
+                    stable_id='doc%d::sentence:%d:%d' % (i, position, position + 1)))
+        cls.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.query(Context).delete()
+        cls.session.query(Candidate).delete()
+        cls.session.commit()
+        cls.session.close()
+
+    def extract(self, bulk, clear=True, clear_spans=True):
+        if clear_spans:
+            self.session.query(Candidate).delete()
+            self.session.query(Context).filter(Context.type == 'span').delete()
+            self.session.commit()
+        extractor = CandidateExtractor(ExtractedPair, [Ngrams(n_max=2), Ngrams(n_max=1)],
+            [DictionaryMatch(d=DICTIONARY), RegexMatchSpan(rgx=r'[A-Z].*')], bulk=bulk)
+        extractor.apply(self.session.query(Sentence).all(), split=0, clear=clear, parallelism=1)
+
+        # Compares rows by stable_id, since the two paths may assign different ids
+        self.session.expire_all()
+        spans = sorted((s.stable_id, s.sentence.stable_id, s.char_start, s.char_end)
+                       for s in self.session.query(Span))
+        candidates = sorted((c.split, c.a.stable_id, c.b.stable_id)
+                            for c in self.session.query(ExtractedPair))
+        return spans, candidates
+
+    def test_bulk_matches_orm(self):
+        spans, candidates = self.extract(bulk=False)
+        self.assertGreater(len(candidates), 0)
+        self.assertEqual(self.extract(bulk=True), (spans, candidates))
+
+        # Existing spans are reused, and without clearing, existing candidates are skipped
+        self.assertEqual(self.extract(bulk=True, clear_spans=False), (spans, candidates))
+        self.assertEqual(self.extract(bulk=True, clear=False, clear_spans=False), (spans, candidates))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+from snorkel.candidates import Ngrams
+from snorkel.matchers import (
+    Concat, DictionaryMatch, LambdaFunctionMatcher, PersonMatcher, RegexMatchEach, RegexMatchSpan, SeenCharSpans,
+    SlotFillMatch, Union
+)
+from snorkel.models import Sentence, TemporarySpan
+from six.moves import cPickle as pickle
+import random
+import unittest
+
+
+VOCAB = ['Foo', 'bar', 'BAZ', 'qux', '-', '/', 'a', 'b', 'x-y', 'c/d', 'The', 'of', 'New', 'York', '12']
+
+DICTIONARY = ['foo', 'bar', 'foo bar', 'foo-bar', 'bar baz qux', 'x', 'x-', 'x-y', 'c', 'new york', 'the',
+              '12', 'a b', 'ab', 'of the', 'baz -']
+
+NER_TAGS = ['O', 'PERSON', 'LOCATION', 'NUMBER']
+
+
+def random_sentence(rng):
+    """A transient Sentence of random words, some of them not separated by spaces"""
+    words = [rng.choice(VOCAB) for _ in range(rng.randint(1, 15))]
+    text, offsets = '', []
+    for w in words:
+        if text and rng.random() < 0.7:
+            text += ' ' * rng.randint(1, 2)
+        offsets.append(len(text))
+        text += w
+    return Sentence(text=text, words=words, char_offsets=offsets, lemmas=[w.lower() for w in words],
+                    ner_tags=[rng.choice(NER_TAGS) for _ in words], pos_tags=['NN'] * len(words))
+
+
+def random_leaf(rng):
+    k = rng.randint(0, 5)
+    if k == 0:
+        return DictionaryMatch(d=DICTIONARY, longest_match_only=rng.random() < 0.5)
+    elif k == 1:
+        return DictionaryMatch(d=DICTIONARY, attrib='lemmas', reverse=rng.random() < 0.3)
+    elif k == 2:
+        return RegexMatchSpan(rgx=rng.choice(['[a-z]+', 'foo.*', r'\d+', '.*a.*']), ignore_case=rng.random() < 0.5)
+    elif k == 3:
+        return RegexMatchEach(rgx=rng.choice(['[A-Z].*', 'PERSON|LOCATION', '.']),
+                              attrib=rng.choice(['words', 'ner_tags']))
+    elif k == 4:
+        return LambdaFunctionMatcher(func=lambda c: len(c.get_span()) % 3 == 0)
+    return PersonMatcher()
+
+
+def random_matcher(rng, depth=0):
+    """A random tree of matchers, of up to depth 3"""
+    if depth > 2 or rng.random() < 0.35:
+        return random_leaf(rng)
+    k = rng.randint(0, 3)
+    if k == 0:
+        return Union(*[random_matcher(rng, depth + 1) for _ in range(rng.randint(1, 3))])
+    elif k == 1:
+        return Concat(random_matcher(rng, depth + 1), random_matcher(rng, depth + 1),
+                      permutations=rng.random() < 0.5, left_required=rng.random() < 0.7,
+                      right_required=rng.random() < 0.7, ignore_sep=rng.random() < 0.5)
+    elif k == 2:
+        return SlotFillMatch(random_matcher(rng, depth + 1), random_matcher(rng, depth + 1),
+                             pattern=rng.choice(['{0} {1}', '{0}-{1}', '{1} of {0}']))
+    elif rng.random() < 0.5:
+        return DictionaryMatch(random_matcher(rng, depth + 1), d=DICTIONARY)
+    return RegexMatchSpan(random_matcher(rng, depth + 1), rgx='.*')
+
+
+def spans(candidates):
+    return [(c.char_start, c.char_end) for c in candidates]
+
+
+def filter_candidates(matcher, candidates):
+    """The candidates for which matcher.f is True, keeping only the longest matches if set"""
+    accepted = []
+    for c in candidates:
+        if matcher.f(c) and not (matcher.longest_match_only and any(
+            a.char_start <= c.char_start and c.char_end <= a.char_end for a in accepted)):
+            accepted.append(c)
+    return accepted
+
+
+class TestMatchers(unittest.TestCase):
+
+    def assert_matches_filter(self, make_matcher, n_max=4, n_sentences=200, seed=0):
+        rng = random.Random(seed)
+        n_matches = 0
+        for _ in range(n_sentences):
+            sentence = random_sentence(rng)
+            ngrams = Ngrams(n_max=n_max)
+            expected = spans(filter_candidates(make_matcher(), ngrams.apply(sentence)))
+            self.assertEqual(spans(make_matcher().apply_context(ngrams, sentence)), expected)
+            n_matches += len(expected)
+        self.assertGreater(n_matches, 0)
+
+    def test_dictionary_scan(self):
+        for n_max in (1, 2, 5):
+            self.assert_matches_filter(lambda: DictionaryMatch(d=DICTIONARY), n_max=n_max)
+            self.assert_matches_filter(lambda: DictionaryMatch(d=DICTIONARY, longest_match_only=False),
+                                       n_max=n_max)
+            self.assert_matches_filter(lambda: DictionaryMatch(d=DICTIONARY, ignore_case=False), n_max=n_max)
+            self.assert_matches_filter(lambda: DictionaryMatch(d=DICTIONARY, attrib='lemmas'), n_max=n_max)
+            self.assert_matches_filter(lambda: DictionaryMatch(d=DICTIONARY, reverse=True), n_max=n_max)
+
+    def test_compiled_plans(self):
+        rng = random.Random(1)
+        n_matches = 0
+        for _ in range(200):
+            matcher = random_matcher(rng)
+            plan = matcher.compile()
+            for _ in range(3):
+                sentence = random_sentence(rng)
+                for c in Ngrams(n_max=4).apply(sentence):
+                    match = bool(matcher.f(c))
+                    self.assertEqual(bool(plan(c, sentence, c.char_start, c.char_end)), match)
+                    n_matches += match
+        self.assertGreater(n_matches, 0)
+
+        # Plans are not pickled, but compiled again
+        matcher = Concat(DictionaryMatch(d=DICTIONARY), RegexMatchSpan(rgx=r'\d+'))
+        matcher.compile()
+        matcher = pickle.loads(pickle.dumps(matcher, 2))
+        self.assertIsNone(matcher._plan)
+        self.assert_matches_filter(lambda: matcher)
+
+    def test_seen_char_spans(self):
+        rng = random.Random(2)
+        for _ in range(500):
+            index, seen = SeenCharSpans(), []
+            for _ in range(rng.randint(1, 30)):
+                start = rng.randint(0, 20)
+                c = TemporarySpan(char_start=start, char_end=start + rng.randint(0, 8), sentence=None)
+                contained = any(a <= c.char_start and c.char_end <= b for a, b in seen)
+                self.assertEqual(index.contains(c), contained)
+                if not contained:
+                    seen.append((c.char_start, c.char_end))
+                    index.add(c)
+
+    def test_longest_match_only(self):
+        rng = random.Random(3)
+        for _ in range(100):
+            matcher = random_matcher(rng)
+            matcher.longest_match_only = True
+            for _ in range(3):
+                sentence = random_sentence(rng)
+                candidates = list(Ngrams(n_max=4).apply(sentence))
+                self.assertEqual(spans(matcher.apply(candidates)),
+                                 spans(filter_candidates(matcher, candidates)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -242,6 +242,35 @@ class TestCategorical(unittest.TestCase):
         self._test_categorical(L, LF_acc_priors, labels,
             candidate_ranges=candidate_ranges)
 
+    def test_scoped_categorical_labels(self):
+        # Gold labels are remapped through candidate_ranges along with L
+        class RecordingModel(GenerativeModel):
+            def _compile(self, L, *args, **kwargs):
+                if kwargs.get('labels') is not None:
+                    self.compiled_labels = kwargs['labels']
+                return super(RecordingModel, self)._compile(L, *args, **kwargs)
+
+        L = sparse.csr_matrix(np.array([[3], [4], [1]]))
+        candidate_ranges = [[3, 4], [2, 4], [1, 3]]
+        labels = np.array([4, 2, 3])
+        for labels_in in [labels, sparse.csr_matrix(labels.reshape(3, 1))]:
+            gen_model = RecordingModel()
+            gen_model.train(L, labels=labels_in, epochs=0,
+                candidate_ranges=candidate_ranges)
+            self.assertEqual(list(gen_model.compiled_labels), [2, 1, 2])
+
+        # Unlabeled candidates are left as abstains
+        gen_model = RecordingModel()
+        gen_model.train(L, labels=np.array([0, 4, 0]), epochs=0,
+            candidate_ranges=candidate_ranges)
+        self.assertEqual(list(gen_model.compiled_labels), [0, 2, 0])
+
+        # Labels outside of a candidate's range are rejected
+        gen_model = RecordingModel()
+        self.assertRaises(ValueError, gen_model.train, L,
+            labels=np.array([1, 2, 3]), epochs=0,
+            candidate_ranges=candidate_ranges)
+
     # def test_scoped_categorical_large(self):
     #     LF_acc_priors = [0.75, 0.75, 0.75, 0.75, 0.9]
     #     print("Generating L...")
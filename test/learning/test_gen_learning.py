@@ -1,7 +1,12 @@
 import math
+from numbskull import NumbSkull
 from numbskull.inference import FACTORS
 from scipy import sparse
-from snorkel.learning.gen_learning import GenerativeModel, DEP_EXCLUSIVE, DEP_REINFORCING, DEP_FIXING, DEP_SIMILAR
+from snorkel.learning import gen_learning
+from snorkel.learning.gen_learning import GenerativeModel, GenerativeModelWeights, DEP_EXCLUSIVE, DEP_REINFORCING, DEP_FIXING, DEP_SIMILAR
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 
@@ -375,5 +380,76 @@ class TestGenLearning(unittest.TestCase):
         # n_edges
         self.assertEqual(n_edges, 135)
 
+    def test_marginals(self):
+        # Defines a label matrix
+        L = sparse.lil_matrix((4, 3))
+        L[0, 0] = 1
+        L[0, 1] = 1
+        L[1, 0] = -1
+        L[1, 1] = 1
+        L[2, 2] = -1
+
+        # Sets the weights by hand
+        gen_model = GenerativeModel()
+        gen_model.cardinality = 2
+        gen_model.weights = GenerativeModelWeights(3)
+        gen_model.weights.class_prior = 0.5
+        gen_model.weights.lf_accuracy = np.array([1.0, 2.0, 0.5])
+        gen_model.weights.dep_fixing[0, 1] = 1.5
+        gen_model.weights.dep_reinforcing[0, 1] = 0.25
+
+        def sigmoid(x):
+            return 1 / (1 + math.exp(-x))
+
+        expected = [
+            sigmoid(1.0 + 2 * 1.0 + 2 * 2.0 + 0.25),
+            sigmoid(1.0 - 2 * 1.0 + 2 * 2.0 + 1.5),
+            sigmoid(1.0 - 2 * 0.5),
+            sigmoid(1.0),
+        ]
+        for kwargs in ({}, {'batch_size': 3}, {'use_numba': True}):
+            marginals = gen_model.marginals(L, **kwargs)
+            self.assertTrue(np.allclose(marginals, expected))
+
+        # Values outside {-1, 0, 1} are rejected
+        L[3, 0] = 2
+        self.assertRaises(ValueError, gen_model.marginals, L)
+
+    def test_compile_dir(self):
+        np.random.seed(1)
+        L = sparse.csr_matrix(np.random.choice([-1, 0, 1], size=(50, 4), p=[0.3, 0.4, 0.3]))
+        deps = [(0, 1, DEP_SIMILAR), (1, 2, DEP_FIXING), (2, 3, DEP_REINFORCING)]
+        compile_dir = tempfile.mkdtemp()
+        try:
+            # The factor graph loaded from memory-mapped arrays is the one
+            # NumbSkull loads itself
+            gen_model = GenerativeModel(class_prior=True, lf_propensity=True)
+            gen_model._process_dependency_graph(L, deps)
+            gen_model.cardinality = 2
+            arrays = gen_model._compile(L, 0.5, 0.0, [1.0] * 4, [False] * 4, 2 * np.ones(50),
+                compile_dir=compile_dir, chunk_size=7)
+            weight, variable, factor, ftv, domain_mask, n_edges = arrays
+            expected = NumbSkull(quiet=True)
+            expected.loadFactorGraph(*[np.copy(X) for X in arrays[:5]] + [n_edges])
+            fg = NumbSkull(quiet=True)
+            gen_learning._load_factor_graph(fg, weight, variable, factor, ftv, domain_mask,
+                compile_dir=compile_dir)
+            expected, fg = expected.factorGraphs[0], fg.factorGraphs[0]
+            for name in ('variable', 'factor', 'fmap', 'vmap', 'factor_index', 'var_value'):
+                np.testing.assert_array_equal(getattr(fg, name), getattr(expected, name))
+            self.assertEqual(sorted(os.listdir(compile_dir)),
+                             sorted(name + '.npy' for name in gen_learning.COMPILED_ARRAYS))
+            del arrays, weight, variable, factor, ftv, domain_mask, fg
+
+            # Training removes the files of the factor graph
+            gen_model = GenerativeModel(class_prior=True, lf_propensity=True)
+            gen_model.train(L, deps=deps, epochs=5, compile_dir=compile_dir, chunk_size=7)
+            self.assertEqual(os.listdir(compile_dir), [])
+            marginals = gen_model.marginals(L)
+            self.assertEqual(marginals.shape, (50,))
+            self.assertTrue(np.all((marginals >= 0) & (marginals <= 1)))
+        finally:
+            shutil.rmtree(compile_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,311 @@
+from numba import jit
+from scipy import sparse
+from snorkel.learning.structure import DependencySelector
+from snorkel.learning.structure.constants import DEP_FIXING, DEP_REINFORCING, DEP_SIMILAR
+from snorkel.learning.structure.gen_learning import _fit_all_deps
+import numpy as np
+import unittest
+
+
+@jit(nopython=True, nogil=True)
+def dense_fit_deps(m, n, j, L, weights, joint, higher_order, propensity, regularization, truncation):
+    """DependencySelector's fit of the weights of LF j, as it was before the label matrix was kept sparse"""
+    step_size = 1.0 / m
+    epochs = 10
+    l1delta = regularization * step_size * truncation
+    last_weight = len(weights) - 1
+
+    for t in range(epochs):
+        for i in range(m):
+            # Processes a training example
+
+            # First, computes joint and conditional distributions
+            joint[:] = 0, 0, 0, 0, 0, 0
+            for k in range(n):
+                if j == k:
+                    # Accuracy
+                    joint[0] += weights[j]
+                    joint[5] += weights[j]
+                    joint[2] -= weights[j]
+                    joint[3] -= weights[j]
+                else:
+                    if L[i, k] == 1:
+                        # Accuracy
+                        joint[0] -= weights[k]
+                        joint[1] -= weights[k]
+                        joint[2] -= weights[k]
+                        joint[3] += weights[k]
+                        joint[4] += weights[k]
+                        joint[5] += weights[k]
+
+                        # Similar
+                        joint[2] += weights[n + k]
+                        joint[5] += weights[n + k]
+
+                        if higher_order:
+                            # Reinforcement
+                            joint[5] += weights[2 * n + k] + weights[3 * n + k]
+                            joint[1] -= weights[2 * n + k]
+                            joint[4] -= weights[2 * n + k]
+
+                            # Fixing
+                            joint[3] += weights[4 * n + k]
+                            joint[1] -= weights[4 * n + k]
+                            joint[4] -= weights[4 * n + k]
+                            joint[0] += weights[5 * n + k]
+
+                    elif L[i, k] == -1:
+                        # Accuracy
+                        joint[0] += weights[k]
+                        joint[1] += weights[k]
+                        joint[2] += weights[k]
+                        joint[3] -= weights[k]
+                        joint[4] -= weights[k]
+                        joint[5] -= weights[k]
+
+                        # Similar
+                        joint[0] += weights[n + k]
+                        joint[3] += weights[n + k]
+
+                        if higher_order:
+                            # Reinforcement
+                            joint[0] += weights[2 * n + k] + weights[3 * n + k]
+                            joint[1] -= weights[2 * n + k]
+                            joint[4] -= weights[2 * n + k]
+
+                            # Fixing
+                            joint[2] += weights[4 * n + k]
+                            joint[1] -= weights[4 * n + k]
+                            joint[4] -= weights[4 * n + k]
+                            joint[5] += weights[5 * n + k]
+
+                    else:
+                        # Similar
+                        joint[1] += weights[n + k]
+                        joint[4] += weights[n + k]
+
+                        if higher_order:
+                            # Reinforcement
+                            joint[0] -= weights[3 * n + k]
+                            joint[2] -= weights[3 * n + k]
+                            joint[3] -= weights[3 * n + k]
+                            joint[5] -= weights[3 * n + k]
+
+                            # Fixing
+                            joint[0] -= weights[5 * n + k]
+                            joint[2] -= weights[5 * n + k]
+                            joint[3] -= weights[5 * n + k]
+                            joint[5] -= weights[5 * n + k]
+
+            if propensity:
+                joint[0] += weights[last_weight]
+                joint[2] += weights[last_weight]
+                joint[3] += weights[last_weight]
+                joint[5] += weights[last_weight]
+
+            joint = np.exp(joint)
+            joint /= np.sum(joint)
+
+            marginal_pos = np.sum(joint[3:6])
+            marginal_neg = np.sum(joint[0:3])
+
+            if L[i, j] == 1:
+                conditional_pos = joint[5] / (joint[2] + joint[5])
+                conditional_neg = joint[2] / (joint[2] + joint[5])
+            elif L[i, j] == -1:
+                conditional_pos = joint[3] / (joint[0] + joint[3])
+                conditional_neg = joint[0] / (joint[0] + joint[3])
+            else:
+                conditional_pos = joint[4] / (joint[1] + joint[4])
+                conditional_neg = joint[1] / (joint[1] + joint[4])
+
+            # Second, takes likelihood gradient step
+
+            for k in range(n):
+                if j == k:
+                    # Accuracy
+                    weights[j] -= step_size * (joint[5] + joint[0] - joint[2] - joint[3])
+                    if L[i, j] == 1:
+                        weights[j] += step_size * (conditional_pos - conditional_neg)
+                    elif L[i, j] == -1:
+                        weights[j] += step_size * (conditional_neg - conditional_pos)
+                else:
+                    if L[i, k] == 1:
+                        # Accuracy
+                        weights[k] -= step_size * (marginal_pos - marginal_neg - conditional_pos + conditional_neg)
+
+                        # Similar
+                        weights[n + k] -= step_size * (joint[2] + joint[5])
+                        if L[i, j] == 1:
+                            weights[n + k] += step_size
+
+                        if higher_order:
+                            # Incoming reinforcement
+                            weights[2 * n + k] -= step_size * (joint[5] - joint[1] - joint[4])
+                            if L[i, j] == 1:
+                                weights[2 * n + k] += step_size * conditional_pos
+                            elif L[i, j] == 0:
+                                weights[2 * n + k] += step_size * -1
+
+                            # Outgoing reinforcement
+                            weights[3 * n + k] -= step_size * joint[5]
+                            if L[i, j] == 1:
+                                weights[3 * n + k] += step_size * conditional_pos
+
+                            # Incoming fixing
+                            weights[4 * n + k] -= step_size * (joint[3] - joint[1] - joint[4])
+                            if L[i, j] == -1:
+                                weights[4 * n + k] += step_size * conditional_pos
+                            elif L[i, j] == 0:
+                                weights[4 * n + k] += step_size * -1
+
+                            # Outgoing fixing
+                            weights[5 * n + k] -= step_size * joint[0]
+                            if L[i, j] == -1:
+                                weights[5 * n + k] += step_size * conditional_neg
+                    elif L[i, k] == -1:
+                        # Accuracy
+                        weights[k] -= step_size * (marginal_neg - marginal_pos - conditional_neg + conditional_pos)
+
+                        # Similar
+                        weights[n + k] -= step_size * (joint[0] + joint[3])
+                        if L[i, j] == -1:
+                            weights[n + k] += step_size
+
+                        if higher_order:
+                            # Incoming reinforcement
+                            weights[2 * n + k] -= step_size * (joint[0] - joint[1] - joint[4])
+                            if L[i, j] == -1:
+                                weights[2 * n + k] += step_size * conditional_neg
+                            elif L[i, j] == 0:
+                                weights[2 * n + k] += step_size * -1
+
+                            # Outgoing reinforcement
+                            weights[3 * n + k] -= step_size * joint[0]
+                            if L[i, j] == -1:
+                                weights[3 * n + k] += step_size * conditional_neg
+
+                            # Incoming fixing
+                            weights[4 * n + k] -= step_size * (joint[2] - joint[1] - joint[4])
+                            if L[i, j] == 1:
+                                weights[4 * n + k] += step_size * conditional_neg
+                            elif L[i, j] == 0:
+                                weights[4 * n + k] += step_size * -1
+
+                            # Outgoing fixing
+                            weights[5 * n + k] -= step_size * joint[5]
+                            if L[i, j] == 1:
+                                weights[5 * n + k] += step_size * conditional_pos
+                    else:
+                        # Similar
+                        weights[n + k] -= step_size * (joint[1] + joint[4])
+                        if L[i, j] == 0:
+                            weights[n + k] += step_size
+
+                        if higher_order:
+                            # No effect of incoming reinforcement
+
+                            # Outgoing reinforcement
+                            weights[3 * n + k] -= step_size * (-1 * joint[0] - joint[2] - joint[3] - joint[5])
+                            if L[i, j] != 0:
+                                weights[3 * n + k] += step_size * -1
+
+                            # No effect of incoming fixing
+
+                            # Outgoing fixing
+                            weights[5 * n + k] -= step_size * (-1 * joint[0] - joint[2] - joint[3] - joint[5])
+                            if L[i, j] != 0:
+                                weights[5 * n + k] += step_size * -1
+
+            if propensity:
+                weights[last_weight] -= step_size * (joint[0] + joint[2] + joint[3] + joint[5])
+                if L[i, j] != 0:
+                    weights[last_weight] += step_size
+
+            # Third, takes regularization gradient step
+            if (t * m + i) % truncation == 0:
+                for k in range(len(weights)):
+                    weights[k] = max(0, weights[k] - l1delta) if weights[k] > 0 else min(0, weights[k] + l1delta)
+
+
+
+def dense_weights(L, higher_order, propensity, threshold=0.05, truncation=10):
+    """The weights of each LF's dependencies, fit on the dense label matrix as before L was kept sparse"""
+    L = np.asarray(L.todense())
+    m, n = L.shape
+    n_weights = 2 * n
+    if higher_order:
+        n_weights += 4 * n
+    if propensity:
+        n_weights += 1
+    weights = np.zeros((n, n_weights))
+    weights[:, :n] = 1.0
+    for j in range(n):
+        dense_fit_deps(m, n, j, L, weights[j], np.zeros((6,)), higher_order, propensity, threshold, truncation)
+    return weights
+
+
+def dense_select(L, higher_order, propensity, threshold=0.05):
+    weights = dense_weights(L, higher_order, propensity, threshold)
+    n = L.shape[1]
+    deps = set()
+    for j in range(n):
+        for k in range(n):
+            if abs(weights[j, n + k]) > threshold:
+                deps.add((j, k, DEP_SIMILAR) if j < k else (k, j, DEP_SIMILAR))
+            if higher_order:
+                if abs(weights[j, 2 * n + k]) > threshold:
+                    deps.add((j, k, DEP_REINFORCING))
+                if abs(weights[j, 3 * n + k]) > threshold:
+                    deps.add((k, j, DEP_REINFORCING))
+                if abs(weights[j, 4 * n + k]) > threshold:
+                    deps.add((j, k, DEP_FIXING))
+                if abs(weights[j, 5 * n + k]) > threshold:
+                    deps.add((k, j, DEP_FIXING))
+    return deps
+
+
+def random_L(rng, m=300, n=6):
+    """A label matrix whose second and fourth LFs mostly copy the first and third"""
+    L = rng.choice([-1, 0, 1], size=(m, n), p=[0.3, 0.4, 0.3])
+    copy = rng.random_sample((m, 2)) < 0.8
+    L[:, 1] = np.where(copy[:, 0], L[:, 0], L[:, 1])
+    L[:, 3] = np.where(copy[:, 1], L[:, 2], L[:, 3])
+    return sparse.csr_matrix(L)
+
+
+class TestDependencySelector(unittest.TestCase):
+
+    def test_select(self):
+        rng = np.random.RandomState(0)
+        n_deps = 0
+        for _ in range(3):
+            L = random_L(rng)
+            m, n = L.shape
+            for higher_order in (False, True):
+                for propensity in (False, True):
+                    expected = dense_weights(L, higher_order, propensity)
+                    weights = np.zeros(expected.shape)
+                    weights[:, :n] = 1.0
+                    _fit_all_deps(m, n, L.indptr, L.indices, L.data.astype(np.int64), weights,
+                                  higher_order, propensity, 0.05, 10)
+                    np.testing.assert_allclose(weights, expected, rtol=1e-7, atol=1e-10)
+
+                    deps = DependencySelector().select(L, higher_order=higher_order, propensity=propensity)
+                    self.assertEqual(deps, dense_select(L, higher_order, propensity))
+                    self.assertEqual(DependencySelector().select(L.tolil(), higher_order=higher_order,
+                                                                 propensity=propensity), deps)
+                    n_deps += len(deps)
+        self.assertGreater(n_deps, 0)
+
+    def test_sample_size(self):
+        L = random_L(np.random.RandomState(1), m=500)
+        rows = np.sort(np.random.RandomState(2).choice(500, 200, replace=False))
+        for higher_order in (False, True):
+            self.assertEqual(DependencySelector().select(L, higher_order=higher_order, sample_size=200, seed=2),
+                             dense_select(L[rows], higher_order, False))
+        # A sample at least as large as L uses all of it
+        self.assertEqual(DependencySelector().select(L, sample_size=500, seed=2), dense_select(L, False, False))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from six.moves import cPickle as pickle
+from snorkel.models import Context, Document, Sentence, SnorkelSession, Span, snorkel_postgres
+from snorkel.models.context import TemporarySpan, char_to_word_index, pack_array, unpack_array
+import random
+import unittest
+
+
+INT_ARRAYS = [
+    [],
+    [0, 5, -3, 127],
+    [0, 300, -32768],
+    [0, 70000, -5, 2 ** 31 - 1],
+    [2 ** 40, 1],
+    [None, 1],
+]
+
+STR_ARRAYS = [
+    [],
+    [u'The', u'quick', u'brown', u'fox'],
+    [u'NN', u'VB', u'NN', u'NN', u'DT', u'NN'],
+    [u'caf\xe9', u'', u'na\xefve', u'caf\xe9'],
+    [u'with\0nul', u'x'],
+    [u'O'] * 1000,
+    [u'w%d' % i for i in range(600)],
+    [None, u'x'],
+]
+
+
+class TestPackedArrays(unittest.TestCase):
+
+    def test_round_trip(self):
+        for values in INT_ARRAYS:
+            self.assertEqual(unpack_array(pack_array(values, 'int')), values)
+        for values in STR_ARRAYS:
+            self.assertEqual(unpack_array(pack_array(values, 'str')), values)
+
+    def test_pickled_arrays(self):
+        # Rows written before arrays were packed hold the lists pickled by PickleType
+        for values in INT_ARRAYS + STR_ARRAYS:
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                self.assertEqual(unpack_array(pickle.dumps(values, protocol)), values)
+
+    @unittest.skipIf(snorkel_postgres, "Sentence arrays are only packed on SQLite")
+    def test_pickled_sentence_rows(self):
+        session = SnorkelSession()
+        session.query(Context).delete()
+        words = [u'Packed', u'caf\xe9', u'arrays']
+        offsets = [0, 7, 13]
+        document = Document(name='packed', stable_id='packed::document:0:0', meta={})
+        sentence = Sentence(document=document, position=0, text=u' '.join(words), words=words,
+            char_offsets=offsets, abs_char_offsets=offsets, stable_id='packed::sentence:0:19')
+        session.add(sentence)
+        session.commit()
+        sentence_id = sentence.id
+        session.close()
+
+        # Rewrite the row's arrays as pickled lists, as written before they were packed
+        session = SnorkelSession()
+        session.execute(Sentence.__table__.update().values(
+            words=pickle.dumps(words, pickle.HIGHEST_PROTOCOL),
+            char_offsets=pickle.dumps(offsets, pickle.HIGHEST_PROTOCOL)))
+        session.commit()
+        sentence = session.query(Sentence).filter(Sentence.id == sentence_id).one()
+        self.assertEqual(sentence.words, words)
+        self.assertEqual(sentence.char_offsets, offsets)
+        self.assertEqual(sentence.abs_char_offsets, offsets)
+        self.assertEqual(sentence.lemmas, None)
+        session.query(Context).delete()
+        session.commit()
+        session.close()
+
+
+def linear_char_to_word_index(char_offsets, ci):
+    """The linear scan which char_to_word_index replaced"""
+    i = None
+    for i, co in enumerate(char_offsets):
+        if ci == co:
+            return i
+        elif ci < co:
+            return i-1
+    return i
+
+
+class TestWordIndex(unittest.TestCase):
+
+    def test_char_to_word_index(self):
+        offsets = [
+            [],
+            [0],
+            [3],
+            [0, 4, 10, 11, 17],
+            [2, 2, 5, 5, 5, 9],
+            [0, 0, 0],
+        ]
+        rng = random.Random(0)
+        for _ in range(50):
+            offsets.append(sorted(rng.randint(0, 30) for _ in range(rng.randint(0, 10))))
+        for char_offsets in offsets:
+            # Including indexes before the first offset and past the end of the sentence
+            for ci in range(-2, 35):
+                self.assertEqual(char_to_word_index(char_offsets, ci),
+                                 linear_char_to_word_index(char_offsets, ci))
+
+    def test_cached_word_index(self):
+        sentence = Sentence(words=[u'The', u'quick', u'brown', u'fox'], char_offsets=[0, 4, 10, 16])
+        other = Sentence(words=[u'A', u'fox'], char_offsets=[0, 2])
+        for span in (TemporarySpan(sentence=sentence, char_start=4, char_end=14),
+                     Span(sentence=sentence, char_start=4, char_end=14)):
+            self.assertEqual((span.get_word_start(), span.get_word_end()), (1, 2))
+            span.char_start = 10
+            self.assertEqual((span.get_word_start(), span.get_word_end()), (2, 2))
+            span.char_end = 18
+            self.assertEqual((span.get_word_start(), span.get_word_end()), (2, 3))
+            self.assertEqual(span.get_n(), 2)
+            span.sentence = other
+            self.assertEqual((span.get_word_start(), span.get_word_end()), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+from snorkel.models import Document, construct_stable_id
+from snorkel.parser.corenlp import StanfordCoreNLPServer, split_text
+from snorkel.parser.parser import URLParserConnection
+from six.moves import BaseHTTPServer, socketserver
+from subprocess import Popen
+from threading import Lock, Thread
+import json
+import os
+import random
+import re
+import signal
+import socket
+import time
+import unittest
+
+
+TEXT = u"\n\n".join([
+    u"The first paragraph. It has two sentences.",
+    u"A caf\xe9 in the second one!",
+    u"Does the third span two lines? It does.",
+    u"The last one is short.",
+])
+
+
+def corenlp_json(text):
+    """A CoreNLP style JSON response, with a sentence ending at each '.', '!' or '?'"""
+    sentences, tokens = [], []
+    for m in re.finditer(r'\w+|[^\w\s]', text, re.UNICODE):
+        tokens.append({'word': m.group(), 'lemma': m.group().lower(), 'pos': 'NN', 'ner': 'O',
+                       'characterOffsetBegin': m.start(), 'characterOffsetEnd': m.end(),
+                       'originalText': m.group()})
+        if m.group() in '.!?':
+            sentences.append(tokens)
+            tokens = []
+    if len(tokens) > 0:
+        sentences.append(tokens)
+    return json.dumps({'sentences': [
+        {'tokens': tokens,
+         'basic-dependencies': [{'governor': k, 'dep': 'dep', 'dependent': k + 1} for k in range(len(tokens))]}
+        for tokens in sentences
+    ]})
+
+
+class StubCoreNLPServer(StanfordCoreNLPServer):
+    """A StanfordCoreNLPServer which does not launch any server process"""
+    def _launch(self, i):
+        pass
+
+
+class PooledStubServer(StubCoreNLPServer):
+    """A StanfordCoreNLPServer which launches a sleep process in place of each server JVM"""
+    def __init__(self, **kwargs):
+        self.launched = []
+        super(PooledStubServer, self).__init__(**kwargs)
+
+    def _launch(self, i):
+        self.launched.append(i)
+        # Without close_fds, the processes would keep the stub servers' sockets open
+        self.process_groups[i] = Popen('sleep 60', shell=True, preexec_fn=os.setsid, close_fds=True)
+
+
+class StubConnection(URLParserConnection):
+    """A URLParserConnection which answers its requests with corenlp_json, and records them"""
+    def __init__(self, parser):
+        super(StubConnection, self).__init__(parser)
+        self.requests = []
+
+    def post(self, url, data, allow_redirects=True):
+        self.requests.append(data.decode('utf-8'))
+        return corenlp_json(data.decode('utf-8'))
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers POSTed texts with corenlp_json, after the server's delay for them; or hangs up on 'error'"""
+    def do_POST(self):
+        text = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        server = self.server
+        with server.lock:
+            server.requests.append(text)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(server.delay(text))
+        with server.lock:
+            server.active -= 1
+            server.answered.append(text)
+
+        if text == 'error':
+            self.close_connection = 1
+            return
+        content = corenlp_json(text).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local stand-in for a CoreNLP server, which records the requests it gets"""
+    daemon_threads = True
+
+    def __init__(self, port, delay=lambda text: 0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.delay = delay
+        self.lock = Lock()
+        self.requests = []
+        self.answered = []
+        self.active = 0
+        self.max_active = 0
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def free_ports(n):
+    """Return the first of n consecutive ports which are free"""
+    while True:
+        sockets = [socket.socket()]
+        sockets[0].bind(('127.0.0.1', 0))
+        port = sockets[0].getsockname()[1]
+        try:
+            for i in range(1, n):
+                sockets.append(socket.socket())
+                sockets[i].bind(('127.0.0.1', port + i))
+            return port
+        except socket.error:
+            pass
+        finally:
+            for s in sockets:
+                s.close()
+
+
+class TestSplitText(unittest.TestCase):
+
+    def test_boundary_preference(self):
+        # Paragraph breaks are preferred to line breaks, sentence ends and whitespace, in that order
+        seps = ['\n\n', '\n', '. ', ' ']
+        ends = [32, 36, 41, 45]
+        for i, (sep, end) in enumerate(zip(seps, ends)):
+            text = 'x' * 30
+            for j, s in enumerate(seps):
+                text += ('x' * len(s) if j < i else s) + 'x' * 3
+            text += 'x' * 60
+            chunks = split_text(text, 50)
+            self.assertEqual(chunks[0], (0, text[:end]))
+            self.assertTrue(chunks[0][1].endswith(sep))
+
+        # Boundaries in the first half of the chunk are not used
+        text = 'x' * 10 + '\n\n' + 'x' * 30 + ' ' + 'x' * 60
+        self.assertEqual(split_text(text, 50)[0], (0, text[:43]))
+
+    def test_forced_split(self):
+        text = 'x' * 120
+        self.assertEqual(split_text(text, 50), [(0, 'x' * 50), (50, 'x' * 50), (100, 'x' * 20)])
+        self.assertEqual(split_text('short', 50), [(0, 'short')])
+
+    def test_chunks(self):
+        rng = random.Random(0)
+        for _ in range(100):
+            text = ''.join(rng.choice('abc .!\n') for _ in range(rng.randint(0, 500)))
+            max_chunk_size = rng.randint(2, 100)
+            chunks = split_text(text, max_chunk_size)
+            self.assertEqual(''.join(chunk for _, chunk in chunks), text)
+            offset = 0
+            for chunk_offset, chunk in chunks:
+                self.assertEqual(chunk_offset, offset)
+                self.assertLessEqual(len(chunk), max_chunk_size)
+                offset += len(chunk)
+
+
+class TestParseChunks(unittest.TestCase):
+
+    def _parse(self, document, max_chunk_size):
+        parser = StubCoreNLPServer(max_chunk_size=max_chunk_size, num_threads=2)
+        conn = StubConnection(parser)
+        return list(conn.parse(document, TEXT)), conn.requests
+
+    def test_parse_chunks(self):
+        document = Document(name='doc', stable_id='doc::document:0:0')
+        expected, requests = self._parse(document, None)
+        self.assertEqual(requests, [TEXT])
+        self.assertEqual(len(expected), 6)
+
+        parts, requests = self._parse(document, 60)
+        self.assertEqual(requests, [chunk for _, chunk in split_text(TEXT, 60)])
+        self.assertGreater(len(requests), 2)
+
+        # The chunks' sentences are the same as the whole document's
+        self.assertEqual(parts, expected)
+        for position, sentence in enumerate(parts):
+            self.assertEqual(sentence['position'], position)
+            start = sentence['abs_char_offsets'][0]
+            end = sentence['abs_char_offsets'][-1] + len(sentence['words'][-1])
+            self.assertEqual(sentence['text'], TEXT[start:end])
+            self.assertEqual(sentence['stable_id'], construct_stable_id(document, 'sentence', start, end))
+            for word, abs_char_offset, char_offset in zip(sentence['words'], sentence['abs_char_offsets'],
+                                                          sentence['char_offsets']):
+                self.assertEqual(TEXT[abs_char_offset:abs_char_offset + len(word)], word)
+                self.assertEqual(abs_char_offset, start + char_offset)
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        port = free_ports(1)
+        # The first document is answered last
+        self.server = StubHTTPServer(port, delay=lambda text: 0.2 if text.startswith('Slow') else 0)
+        self.parser = StubCoreNLPServer(port=port, max_chunk_size=None)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_order(self):
+        texts = [u'Slow document 0.'] + [u'Document %d.' % i for i in range(1, 8)]
+        conn = self.parser.connect()
+        responses = list(conn.pipeline(enumerate(texts), in_flight=4, skip=lambda text: text.endswith('5.')))
+
+        # Responses are yielded in input order, though they are answered out of order
+        self.assertEqual([(document, text) for document, text, _ in responses], list(enumerate(texts)))
+        for document, text, response in responses:
+            if document == 5:
+                self.assertIsNone(response)
+            else:
+                self.assertEqual(response.result(), corenlp_json(text))
+        self.assertEqual(self.server.answered[-1], texts[0])
+        self.assertGreater(self.server.max_active, 1)
+        self.assertLessEqual(self.server.max_active, 4)
+        self.assertEqual(sorted(self.server.requests), sorted(texts[:5] + texts[6:]))
+
+    def test_error(self):
+        conn = URLParserConnection(self.parser, retries=0)
+        responses = list(conn.pipeline(enumerate([u'One.', u'error', u'Three.']), in_flight=2))
+        self.assertEqual(responses[0][2].result(), corenlp_json(u'One.'))
+        self.assertRaises(ValueError, responses[1][2].result)
+        self.assertEqual(responses[2][2].result(), corenlp_json(u'Three.'))
+
+
+
+class TestServerPool(unittest.TestCase):
+
+    def setUp(self):
+        port = free_ports(2)
+        self.servers = [StubHTTPServer(port + i, delay=lambda text: 0.05) for i in range(2)]
+        self.parser = PooledStubServer(port=port, max_chunk_size=None, num_servers=2)
+
+    def tearDown(self):
+        self.parser.close()
+        for server in self.servers:
+            if server is not None:
+                server.stop()
+
+    def test_balancing(self):
+        texts = [u'Document %d.' % i for i in range(8)]
+        conn = self.parser.connect()
+        for _, text, response in conn.pipeline(enumerate(texts), in_flight=4):
+            self.assertEqual(response.result(), corenlp_json(text))
+
+        # Concurrent requests are spread over both servers
+        self.assertEqual(sorted(self.servers[0].requests + self.servers[1].requests), texts)
+        self.assertGreater(len(self.servers[0].requests), 0)
+        self.assertGreater(len(self.servers[1].requests), 0)
+        self.assertEqual(self.parser._outstanding, [0, 0])
+
+    def test_failover(self):
+        conn = URLParserConnection(self.parser, retries=0)
+        processes = list(self.parser.process_groups)
+        self.assertEqual(self.parser.launched, [0, 1])
+
+        # The second server dies, and refuses connections
+        self.servers[1].stop()
+        self.servers[1] = None
+        self.parser._kill(processes[1], signal.SIGKILL)
+        processes[1].wait()
+
+        # A request sent to it is sent to the first server instead; the second is restarted, and avoided
+        self.parser._avoid_until[0] = time.time() + 60
+        self.assertEqual(self.parser.request(u'Failover.', conn), corenlp_json(u'Failover.'))
+        self.assertEqual(self.servers[0].requests, [u'Failover.'])
+        self.assertEqual(self.parser.launched, [0, 1, 1])
+        self.assertIsNot(self.parser.process_groups[1], processes[1])
+        self.assertGreater(self.parser._avoid_until[1], time.time())
+        self.assertEqual(self.parser._outstanding, [0, 0])
+
+        # Once no server responds, requests fail
+        self.servers[0].stop()
+        self.servers[0] = None
+        self.assertRaises(ValueError, self.parser.request, u'Failed.', conn)
+
+        processes = list(self.parser.process_groups)
+        self.parser.close()
+        self.assertEqual(self.parser.process_groups, [None, None])
+        for process in processes:
+            self.assertIsNotNone(process.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
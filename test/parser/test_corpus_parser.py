@@ -0,0 +1,154 @@
+from snorkel.models import Context, Document, Sentence, SnorkelSession
+from snorkel.parser import CorpusParser, ParseCache, Parser, ParserConnection, TextDocPreprocessor, corpus_parser
+from snorkel.parser.rule_parser import RegexTokenizer, RuleBasedParser
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+
+TEXTS = [
+    "The first document.\nIt has two sentences.",
+    "A second, longer document\nwith three lines\nof text.",
+    "One more.",
+]
+
+SENTENCE_COLUMNS = ['position', 'text', 'words', 'char_offsets', 'abs_char_offsets', 'lemmas', 'pos_tags',
+                    'ner_tags', 'dep_parents', 'dep_labels', 'entity_cids', 'entity_types']
+
+
+class CountingParser(RuleBasedParser):
+    """A RuleBasedParser which counts the documents it parses"""
+    def __init__(self):
+        super(CountingParser, self).__init__(tokenizer=RegexTokenizer(),
+                                             sent_boundary=RegexTokenizer("[\n\r]+"))
+        self.n_parsed = 0
+
+    def parse(self, document, text):
+        self.n_parsed += 1
+        return super(CountingParser, self).parse(document, text)
+
+
+class CommitCountingParser(RuleBasedParser):
+    """A RuleBasedParser which records the number of committed Documents before each parse"""
+    def __init__(self):
+        super(CommitCountingParser, self).__init__(tokenizer=RegexTokenizer(),
+                                                   sent_boundary=RegexTokenizer("[\n\r]+"))
+        self.n_committed = []
+
+    def parse(self, document, text):
+        session = SnorkelSession()
+        self.n_committed.append(session.query(Document).count())
+        session.close()
+        return super(CommitCountingParser, self).parse(document, text)
+
+
+class UnsignedParser(Parser):
+    """A parser which does not override signature"""
+    def __init__(self):
+        super(UnsignedParser, self).__init__(name='unsigned')
+
+    def connect(self):
+        return ParserConnection(self)
+
+
+class TestCorpusParser(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.session = SnorkelSession()
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.query(Context).delete()
+        cls.session.commit()
+        cls.session.close()
+        shutil.rmtree(cls.tmp_dir)
+
+    def _parse(self, bulk=False, parser=None, cache=None, docs=None, **kwargs):
+        self.session.query(Context).delete()
+        self.session.commit()
+
+        if docs is None:
+            docs = [(Document(name='doc%d' % i, stable_id='doc%d::document:0:0' % i, meta={'i': i}), text)
+                    for i, text in enumerate(TEXTS)]
+        parser = parser or RuleBasedParser(tokenizer=RegexTokenizer(), sent_boundary=RegexTokenizer("[\n\r]+"))
+        CorpusParser(parser=parser, bulk=bulk, cache=cache).apply(docs, parallelism=1, **kwargs)
+
+        # Compares rows by stable_id, since the two paths may assign different ids
+        contexts = sorted((c.type, c.stable_id) for c in self.session.query(Context))
+        documents = sorted((d.stable_id, d.name, d.meta) for d in self.session.query(Document))
+        sentences = sorted(
+            tuple([s.stable_id, s.document.stable_id] + [getattr(s, c) for c in SENTENCE_COLUMNS])
+            for s in self.session.query(Sentence))
+        return contexts, documents, sentences
+
+    def test_bulk_matches_orm(self):
+        contexts, documents, sentences = self._parse(bulk=False)
+        self.assertEqual(len(documents), 3)
+        self.assertEqual(len(sentences), 6)
+
+        bulk_contexts, bulk_documents, bulk_sentences = self._parse(bulk=True)
+        self.assertEqual(bulk_contexts, contexts)
+        self.assertEqual(bulk_documents, documents)
+        self.assertEqual(bulk_sentences, sentences)
+
+    def test_parse_cache(self):
+        expected = self._parse()
+        path = os.path.join(self.tmp_dir, 'parse_cache.db')
+
+        # Only the first run parses the documents
+        for n_parsed in (len(TEXTS), 0):
+            parser = CountingParser()
+            self.assertEqual(self._parse(parser=parser, cache=ParseCache(path)), expected)
+            self.assertEqual(parser.n_parsed, n_parsed)
+
+        stats = ParseCache(path).stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']),
+                         (len(TEXTS), len(TEXTS), len(TEXTS)))
+        conn = sqlite3.connect(path)
+        self.assertEqual(stats['size'], conn.execute('SELECT SUM(size) FROM parse').fetchone()[0])
+        conn.close()
+
+        # Least recently used entries are evicted down to max_size
+        cache = ParseCache(path, max_size=stats['size'] - 1)
+        self.assertEqual(self._parse(cache=cache), expected)
+        stats = cache.stats()
+        self.assertLess(stats['entries'], len(TEXTS))
+        self.assertLessEqual(stats['size'], cache.max_size)
+
+        # Parsers without their own signature are refused
+        self.assertRaises(ValueError, cache.key, UnsignedParser(), TEXTS[0])
+        self.assertNotEqual(cache.key(CountingParser(), TEXTS[0]),
+                            cache.key(RuleBasedParser(tokenizer=RegexTokenizer(r'\W+')), TEXTS[0]))
+
+    def test_shards(self):
+        txt_dir = os.path.join(self.tmp_dir, 'txt')
+        os.makedirs(txt_dir)
+        for i in range(7):
+            with open(os.path.join(txt_dir, 'doc%d.txt' % i), 'w') as f:
+                f.write(TEXTS[i % len(TEXTS)])
+        expected = self._parse(docs=TextDocPreprocessor(txt_dir))
+        self.assertEqual(len(expected[1]), 7)
+
+        commit_size = corpus_parser.SHARD_COMMIT_SIZE
+        try:
+            for bulk in (False, True):
+                corpus_parser.SHARD_COMMIT_SIZE = 2
+                self.assertEqual(self._parse(bulk=bulk, docs=TextDocPreprocessor(txt_dir), shards=3),
+                                 expected)
+
+                # Each document's Sentences are committed before the next one is parsed
+                corpus_parser.SHARD_COMMIT_SIZE = 1
+                parser = CommitCountingParser()
+                self.assertEqual(self._parse(bulk=bulk, parser=parser, docs=TextDocPreprocessor(txt_dir),
+                                             shards=3), expected)
+                self.assertEqual(parser.n_committed, list(range(7)))
+        finally:
+            corpus_parser.SHARD_COMMIT_SIZE = commit_size
+
+
+if __name__ == '__main__':
+    unittest.main()
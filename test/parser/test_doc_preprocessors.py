@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from snorkel.parser import TextDocPreprocessor, TSVDocPreprocessor, XMLMultiDocPreprocessor
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+
+XML_BODY = u''.join(u'<document><id>d%d</id><text>café %d</text></document>\n' % (i, i)
+                    for i in range(40))
+
+XML_FILES = {
+    'utf8.xml': (u'<?xml version="1.0" encoding="UTF-8"?>\n<root>\n' + XML_BODY + u'</root>\n').encode('utf-8'),
+    'no_declaration.xml': (u'<root>\n' + XML_BODY + u'</root>\n').encode('utf-8'),
+    'latin1.xml': (u'<?xml version="1.0" encoding="ISO-8859-1"?>\n<root>\n' + XML_BODY + u'</root>\n').encode('latin-1'),
+    'utf16.xml': (u'<?xml version="1.0" encoding="UTF-16"?>\n<root>\n' + XML_BODY + u'</root>\n').encode('utf-16'),
+    'dtd.xml': (u'<?xml version="1.0"?>\n<!DOCTYPE root [<!ENTITY e "entity">]>\n<root>\n' +
+                XML_BODY.replace(u'café', u'&e;') + u'</root>\n').encode('utf-8'),
+}
+
+
+def sharded_docs(preprocessor, n_shards):
+    return sorted((doc.name, text) for shard in preprocessor.shards(n_shards) for doc, text in shard)
+
+
+class TestDocPreprocessors(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        with io.open(os.path.join(cls.tmp_dir, 'docs.tsv'), 'w', encoding='utf-8') as f:
+            for i in range(100):
+                f.write(u'doc%d\thello wörld %d\n' % (i, i))
+        os.mkdir(os.path.join(cls.tmp_dir, 'txt'))
+        for i in range(23):
+            with io.open(os.path.join(cls.tmp_dir, 'txt', 'f%02d.txt' % i), 'w', encoding='utf-8') as f:
+                f.write(u'text %d' % i)
+        for name, data in XML_FILES.items():
+            with open(os.path.join(cls.tmp_dir, name), 'wb') as f:
+                f.write(data)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def assert_shards_match(self, preprocessor, n_docs):
+        expected = sorted((doc.name, text) for doc, text in preprocessor)
+        self.assertEqual(len(expected), n_docs)
+        for n_shards in (1, 2, 3, 7):
+            self.assertEqual(sharded_docs(preprocessor, n_shards), expected)
+
+    def test_tsv_shards(self):
+        self.assert_shards_match(TSVDocPreprocessor(os.path.join(self.tmp_dir, 'docs.tsv')), 100)
+
+    def test_text_shards(self):
+        self.assert_shards_match(TextDocPreprocessor(os.path.join(self.tmp_dir, 'txt')), 23)
+
+    def test_xml_shards(self):
+        for name in XML_FILES:
+            preprocessor = XMLMultiDocPreprocessor(os.path.join(self.tmp_dir, name))
+            self.assert_shards_match(preprocessor, 40)
+
+    def test_max_docs_shards(self):
+        preprocessor = TSVDocPreprocessor(os.path.join(self.tmp_dir, 'docs.tsv'), max_docs=31)
+        self.assertEqual(len(list(preprocessor)), 31)
+        for n_shards in (2, 3, 7):
+            self.assertEqual(len(sharded_docs(preprocessor, n_shards)), 31)
+
+
+if __name__ == '__main__':
+    unittest.main()
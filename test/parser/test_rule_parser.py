@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from snorkel.models import Document
+from snorkel.parser.rule_parser import RegexTokenizer, RuleBasedParser
+import re
+import unittest
+
+
+TEXTS = [
+    "The first document.\nIt has two sentences.",
+    "\n\nBlank lines\r\n\r\nand   extra   spaces  \n",
+    u"Caf\xe9, with an escaped\\nnewline",
+    "",
+    "One more.",
+]
+
+
+class ApplyOnlyTokenizer(object):
+    """A tokenizer which only implements apply"""
+    def __init__(self):
+        self.tokenizer = RegexTokenizer()
+
+    def apply(self, s):
+        return self.tokenizer.apply(s)
+
+
+class TestRuleBasedParser(unittest.TestCase):
+
+    def assert_batch_matches_parse(self, parser):
+        xs = [(Document(name='doc%d' % i, stable_id='doc%d::document:0:0' % i, meta={}), text)
+              for i, text in enumerate(TEXTS)]
+        expected = [parts for document, text in xs for parts in parser.parse(document, text)]
+        self.assertGreater(len(expected), 0)
+        for size in (1, 2, len(xs)):
+            parsed = [parts for i in range(0, len(xs), size) for parts in parser.parse_batch(xs[i:i+size])]
+            self.assertEqual(parsed, expected)
+
+    def test_parse_batch(self):
+        self.assert_batch_matches_parse(
+            RuleBasedParser(tokenizer=RegexTokenizer(), sent_boundary=RegexTokenizer("[\n\r]+")))
+        self.assert_batch_matches_parse(
+            RuleBasedParser(tokenizer=ApplyOnlyTokenizer(), sent_boundary=RegexTokenizer("[\n\r]+")))
+
+    def test_to_unicode(self):
+        parser = RuleBasedParser(tokenizer=RegexTokenizer(), sent_boundary=RegexTokenizer("[\n\r]+"))
+        self.assertEqual(parser.to_unicode(u"Caf\xe9\\n"), u"Caf\xe9\\n")
+        self.assertEqual(parser.to_unicode(u"Caf\xe9\\n".encode('utf-8')), u"Caf\xe9\\n")
+
+    def test_regex_tokenizer_offsets(self):
+        texts = [u"Tokens, and more tokens.", u"", u"  spaced  out  ", u",,leading, and,,repeated,,",
+                 u"no-separators", u".", u"Caf\xe9 au\tlait\n"]
+        for rgx in (r"\s+", r"[\s,.]+", r"[,.]"):
+            tokenizer = RegexTokenizer(rgx)
+            for s in texts:
+                tokens = tokenizer.apply(s)
+                for tok, off in tokens:
+                    self.assertGreater(len(tok), 0)
+                    self.assertEqual(s[off:off+len(tok)], tok)
+
+                # The tokens are the non-empty pieces between the separators, in order
+                self.assertEqual([tok for tok, _ in tokens], [tok for tok in re.split(rgx, s) if tok])
+                offsets = [off for _, off in tokens]
+                self.assertEqual(offsets, sorted(set(offsets)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from six.moves import cPickle as pickle
+from snorkel import sentence_store
+from snorkel.models import Context, Document, Sentence, SnorkelSession
+from snorkel.sentence_store import SentenceStore, export_sentences
+import os
+import shutil
+import tempfile
+import unittest
+
+
+SENTENCES = [
+    [u'The', u'quick', u'brown', u'fox'],
+    [u'Caf\xe9', u'au', u'lait'],
+    [u'One', u'more', u'sentence', u'here', u'.'],
+]
+
+SENTENCE_COLUMNS = ['document_id', 'position', 'stable_id', 'text'] + \
+                   [name for name, _ in sentence_store.SENTENCE_ARRAY_FIELDS]
+
+
+def sentence_row(sentence):
+    return tuple([sentence.id, sentence.document.name] + [getattr(sentence, c) for c in SENTENCE_COLUMNS])
+
+
+@unittest.skipIf(sentence_store.pa is None, "pyarrow is not installed")
+class TestSentenceStore(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.session = SnorkelSession()
+        cls.session.query(Context).delete()
+        for i in range(5):
+            document = Document(name='doc%d' % i, stable_id='doc%d::document:0:0' % i, meta={'i': i})
+            cls.session.add(document)
+            for position, words in enumerate(SENTENCES[:i % 3 + 1]):
+                offsets = [sum(len(w) + 1 for w in words[:j]) for j in range(len(words))]
+                cls.session.add(Sentence(document=document, position=position, text=u' '.join(words),
+                    words=words, char_offsets=offsets, abs_char_offsets=offsets, lemmas=words,
+                    pos_tags=[u'NN'] * len(words), ner_tags=[u'O'] * len(words),
+                    dep_parents=[0] * len(words), dep_labels=[u'dep'] * len(words),
+                    entity_cids=[u'O'] * len(words), entity_types=[u'O'] * len(words),
+                    stable_id='doc%d::sentence:%d:%d' % (i, position, position + 1)))
+        cls.session.commit()
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.query(Context).delete()
+        cls.session.commit()
+        cls.session.close()
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_export(self):
+        path = os.path.join(self.tmp_dir, 'sentences.arrow')
+        expected = [sentence_row(s) for s in
+                    self.session.query(Sentence).order_by(Sentence.document_id, Sentence.position)]
+
+        # Write and read several batches of sentences and documents
+        select_batch_size = sentence_store.DOCUMENT_SELECT_BATCH_SIZE
+        read_batch_size = sentence_store.READ_BATCH_SIZE
+        sentence_store.DOCUMENT_SELECT_BATCH_SIZE = 2
+        sentence_store.READ_BATCH_SIZE = 2
+        try:
+            self.assertEqual(export_sentences(self.session, path, batch_size=3), len(expected))
+            store = SentenceStore(path)
+            self.assertEqual(len(store), len(expected))
+            self.assertEqual([sentence_row(s) for s in store], expected)
+            self.assertEqual([sentence_row(s) for d in store.documents() for s in d.sentences], expected)
+        finally:
+            sentence_store.DOCUMENT_SELECT_BATCH_SIZE = select_batch_size
+            sentence_store.READ_BATCH_SIZE = read_batch_size
+
+        documents = dict((d.name, d) for d in store.documents())
+        for document in self.session.query(Document):
+            self.assertEqual(documents[document.name].meta, document.meta)
+            self.assertEqual(documents[document.name].id, document.id)
+
+        ids = [expected[1][0], expected[-1][0], -1]
+        sentences = store.get(ids)
+        self.assertTrue(ids[0] in sentences and ids[1] in sentences)
+        self.assertFalse(-1 in sentences)
+        self.assertEqual(sentence_row(sentences[ids[0]]), expected[1])
+        self.assertEqual(store.get([]), {})
+
+        store = pickle.loads(pickle.dumps(store, 2))
+        self.assertEqual([sentence_row(s) for s in store], expected)
+
+    def test_empty_export(self):
+        path = os.path.join(self.tmp_dir, 'empty.arrow')
+        sentences = self.session.query(Sentence).filter(Sentence.id < 0)
+        self.assertEqual(export_sentences(self.session, path, sentences=sentences), 0)
+        store = SentenceStore(path)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store), [])
+        self.assertEqual(list(store.documents()), [])
+        self.assertEqual(store.get([1, 2]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()